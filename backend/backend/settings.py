@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'myapp.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -151,6 +152,137 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # 文件上传设置
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
+# 上传时边接收边计算SHA-256，PDF按内容哈希存储，相同内容只保存和索引一次
+FILE_UPLOAD_HANDLERS = [
+    'myapp.storage.HashingMemoryFileUploadHandler',
+    'myapp.storage.HashingTemporaryFileUploadHandler',
+]
+
+# PDF文本提取：页数达到阈值时按页范围分发到进程池
+PDF_EXTRACT_WORKERS = 4  # 实际不超过CPU核数
+PDF_EXTRACT_POOL_THRESHOLD = 100  # 页
+PDF_EXTRACT_PAGES_PER_TASK = 20
+
+# 文本分段
+CHUNK_STRATEGY = 'sentence'  # myapp.chunking.CHUNKERS中注册的分段器
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 0  # 相邻分段重叠的大小（与CHUNK_UNIT同单位）
+CHUNK_UNIT = 'chars'  # 'chars'：字符数；'tokens'：估算token数
+
+# FAISS索引进程内缓存
+FAISS_INDEX_CACHE_SIZE = 32  # 最多缓存的文档数
+FAISS_INDEX_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 估算内存上限
+
+# 文档向量索引类型：flat（原始float32）、fp16、sq8（int8）、pq
+# 体积与召回率对比：python manage.py run_benchmarks --index-types
+# sq8体积约1/4且召回率接近flat；pq更小但召回率明显下降，只适合分段很多的文档
+FAISS_INDEX_TYPE = 'flat'
+FAISS_PQ_M = 64  # PQ子空间数，需整除向量维度
+FAISS_PQ_NBITS = 8
+FAISS_INDEX_MIGRATE_ON_LOAD = True  # 加载到旧的flat索引时按FAISS_INDEX_TYPE重建并写回
+
+# prompt上下文：按token预算挑选最有代表性的分段
+# 预算 = min(PROMPT_CONTEXT_MAX_TOKENS, 上下文窗口 - max_tokens - 模板 - 余量)
+PROMPT_CONTEXT_MAX_TOKENS = 3000
+PROMPT_CONTEXT_DIVERSITY = 0.5  # 0只看代表性，越大越偏向覆盖不同内容
+MODEL_CONTEXT_WINDOWS = {  # 按模型名最长前缀匹配
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'claude': 200000,
+    'deepseek': 64000,
+    'qwen': 32768,
+}
+MODEL_CONTEXT_WINDOW_DEFAULT = 8192
+
+# 长文档处理模式：single（一次调用）、map_reduce（分组摘要后合并）、
+# auto（分段超出上下文预算时使用map_reduce）；请求中的mode参数优先
+PROCESS_MODE = 'single'
+MAP_REDUCE_GROUP_TOKENS = 3000  # map阶段每组分段的token上限
+MAP_REDUCE_CONCURRENCY = 4  # 同时进行的map调用数
+MAP_REDUCE_MAX_TOKENS = 500  # 每组摘要的max_tokens
+MAP_REDUCE_TEMPERATURE = 0.3
+
+# 合并并发的重复请求：相同文档+任务+配置的处理、同一文档的索引构建和PDF解析
+# 同时只执行一次（进程内用Event，跨进程用 BASE_DIR/singleflight 下的文件锁）
+SINGLE_FLIGHT_ENABLED = True
+
+# 跨文档全局向量索引（faiss_index/global.index）
+GLOBAL_INDEX_ENABLED = True
+GLOBAL_INDEX_NLIST = 100  # IVF聚类数
+GLOBAL_INDEX_NPROBE = 8  # 查询时扫描的聚类数
+GLOBAL_INDEX_TRAIN_THRESHOLD = None  # 向量数达到该值后迁移到IVF，默认 NLIST*39
+GLOBAL_INDEX_COMPACT_RATIO = 0.5  # 增量日志超过快照大小的该比例时合并写回快照
+
+# 上游AI接口HTTP连接池（按base_url共享）
+AI_HTTP_POOL_CONNECTIONS = 4  # 每个Session缓存的主机连接池数
+AI_HTTP_POOL_MAXSIZE = 20  # 每个主机保持的最大keep-alive连接数
+AI_HTTP_POOL_BLOCK = False  # 连接池满时是否阻塞等待
+
+# 上游限流（每个AIConfig独立计数），统计见 /api/upstream-stats/
+AI_RATE_LIMIT_RPS = 0  # 每秒请求数，0表示不限速；按服务商配额设置
+AI_RATE_LIMIT_BURST = 10  # 令牌桶容量，允许的瞬时突发
+AI_MAX_CONCURRENCY = 8  # 同时在途的上游请求数（对话、嵌入、流式共用）
+AI_RETRY_MAX = 3  # 429/5xx/超时/连接错误的最大重试次数
+AI_RETRY_BACKOFF_BASE = 0.5  # 指数退避基数（秒），带随机抖动；有Retry-After时优先遵守
+AI_RETRY_BACKOFF_MAX = 20.0
+AI_REQUEST_DEADLINE = 120.0  # 单次调用的总时限（秒），包含排队、重试和等待
+
+# 进程内指标，Prometheus从 /metrics 抓取（多进程部署时每个进程单独抓取）
+METRICS_ENABLED = True  # 关闭后不再记录，/metrics返回404
+
+# 按需剖析：管理员请求带 X-Profile: 1 头或 ?profile=1，结果见 /api/profiles/
+PROFILE_TOKEN = ''  # 非空时带 X-Profile-Token 头的请求也视为管理员
+PROFILE_SAMPLE_RATE = 0.0  # 对下列路径的请求按比例抽样剖析，0表示不抽样
+PROFILE_SAMPLE_PATHS = ['/api/process/', '/api/async/process/']
+PROFILE_KEEP = 50  # 保留最近的剖析数
+PROFILE_DIR = None  # 默认 BASE_DIR/profiles
+
+# ASGI下的异步接口（/api/async/...），需要安装httpx，例如：uvicorn backend.asgi:application
+AI_ASYNC_MAX_CONNECTIONS = 500  # 每个事件循环中每个上游的最大并发连接数
+ASYNC_BLOCKING_WORKERS = 4  # PDF解析、嵌入、FAISS等阻塞步骤使用的线程数
+
+# 嵌入请求分批
+EMBEDDING_BATCH_SIZE = 64  # 每次请求的文本段数
+EMBEDDING_MAX_CONCURRENCY = 4  # 同时进行的批次数
+
+# 嵌入向量本地缓存（SQLite，按模型和文本哈希存储）
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = None  # 默认为 BASE_DIR/embedding_cache.sqlite3
+
+# 激活AI配置的缓存：每隔多少秒检查一次跨进程版本戳
+AI_CONFIG_STAMP_CHECK_INTERVAL = 1.0
+AI_CONFIG_STAMP_PATH = None  # 默认为 BASE_DIR/.aiconfig_version
+
+# 文档处理任务队列（python manage.py process_jobs 启动worker）
+PROCESS_JOB_WORKERS = 2  # worker并发执行的任务数
+PROCESS_JOB_QUEUE_LIMIT = 100  # 最多排队的任务数，0表示不限制
+PROCESS_JOB_LOCK_PATH = None  # 排队计数的跨进程锁，默认为 BASE_DIR/.job_queue.lock
+PROCESS_JOB_TIMEOUT = 30 * 60  # 任务开始后超过该秒数仍未完成视为worker已崩溃，重新排队；0表示不回收
+
+# LLM结果缓存（summary/analysis/questions）
+RESULT_CACHE_TTL = 24 * 60 * 60  # 秒
+RESULT_CACHE_MAX_ENTRIES = 1000
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'llm-results',
+        'TIMEOUT': RESULT_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': RESULT_CACHE_MAX_ENTRIES},
+    },
+}
+
+# 上传PDF后后台预处理（提取、分段、建索引）
+INGEST_BACKEND = 'thread'  # 'thread'：本进程线程池；'queue'：交给process_jobs worker；None：关闭
+INGEST_WORKERS = 2
+
+# 模拟模式下流式输出每段之间的间隔（秒）
+SIMULATION_STREAM_DELAY = 0.02
 
 
 
@@ -1,63 +1,153 @@
 import os
+import asyncio
+import functools
+import contextvars
 import requests
 import faiss
 import numpy as np
-import PyPDF2
-import re
 from django.conf import settings
 import json
 import uuid
+import hashlib
 from pathlib import Path
 import time
+import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from .caches import index_cache, get_result_cache
+from asgiref.sync import sync_to_async
+from .http_client import get_async_client, httpx
+from .upstream import aupstream_post, upstream_post
+from .pdf_extract import iter_page_texts
+from .chunking import clean_text, estimate_tokens, get_chunker
+from .global_index import get_global_index
+from .chunk_store import ChunkStore, write_chunks
+from .index_types import build_index, index_type_of
+from .singleflight import get_single_flight
+from .context_packer import context_budget, context_window, group_chunks, select_chunks
+from .embedding_store import get_embedding_store, text_hash
+from .metrics import CACHE_REQUESTS, STAGE_SECONDS, enabled as metrics_enabled, record_usage
+from .profiling import record_stage
 
-class DocumentProcessor:
-    def __init__(self):
-        self.vector_dim = 1536
-        self.index_path = Path(settings.BASE_DIR) / "faiss_index"
-        self.index_path.mkdir(exist_ok=True)
+# 分段算法有变化时递增，使旧的文本缓存自动失效
+CHUNKER_VERSION = 3
+# prompt模板有变化时递增，使旧的结果缓存自动失效
+PROMPT_TEMPLATE_VERSION = 2
+# map阶段prompt变化时递增，旧的分段摘要缓存随之失效
+MAP_TEMPLATE_VERSION = 1
+PROCESS_MODES = ('single', 'map_reduce', 'auto')
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_write_json(path, data):
+    """先写临时文件再替换，避免并发读到写了一半的文件"""
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _timed_iter(iterable, elapsed):
+    """逐项迭代，把取下一项花费的时间累加到elapsed[0]"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            elapsed[0] += time.perf_counter() - start
+        yield item
+
+
+def _load_active_config():
+    """从数据库或环境变量读取当前激活的配置"""
+    from .models import AIConfig
+    active_config = AIConfig.objects.filter(is_active=True).first()
     
-    def _get_active_config(self):
-        """获取当前激活的配置"""
+    if active_config and active_config.api_key:
+        return {
+            'api_key': active_config.api_key,
+            'base_url': active_config.base_url.rstrip('/'),  # 移除末尾斜杠
+            'model_name': active_config.model_name,
+            'embedding_model': active_config.embedding_model,
+            'temperature': active_config.temperature,
+            'max_tokens': active_config.max_tokens,
+            'simulation_mode': False
+        }
+    else:
+        api_key = os.getenv('AIHUBMIX_API_KEY')
+        base_url = os.getenv('AIHUBMIX_BASE_URL')
+        
+        if not api_key or not base_url:
+            print("警告: 未找到AI配置，将使用模拟模式")
+            return {
+                'api_key': '',
+                'base_url': '',
+                'model_name': 'gpt-3.5-turbo',
+                'embedding_model': 'text-embedding-ada-002',
+                'temperature': 0.7,
+                'max_tokens': 2000,
+                'simulation_mode': True
+            }
+        else:
+            return {
+                'api_key': api_key,
+                'base_url': base_url.rstrip('/'),
+                'model_name': 'gpt-3.5-turbo',
+                'embedding_model': 'text-embedding-ada-002',
+                'temperature': 0.7,
+                'max_tokens': 2000,
+                'simulation_mode': False
+            }
+
+
+# 进程内配置缓存；stamp为跨进程版本戳，其他进程修改配置后据此失效
+_config_cache = {'config': None, 'stamp': None, 'checked_at': 0.0}
+_config_lock = threading.Lock()
+
+
+def _config_stamp_file():
+    return Path(getattr(settings, 'AI_CONFIG_STAMP_PATH', None)
+                or Path(settings.BASE_DIR) / ".aiconfig_version")
+
+
+def _read_config_stamp():
+    try:
+        return _config_stamp_file().read_text(encoding='utf-8')
+    except OSError:
+        return None
+
+
+def get_active_config():
+    """获取当前激活的配置，命中缓存时只是一次字典读取
+
+    每隔AI_CONFIG_STAMP_CHECK_INTERVAL秒检查一次跨进程版本戳。
+    """
+    interval = getattr(settings, 'AI_CONFIG_STAMP_CHECK_INTERVAL', 1.0)
+    now = time.monotonic()
+    config = _config_cache['config']
+    if config is not None and now - _config_cache['checked_at'] < interval:
+        return config
+    
+    with _config_lock:
+        stamp = _read_config_stamp()
+        config = _config_cache['config']
+        if config is not None and stamp == _config_cache['stamp']:
+            _config_cache['checked_at'] = now
+            return config
+        
         try:
-            from .models import AIConfig
-            active_config = AIConfig.objects.filter(is_active=True).first()
-            
-            if active_config and active_config.api_key:
-                return {
-                    'api_key': active_config.api_key,
-                    'base_url': active_config.base_url.rstrip('/'),  # 移除末尾斜杠
-                    'model_name': active_config.model_name,
-                    'embedding_model': active_config.embedding_model,
-                    'temperature': active_config.temperature,
-                    'max_tokens': active_config.max_tokens,
-                    'simulation_mode': False
-                }
-            else:
-                api_key = os.getenv('AIHUBMIX_API_KEY')
-                base_url = os.getenv('AIHUBMIX_BASE_URL')
-                
-                if not api_key or not base_url:
-                    print("警告: 未找到AI配置，将使用模拟模式")
-                    return {
-                        'api_key': '',
-                        'base_url': '',
-                        'model_name': 'gpt-3.5-turbo',
-                        'embedding_model': 'text-embedding-ada-002',
-                        'temperature': 0.7,
-                        'max_tokens': 2000,
-                        'simulation_mode': True
-                    }
-                else:
-                    return {
-                        'api_key': api_key,
-                        'base_url': base_url.rstrip('/'),
-                        'model_name': 'gpt-3.5-turbo',
-                        'embedding_model': 'text-embedding-ada-002',
-                        'temperature': 0.7,
-                        'max_tokens': 2000,
-                        'simulation_mode': False
-                    }
-                    
+            config = _load_active_config()
         except Exception as e:
             print(f"加载AI配置失败: {e}, 使用环境变量")
             api_key = os.getenv('AIHUBMIX_API_KEY')
@@ -72,53 +162,270 @@ class DocumentProcessor:
                 'max_tokens': 2000,
                 'simulation_mode': not (api_key and base_url)
             }
+        
+        _config_cache.update(config=config, stamp=stamp, checked_at=now)
+        return config
+
+
+def invalidate_active_config():
+    """AIConfig变更后调用：清空本进程缓存并更新跨进程版本戳"""
+    with _config_lock:
+        _config_cache['config'] = None
+        stamp_file = _config_stamp_file()
+        tmp_path = stamp_file.with_name(f"{stamp_file.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_path.write_text(uuid.uuid4().hex, encoding='utf-8')
+            os.replace(tmp_path, stamp_file)
+        except OSError as e:
+            print(f"写入配置版本戳失败: {e}")
+
+
+# 异步请求内固定使用的配置；_run_blocking复制上下文，线程池中的同步步骤同样可见
+_request_config = contextvars.ContextVar('request_config', default=None)
+
+
+class LLMStreamError(Exception):
+    """流式调用上游失败"""
+
+
+class DocumentProcessor:
+    def __init__(self):
+        self.vector_dim = 1536
+        self.chunk_strategy = getattr(settings, 'CHUNK_STRATEGY', 'sentence')
+        self.chunk_size = getattr(settings, 'CHUNK_SIZE', 400)
+        self.chunk_overlap = getattr(settings, 'CHUNK_OVERLAP', 0)
+        self.chunk_unit = getattr(settings, 'CHUNK_UNIT', 'chars')
+        self.stage_timings = {}
+        self.cache_info = {}
+        self.last_llm_ok = False
+        self.last_error = None  # process_document失败时的错误信息
+        self.upstream_failed = False  # 失败是否来自上游接口
+        self.pdf_extract_workers = getattr(settings, 'PDF_EXTRACT_WORKERS', 4)
+        self.pdf_pool_threshold = getattr(settings, 'PDF_EXTRACT_POOL_THRESHOLD', 100)
+        self.pdf_pages_per_task = getattr(settings, 'PDF_EXTRACT_PAGES_PER_TASK', 20)
+        self.embedding_batch_size = getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+        self.embedding_concurrency = getattr(settings, 'EMBEDDING_MAX_CONCURRENCY', 4)
+        self.index_path = Path(settings.BASE_DIR) / "faiss_index"
+        self.index_path.mkdir(exist_ok=True)
+        self.text_cache_path = Path(settings.BASE_DIR) / "text_cache"
+        self.text_cache_path.mkdir(exist_ok=True)
+        self.process_mode = getattr(settings, 'PROCESS_MODE', 'single')
+        self.map_group_tokens = getattr(settings, 'MAP_REDUCE_GROUP_TOKENS', 3000)
+        self.map_concurrency = getattr(settings, 'MAP_REDUCE_CONCURRENCY', 4)
+        self.map_max_tokens = getattr(settings, 'MAP_REDUCE_MAX_TOKENS', 500)
+        self.map_temperature = getattr(settings, 'MAP_REDUCE_TEMPERATURE', 0.3)
+        self.context_max_tokens = getattr(settings, 'PROMPT_CONTEXT_MAX_TOKENS', 3000)
+        self.context_diversity = getattr(settings, 'PROMPT_CONTEXT_DIVERSITY', 0.5)
+        self.index_type = getattr(settings, 'FAISS_INDEX_TYPE', 'flat')
+        self.pq_m = getattr(settings, 'FAISS_PQ_M', 64)
+        self.pq_nbits = getattr(settings, 'FAISS_PQ_NBITS', 8)
+        self.migrate_on_load = getattr(settings, 'FAISS_INDEX_MIGRATE_ON_LOAD', True)
+        self.single_flight = None
+        if getattr(settings, 'SINGLE_FLIGHT_ENABLED', True):
+            self.single_flight = get_single_flight(Path(settings.BASE_DIR) / "singleflight")
+        self.global_index = None
+        if getattr(settings, 'GLOBAL_INDEX_ENABLED', True):
+            self.global_index = get_global_index(self.index_path, self.vector_dim)
+        self.embedding_store = None
+        if getattr(settings, 'EMBEDDING_CACHE_ENABLED', True):
+            self.embedding_store = get_embedding_store(
+                getattr(settings, 'EMBEDDING_CACHE_PATH', None)
+                or Path(settings.BASE_DIR) / "embedding_cache.sqlite3"
+            )
+    
+    def _get_active_config(self):
+        """获取当前激活的配置（进程内缓存，AIConfig变更时失效）"""
+        config = _request_config.get()
+        return config if config is not None else get_active_config()
+    
+    def iter_pdf_pages(self, pdf_path):
+        """按页yield PDF文本，大文件使用进程池并行解析"""
+        return iter_page_texts(
+            pdf_path,
+            workers=self.pdf_extract_workers,
+            pool_threshold=self.pdf_pool_threshold,
+            pages_per_task=self.pdf_pages_per_task,
+        )
     
     def extract_text_from_pdf(self, pdf_path):
         """从PDF提取文本"""
         try:
-            with open(pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            return "".join(page + "\n" for page in self.iter_pdf_pages(pdf_path))
         except Exception as e:
             print(f"PDF提取错误: {e}")
             return ""
     
     def clean_text(self, text):
         """清洗文本"""
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'[^\w\s\u4e00-\u9fff，。！？；：""''（）《》]', '', text)
-        return text.strip()
+        return clean_text(text)
+    
+    def get_chunker(self, chunk_size=None):
+        """按当前分段配置创建分段器"""
+        return get_chunker(
+            self.chunk_strategy,
+            max_size=chunk_size or self.chunk_size,
+            overlap=self.chunk_overlap,
+            unit=self.chunk_unit,
+        )
     
-    def chunk_text(self, text, chunk_size=400):
+    def chunk_text(self, text, chunk_size=None):
         """文本分段"""
-        sentences = re.split(r'[。！？]', text)
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in sentences:
-            if len(current_chunk + sentence) < chunk_size:
-                current_chunk += sentence + "。"
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + "。"
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        return chunks
+        return [chunk.text for chunk in self.get_chunker(chunk_size).chunk_text(text)]
     
+    @contextmanager
+    def _stage(self, name):
+        """记录处理阶段耗时（秒）"""
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_timings[name] = round(elapsed, 4)
+            STAGE_SECONDS.observe(elapsed, stage=name)
+            record_stage(name, elapsed, time.thread_time() - cpu_start)
+
+    def _chunker_signature(self):
+        """分段参数签名，作为文本缓存键的一部分"""
+        return f"v{CHUNKER_VERSION}-{self.get_chunker().signature()}"
+
+    def _text_cache_file(self, content_hash):
+        return self.text_cache_path / f"{content_hash}_{self._chunker_signature()}.json"
+
+    def load_chunks(self, pdf_path, content_hash=None):
+        """获取PDF的分段文本，优先读取按内容哈希缓存的结果"""
+        return [record['text'] for record in self.load_chunk_records(pdf_path, content_hash)]
+
+    def load_chunk_records(self, pdf_path, content_hash=None):
+        """获取带页码和偏移量的分段记录，缓存未命中时按页流式解析"""
+        if not content_hash:
+            content_hash = file_sha256(pdf_path)
+        cache_file = self._text_cache_file(content_hash)
+
+        records = self._read_text_cache(cache_file)
+        CACHE_REQUESTS.inc(cache='text', status='miss' if records is None else 'hit')
+        if records is not None:
+            return records
+        if self.single_flight is None:
+            return self._extract_chunk_records(pdf_path, cache_file)
+        # 同一文件同时只解析一次，等待者直接读取解析结果
+        with self.single_flight.lock(f"text:{cache_file}"):
+            records = self._read_text_cache(cache_file)
+            if records is not None:
+                return records
+            return self._extract_chunk_records(pdf_path, cache_file)
+
+    @staticmethod
+    def _read_text_cache(cache_file):
+        if not cache_file.exists():
+            return None
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"文本缓存读取失败，重新解析PDF: {e}")
+            return None
+
+    def _extract_chunk_records(self, pdf_path, cache_file):
+        # 解析和分段按页交替进行：取下一页的时间计入extract，其余计入chunk
+        extract_seconds = [0.0]
+        pages = self.iter_pdf_pages(pdf_path)
+        if metrics_enabled():
+            pages = _timed_iter(pages, extract_seconds)
+        start = time.perf_counter()
+        try:
+            records = [chunk.to_dict() for chunk in self.get_chunker().chunk_pages(pages)]
+        except Exception as e:
+            print(f"PDF提取错误: {e}")
+            return []
+        STAGE_SECONDS.observe(extract_seconds[0], stage='extract')
+        STAGE_SECONDS.observe(time.perf_counter() - start - extract_seconds[0], stage='chunk')
+        if records:
+            _atomic_write_json(cache_file, records)
+        return records
+
+    def invalidate_document(self, document_id, pdf_path=None):
+        """删除文档对应的向量索引和文本缓存"""
+        index_cache.invalidate(self.index_path / f"{document_id}.index")
+        if str(document_id).isdigit():
+            self.remove_global_entries(document_id)
+        for path in (self.index_path / f"{document_id}.index",
+                     self.index_path / f"{document_id}.chunks",
+                     self.index_path / f"{document_id}_chunks.json"):
+            if path.exists():
+                path.unlink()
+
+        if pdf_path and os.path.isfile(pdf_path):
+            content_hash = file_sha256(pdf_path)
+            for cache_file in self.text_cache_path.glob(f"{content_hash}_*.json"):
+                cache_file.unlink()
+
     def get_embeddings(self, texts):
-        """获取文本嵌入向量"""
+        """获取文本嵌入向量，只把本地缓存未命中的文本发往上游"""
         config = self._get_active_config()
         
         if config['simulation_mode']:
             print("模拟模式: 生成随机嵌入向量")
             return [np.random.rand(self.vector_dim).tolist() for _ in texts]
-            
+        
+        if self.embedding_store is None:
+            return self._fetch_embeddings(config, texts)
+        
+        model = config['embedding_model']
+        hashes = [text_hash(text) for text in texts]
+        try:
+            cached = self.embedding_store.get_many(model, hashes)
+        except Exception as e:
+            print(f"嵌入缓存读取失败: {e}")
+            cached = {}
+        
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        
+        CACHE_REQUESTS.inc(len(texts) - len(missing), cache='embedding', status='hit')
+        CACHE_REQUESTS.inc(len(missing), cache='embedding', status='miss')
+        if missing:
+            print(f"嵌入缓存命中{len(texts) - len(missing)}/{len(texts)}")
+            fetched = self._fetch_embeddings(config, list(missing.values()))
+            if fetched is None:
+                return None
+            new_items = list(zip(missing.keys(), fetched))
+            cached.update(new_items)
+            try:
+                self.embedding_store.put_many(model, new_items)
+            except Exception as e:
+                print(f"嵌入缓存写入失败: {e}")
+        
+        return [cached[key] for key in hashes]
+    
+    def _fetch_embeddings(self, config, texts):
+        """分批并发请求上游，按原顺序返回"""
+        batch_size = max(1, self.embedding_batch_size)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) <= 1:
+            return self._embed_batch(config, texts)
+        
+        print(f"嵌入请求分为{len(batches)}批，并发数{self.embedding_concurrency}")
+        workers = max(1, min(self.embedding_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda batch: self._embed_batch(config, batch), batches
+            ))
+        
+        if any(result is None for result in results):
+            return None
+        return [embedding for result in results for embedding in result]
+    
+    def _embed_batch(self, config, texts):
+        """请求一批嵌入；429/5xx和网络错误已由upstream_post在同一截止时间内只重试该批"""
+        embeddings = self._request_embeddings(config, texts)
+        if embeddings is None:
+            self.upstream_failed = True
+        return embeddings
+    
+    def _request_embeddings(self, config, texts):
+        """发送一次嵌入请求"""
         try:
             headers = {
                 "Authorization": f"Bearer {config['api_key']}",
@@ -131,73 +438,170 @@ class DocumentProcessor:
             }
             
             print(f"调用嵌入API: {config['base_url']}/embeddings")
-            response = requests.post(
-                f"{config['base_url']}/embeddings",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'data' in result:
-                    return [item['embedding'] for item in result['data']]
-                else:
-                    print(f"嵌入API响应格式异常: {result}")
-                    return None
-            else:
-                print(f"嵌入API错误: {response.status_code} - {response.text}")
-                return None
+            with upstream_post(config, "embeddings", data, timeout=30, headers=headers) as response:
+                return self._embedding_result(response, texts, config)
                 
         except Exception as e:
             print(f"获取embedding失败: {e}")
             return None
     
-    def create_faiss_index(self, document_id, chunks):
-        """创建FAISS向量索引"""
+    def _embedding_result(self, response, texts, config):
+        """解析嵌入响应，失败返回None"""
+        if response.status_code == 200:
+            result = response.json()
+            record_usage(config['embedding_model'], result.get('usage'))
+            if 'data' in result:
+                items = sorted(result['data'], key=lambda item: item.get('index', 0))
+                if len(items) != len(texts):
+                    print(f"嵌入API返回数量不符: {len(items)}/{len(texts)}")
+                    return None
+                return [item['embedding'] for item in items]
+            else:
+                print(f"嵌入API响应格式异常: {result}")
+                return None
+        else:
+            print(f"嵌入API错误: {response.status_code} - {response.text}")
+            return None
+    
+    def create_faiss_index(self, document_id, chunks, global_id=None):
+        """创建FAISS向量索引
+
+        document_id是索引文件的命名键（内容寻址的文档为内容哈希），
+        global_id为全局索引中记录的文档id，默认与数字形式的document_id相同。
+        """
         if not chunks:
             return False
         
-        embeddings = self.get_embeddings(chunks)
+        with STAGE_SECONDS.time(stage='embed'):
+            embeddings = self.get_embeddings(chunks)
         if not embeddings:
             return False
         
-        index = faiss.IndexFlatIP(self.vector_dim)
         embeddings_np = np.array(embeddings).astype('float32')
-        index.add(embeddings_np)
-        
         index_file = self.index_path / f"{document_id}.index"
-        chunks_file = self.index_path / f"{document_id}_chunks.json"
+        with STAGE_SECONDS.time(stage='index_build'):
+            index = self._build_index(embeddings_np)
+            self._write_index(index, index_file)
+            write_chunks(self.index_path / f"{document_id}.chunks", chunks)
+        legacy_file = self.index_path / f"{document_id}_chunks.json"
+        if legacy_file.exists():
+            legacy_file.unlink()
+        index_cache.invalidate(index_file)
         
-        faiss.write_index(index, str(index_file))
-        with open(chunks_file, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, ensure_ascii=False)
+        if global_id is None and str(document_id).isdigit():
+            global_id = document_id
+        if self.global_index is not None and global_id is not None:
+            try:
+                self.global_index.add_document(global_id, embeddings_np)
+            except Exception as e:
+                print(f"更新全局索引失败: {e}")
         
         return True
     
+    def _build_index(self, embeddings_np):
+        """按FAISS_INDEX_TYPE创建文档索引"""
+        return build_index(embeddings_np, self.index_type, self.pq_m, self.pq_nbits)
+    
+    @staticmethod
+    def _write_index(index, index_file):
+        """先写临时文件再替换，读者不会看到写了一半的索引"""
+        tmp_file = index_file.with_name(f"{index_file.name}.{uuid.uuid4().hex}.tmp")
+        faiss.write_index(index, str(tmp_file))
+        os.replace(tmp_file, index_file)
+    
+    def _migrate_index(self, index, index_file):
+        """旧的flat索引按当前FAISS_INDEX_TYPE重建并写回（只从无损的flat迁移）"""
+        if (not self.migrate_on_load or self.index_type == 'flat'
+                or index_type_of(index) != 'flat' or index.ntotal == 0):
+            return index
+        try:
+            migrated = self._build_index(index.reconstruct_n(0, index.ntotal))
+            self._write_index(migrated, index_file)
+            print(f"索引已迁移为{index_type_of(migrated)}: {index_file.name}")
+            return migrated
+        except Exception as e:
+            print(f"索引迁移失败: {e}")
+            return index
+    
+    def _chunks_file(self, document_id):
+        """分段文件路径；尚未迁移的旧文档回退到 {id}_chunks.json"""
+        chunks_file = self.index_path / f"{document_id}.chunks"
+        legacy_file = self.index_path / f"{document_id}_chunks.json"
+        if not chunks_file.exists() and legacy_file.exists():
+            return legacy_file
+        return chunks_file
+    
+    def ensure_index(self, document_id, chunks, global_id=None):
+        """索引不存在时创建；同一文档的并发请求（包括其他进程）只构建一次"""
+        index_file = self.index_path / f"{document_id}.index"
+        if self.single_flight is None:
+            return index_file.exists() or self.create_faiss_index(document_id, chunks, global_id)
+        with self.single_flight.lock(f"index:{index_file}"):
+            return index_file.exists() or self.create_faiss_index(document_id, chunks, global_id)
+    
+    def remove_global_entries(self, global_id):
+        """从全局索引删除一个文档的向量"""
+        if self.global_index is None:
+            return
+        try:
+            self.global_index.remove_document(global_id)
+        except Exception as e:
+            print(f"更新全局索引失败: {e}")
+    
+    def transfer_global_entries(self, document_id, old_id, new_id):
+        """共用索引的文档被删除时，把全局索引中记在它名下的向量改记到new_id"""
+        if self.global_index is None:
+            return
+        try:
+            if self.global_index.remove_document(old_id):
+                vectors = self._chunk_vectors(document_id)
+                if vectors is not None:
+                    self.global_index.add_document(new_id, vectors)
+        except Exception as e:
+            print(f"更新全局索引失败: {e}")
+    
+    def _cached_index(self, index_file, chunks_file):
+        """经index_cache取得(index, chunks)；需要迁移的旧索引写回后按新文件重新缓存"""
+        index, chunks = index_cache.get(
+            index_file, chunks_file,
+            lambda: self._load_index(index_file, chunks_file)
+        )
+        migrated = self._migrate_index(index, index_file)
+        if migrated is not index:
+            index_cache.put(index_file, chunks_file, migrated, chunks)
+        return migrated, chunks
+    
+    def _load_index(self, index_file, chunks_file):
+        """从磁盘读取索引和分段（.chunks文件以mmap方式打开）"""
+        index = faiss.read_index(str(index_file))
+        if chunks_file.suffix == '.chunks':
+            return index, ChunkStore(chunks_file)
+        with open(chunks_file, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        return index, chunks
+    
     def search_similar_chunks(self, document_id, query, top_k=3):
         """搜索相似文本片段"""
         try:
             index_file = self.index_path / f"{document_id}.index"
-            chunks_file = self.index_path / f"{document_id}_chunks.json"
+            chunks_file = self._chunks_file(document_id)
             
             if not index_file.exists() or not chunks_file.exists():
                 return []
             
-            index = faiss.read_index(str(index_file))
-            with open(chunks_file, 'r', encoding='utf-8') as f:
-                chunks = json.load(f)
+            index, chunks = self._cached_index(index_file, chunks_file)
             
             query_embedding = self.get_embeddings([query])
             if not query_embedding:
                 return []
             
             query_np = np.array(query_embedding).astype('float32')
-            scores, indices = index.search(query_np, top_k)
+            with STAGE_SECONDS.time(stage='search'):
+                scores, indices = index.search(query_np, top_k)
             
             results = []
             for score, idx in zip(scores[0], indices[0]):
-                if idx < len(chunks):
+                if 0 <= idx < len(chunks):
                     results.append({
                         'text': chunks[idx],
                         'score': float(score)
@@ -209,9 +613,57 @@ class DocumentProcessor:
             print(f"搜索失败: {e}")
             return []
     
+    def search_library(self, query, top_k=5):
+        """在所有文档中检索相似片段，返回带document_id和chunk_index的结果"""
+        if self.global_index is None:
+            return []
+        try:
+            query_embedding = self.get_embeddings([query])
+            if not query_embedding:
+                return []
+            
+            with STAGE_SECONDS.time(stage='search'):
+                hits = self.global_index.search(query_embedding[0], top_k)
+            index_keys = self._index_keys({document_id for document_id, _, _ in hits})
+            results = []
+            for document_id, chunk_index, score in hits:
+                key = index_keys.get(document_id, str(document_id))
+                index_file = self.index_path / f"{key}.index"
+                chunks_file = self._chunks_file(key)
+                if not index_file.exists() or not chunks_file.exists():
+                    continue
+                _, chunks = self._cached_index(index_file, chunks_file)
+                if chunk_index < len(chunks):
+                    results.append({
+                        'document_id': document_id,
+                        'chunk_index': chunk_index,
+                        'text': chunks[chunk_index],
+                        'score': score
+                    })
+            return results
+            
+        except Exception as e:
+            print(f"全局搜索失败: {e}")
+            return []
+    
+    @staticmethod
+    def _index_keys(document_ids):
+        """全局索引中的文档id -> 索引命名键（内容寻址的文档为内容哈希）"""
+        from .models import PDFDocument
+        rows = PDFDocument.objects.filter(pk__in=document_ids).values_list('pk', 'content_hash')
+        return {pk: content_hash or str(pk) for pk, content_hash in rows}
+    
     def call_llm_api(self, prompt, temperature=None, max_tokens=None):
         """调用LLM API - 专门为AIHubMix优化"""
-        config = self._get_active_config()
+        self.last_llm_ok, content = self._chat_completion(prompt, temperature, max_tokens)
+        if not self.last_llm_ok:
+            self.upstream_failed = True
+        return content
+    
+    def _chat_completion(self, prompt, temperature=None, max_tokens=None, config=None):
+        """调用chat/completions，返回(是否成功, 内容或错误信息)，不修改实例状态，可在线程中并发调用"""
+        if config is None:
+            config = self._get_active_config()
         
         temp = temperature if temperature is not None else config['temperature']
         tokens = max_tokens if max_tokens is not None else config['max_tokens']
@@ -219,74 +671,187 @@ class DocumentProcessor:
         if config['simulation_mode']:
             print("模拟模式: 生成模拟AI响应")
             time.sleep(2)
+            return True, self._generate_mock_response(prompt)
+        
+        try:
+            headers, data = self._chat_request(config, prompt, temp, tokens)
+            with upstream_post(config, "chat/completions", data, timeout=60, headers=headers) as response:
+                return self._chat_result(response, config['model_name'])
+                
+        except requests.exceptions.Timeout:
+            return False, "AIHubMix API请求超时，请稍后重试"
+        except requests.exceptions.ConnectionError:
+            return False, "无法连接到AIHubMix API，请检查网络连接"
+        except Exception as e:
+            return False, f"调用AIHubMix API失败: {str(e)}"
+    
+    def _chat_request(self, config, prompt, temperature, max_tokens):
+        """构造chat/completions请求，返回(headers, json)"""
+        # AIHubMix使用OpenAI兼容格式
+        headers = {
+            "Authorization": f"Bearer {config['api_key']}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": config['model_name'],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": False
+        }
+        
+        print(f"调用AIHubMix API: {config['base_url']}/chat/completions")
+        print(f"使用模型: {config['model_name']}")
+        return headers, data
+    
+    def _chat_result(self, response, model):
+        """解析requests或httpx的响应，返回(是否成功, 内容或错误信息)"""
+        print(f"API响应状态: {response.status_code}")
+        
+        if response.status_code == 200:
+            result = response.json()
+            record_usage(model, result.get('usage'))
             
-            if "总结要点" in prompt:
-                return self._generate_mock_summary()
-            elif "详细分析" in prompt:
-                return self._generate_mock_analysis()
-            elif "出题" in prompt or "题目" in prompt:
-                return self._generate_mock_questions()
+            if 'choices' in result and len(result['choices']) > 0:
+                return True, result['choices'][0]['message']['content']
             else:
-                return "这是AI生成的模拟响应。请配置AI API密钥以获取真实结果。"
+                return False, f"API响应格式异常: {result}"
+        else:
+            return False, self._format_api_error(response)
+    
+    async def acall_llm_api(self, prompt, temperature=None, max_tokens=None, config=None):
+        """call_llm_api的异步版本"""
+        self.last_llm_ok, content = await self._achat_completion(prompt, temperature, max_tokens, config)
+        if not self.last_llm_ok:
+            self.upstream_failed = True
+        return content
+    
+    async def _achat_completion(self, prompt, temperature=None, max_tokens=None, config=None):
+        """_chat_completion的异步版本，使用共享的httpx.AsyncClient，等待上游时不占用线程"""
+        if config is None:
+            config = await sync_to_async(self._get_active_config)()
+        
+        temp = temperature if temperature is not None else config['temperature']
+        tokens = max_tokens if max_tokens is not None else config['max_tokens']
+        
+        if config['simulation_mode']:
+            print("模拟模式: 生成模拟AI响应")
+            await asyncio.sleep(2)
+            return True, self._generate_mock_response(prompt)
+        
+        client = get_async_client(config['base_url'])
+        if client is None:
+            print("未安装httpx，在线程中调用同步客户端")
+            call = functools.partial(self._chat_completion, prompt, temperature, max_tokens, config)
+            return await asyncio.get_running_loop().run_in_executor(_get_blocking_executor(), call)
         
         try:
-            # AIHubMix使用OpenAI兼容格式
-            headers = {
-                "Authorization": f"Bearer {config['api_key']}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": config['model_name'],
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temp,
-                "max_tokens": tokens,
-                "stream": False
-            }
-            
-            print(f"调用AIHubMix API: {config['base_url']}/chat/completions")
-            print(f"使用模型: {config['model_name']}")
-            
-            response = requests.post(
-                f"{config['base_url']}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60
-            )
-            
-            print(f"API响应状态: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                print(f"API响应: {result}")
-                
-                if 'choices' in result and len(result['choices']) > 0:
-                    return result['choices'][0]['message']['content']
+            headers, data = self._chat_request(config, prompt, temp, tokens)
+            async with aupstream_post(config, "chat/completions", data, timeout=60, headers=headers) as response:
+                return self._chat_result(response, config['model_name'])
+        
+        except httpx.TimeoutException:
+            return False, "AIHubMix API请求超时，请稍后重试"
+        except httpx.TransportError:
+            return False, "无法连接到AIHubMix API，请检查网络连接"
+        except Exception as e:
+            return False, f"调用AIHubMix API失败: {str(e)}"
+    
+    def _format_api_error(self, response):
+        """把上游错误响应转换为错误信息"""
+        error_text = response.text
+        print(f"API错误响应: {error_text}")
+        
+        try:
+            error_data = response.json()
+            if 'error' in error_data:
+                error_msg = error_data['error']
+                if isinstance(error_msg, dict) and 'message' in error_msg:
+                    return f"AIHubMix API错误: {error_msg['message']}"
                 else:
-                    return f"API响应格式异常: {result}"
+                    return f"AIHubMix API错误: {error_msg}"
             else:
-                error_text = response.text
-                print(f"API错误响应: {error_text}")
-                
-                try:
-                    error_data = response.json()
-                    if 'error' in error_data:
-                        error_msg = error_data['error']
-                        if isinstance(error_msg, dict) and 'message' in error_msg:
-                            return f"AIHubMix API错误: {error_msg['message']}"
-                        else:
-                            return f"AIHubMix API错误: {error_msg}"
-                    else:
-                        return f"AIHubMix API错误: {error_text}"
-                except:
-                    return f"AIHubMix API错误: {error_text}"
-                
+                return f"AIHubMix API错误: {error_text}"
+        except:
+            return f"AIHubMix API错误: {error_text}"
+    
+    def stream_llm_api(self, prompt, temperature=None, max_tokens=None):
+        """流式调用LLM API，逐段yield生成的文本；失败时抛出LLMStreamError"""
+        config = self._get_active_config()
+        
+        temp = temperature if temperature is not None else config['temperature']
+        tokens = max_tokens if max_tokens is not None else config['max_tokens']
+        
+        if config['simulation_mode']:
+            print("模拟模式: 流式生成模拟AI响应")
+            text = self._generate_mock_response(prompt)
+            delay = getattr(settings, 'SIMULATION_STREAM_DELAY', 0.02)
+            for start in range(0, len(text), 8):
+                time.sleep(delay)
+                yield text[start:start + 8]
+            return
+        
+        headers = {
+            "Authorization": f"Bearer {config['api_key']}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        
+        data = {
+            "model": config['model_name'],
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temp,
+            "max_tokens": tokens,
+            "stream": True
+        }
+        
+        print(f"流式调用AIHubMix API: {config['base_url']}/chat/completions")
+        # 并发名额一直占用到流读完
+        request = ExitStack()
+        try:
+            response = request.enter_context(
+                upstream_post(config, "chat/completions", data, timeout=60, headers=headers, stream=True)
+            )
         except requests.exceptions.Timeout:
-            return "AIHubMix API请求超时，请稍后重试"
+            raise LLMStreamError("AIHubMix API请求超时，请稍后重试")
         except requests.exceptions.ConnectionError:
-            return "无法连接到AIHubMix API，请检查网络连接"
-        except Exception as e:
-            return f"调用AIHubMix API失败: {str(e)}"
+            raise LLMStreamError("无法连接到AIHubMix API，请检查网络连接")
+        
+        with request:
+            if response.status_code != 200:
+                raise LLMStreamError(self._format_api_error(response))
+            
+            # SSE规定为UTF-8；上游常不带charset，不能依赖requests的自动解码
+            for raw_line in response.iter_lines():
+                line = raw_line.decode('utf-8', errors='replace')
+                if not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(payload)
+                except ValueError:
+                    continue
+                # 部分上游在最后一个数据块中返回usage
+                record_usage(config['model_name'], chunk.get('usage'))
+                choices = chunk.get('choices') or []
+                if choices:
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content:
+                        yield content
+    
+    def _generate_mock_response(self, prompt):
+        """根据prompt类型选择模拟响应"""
+        if "总结要点" in prompt:
+            return self._generate_mock_summary()
+        elif "详细分析" in prompt:
+            return self._generate_mock_analysis()
+        elif "出题" in prompt or "题目" in prompt:
+            return self._generate_mock_questions()
+        else:
+            return "这是AI生成的模拟响应。请配置AI API密钥以获取真实结果。"
     
     def _generate_mock_summary(self):
         """生成模拟总结"""
@@ -349,35 +914,412 @@ class DocumentProcessor:
 2. 数字化转型的关键在于__数据驱动__。
 3. 人工智能的基础是__算法和算力__。"""
 
-    def process_document(self, document_id, pdf_path, task_type):
-        """处理文档的主要函数"""
-        text = self.extract_text_from_pdf(pdf_path)
-        if not text:
-            return "无法从PDF提取文本"
+    def prepare_prompt(self, document_id, pdf_path, task_type, content_hash=None, global_id=None):
+        """准备分段、索引并生成prompt，返回(prompt, 错误信息)
+
+        global_id：新建索引时加入全局索引所用的文档id（见create_faiss_index）。
+        """
+        with self._stage('chunks'):
+            chunks = self.load_chunks(pdf_path, content_hash)
+        if not chunks:
+            return None, "无法从PDF提取文本"
         
-        cleaned_text = self.clean_text(text)
-        chunks = self.chunk_text(cleaned_text)
+        if not (self.index_path / f"{document_id}.index").exists():
+            with self._stage('index'):
+                created = self.ensure_index(document_id, chunks, global_id)
+            if not created:
+                return None, "创建向量索引失败"
         
+        builder = self._prompt_builder(task_type)
+        if builder is None:
+            return None, "未知的任务类型"
+        
+        with self._stage('context'):
+            budget = self._context_budget(estimate_tokens(builder([])))
+            selected = select_chunks(
+                chunks, budget, self._chunk_vectors(document_id, len(chunks)), self.context_diversity
+            )
+        return builder([chunks[i] for i in selected]), None
+    
+    def _prompt_builder(self, task_type):
+        return {
+            "summary": self._create_summary_prompt,
+            "analysis": self._create_analysis_prompt,
+            "questions": self._create_questions_prompt,
+        }.get(task_type)
+    
+    def _context_budget(self, template_tokens):
+        """prompt中分段可用的token数，由模型上下文窗口和max_tokens决定"""
+        config = self._get_active_config()
+        window = context_window(
+            config['model_name'],
+            getattr(settings, 'MODEL_CONTEXT_WINDOWS', {}),
+            getattr(settings, 'MODEL_CONTEXT_WINDOW_DEFAULT', 8192),
+        )
+        return context_budget(window, config['max_tokens'] or 0, template_tokens, self.context_max_tokens)
+    
+    def _chunk_vectors(self, document_id, count=None):
+        """从文档索引取出全部分段向量，分段数对不上或读取失败时返回None"""
         index_file = self.index_path / f"{document_id}.index"
-        if not index_file.exists():
-            if not self.create_faiss_index(document_id, chunks):
-                return "创建向量索引失败"
-        
-        if task_type == "summary":
-            prompt = self._create_summary_prompt(chunks)
-        elif task_type == "analysis":
-            prompt = self._create_analysis_prompt(chunks)
-        elif task_type == "questions":
-            prompt = self._create_questions_prompt(chunks)
+        chunks_file = self._chunks_file(document_id)
+        if not index_file.exists() or not chunks_file.exists():
+            return None
+        try:
+            index, _ = self._cached_index(index_file, chunks_file)
+            if count is not None and index.ntotal != count:
+                return None
+            return index.reconstruct_n(0, index.ntotal)
+        except Exception as e:
+            print(f"读取分段向量失败: {e}")
+            return None
+    
+    def _result_cache_key(self, content_hash, task_type, config, mode='single'):
+        """结果缓存键：文档内容、任务类型、处理模式、模板版本和生成参数"""
+        raw = json.dumps([
+            content_hash, task_type, mode, PROMPT_TEMPLATE_VERSION,
+            config['model_name'], config['temperature'], config['max_tokens'],
+            config['simulation_mode'],
+        ])
+        return "result:" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _lookup_result(self, pdf_path, task_type, force_refresh, mode='single', content_hash=None):
+        """查询结果缓存，返回(缓存键, 内容哈希, 命中的结果)
+
+        content_hash为已知的文件哈希（PDFDocument.content_hash），缺省时才读文件计算。
+        """
+        if not content_hash:
+            content_hash = file_sha256(pdf_path)
+        key = self._result_cache_key(content_hash, task_type, self._get_active_config(), mode)
+        self.cache_info = {'status': 'bypass' if force_refresh else 'miss'}
+        if not force_refresh:
+            cached = get_result_cache().get(key)
+            if cached is not None:
+                self.cache_info = {
+                    'status': 'hit',
+                    'age': round(time.time() - cached['created_at'], 1),
+                }
+                CACHE_REQUESTS.inc(cache='result', status='hit')
+                return key, content_hash, cached['result']
+        CACHE_REQUESTS.inc(cache='result', status=self.cache_info['status'])
+        return key, content_hash, None
+    
+    def _store_result(self, key, result):
+        get_result_cache().set(key, {'result': result, 'created_at': time.time()})
+    
+    def process_document(self, document_id, pdf_path, task_type, force_refresh=False, mode=None,
+                         global_id=None, content_hash=None):
+        """处理文档的主要函数
+
+        document_id为索引命名键（PDFDocument.index_key），global_id为文档主键，
+        content_hash为已知的文件哈希（缺省时读文件计算）。
+        mode: single（一次调用）、map_reduce（分组摘要后合并）或auto
+        （分段超出上下文预算时使用map_reduce），默认PROCESS_MODE。
+        """
+        self.stage_timings = {}
+        self.last_llm_ok = False
+        self.last_error = None
+        self.upstream_failed = False
+        mode = mode or self.process_mode
+        if mode not in PROCESS_MODES:
+            self.last_error = "未知的处理模式"
+            return self.last_error
+        requested_at = time.time()
+        key, content_hash, cached = self._lookup_result(
+            pdf_path, task_type, force_refresh, mode, content_hash
+        )
+        if cached is not None:
+            self.last_llm_ok = True
+            return cached
+        
+        def compute():
+            ok, result = self._compute_result(
+                document_id, pdf_path, task_type, content_hash, mode, force_refresh, global_id
+            )
+            return ok, result if ok else self._failure(result)
+        
+        if self.single_flight is None:
+            ok, result = compute()
+        else:
+            # 相同(文档内容, 任务, 模式, 配置)的并发请求只计算一次
+            ok, result, shared = self.single_flight.do(key, compute, since=requested_at)
+            if shared:
+                self.cache_info = {'status': 'coalesced'}
+                CACHE_REQUESTS.inc(cache='result', status='coalesced')
+        return self._finish_result(key, ok, result)
+    
+    async def aprocess_document(self, document_id, pdf_path, task_type, force_refresh=False, mode=None,
+                                global_id=None, content_hash=None):
+        """process_document的异步版本，供ASGI下的异步视图使用
+
+        上游LLM调用走httpx.AsyncClient，不占用线程；PDF解析、嵌入和FAISS等
+        阻塞步骤放到大小固定的共享线程池（ASYNC_BLOCKING_WORKERS）。
+        """
+        self.stage_timings = {}
+        self.last_llm_ok = False
+        self.last_error = None
+        self.upstream_failed = False
+        mode = mode or self.process_mode
+        if mode not in PROCESS_MODES:
+            self.last_error = "未知的处理模式"
+            return self.last_error
+        config = await sync_to_async(self._get_active_config)()
+        # 本次请求内固定使用这份配置，线程池中的同步步骤不再查询数据库
+        token = _request_config.set(config)
+        try:
+            return await self._aprocess_with_config(
+                document_id, pdf_path, task_type, force_refresh, mode, global_id, config, content_hash
+            )
+        finally:
+            _request_config.reset(token)
+    
+    async def _aprocess_with_config(self, document_id, pdf_path, task_type, force_refresh, mode,
+                                    global_id, config, content_hash=None):
+        requested_at = time.time()
+        key, content_hash, cached = await self._run_blocking(
+            self._lookup_result, pdf_path, task_type, force_refresh, mode, content_hash
+        )
+        if cached is not None:
+            self.last_llm_ok = True
+            return cached
+        
+        async def compute():
+            ok, result = await attempt()
+            return ok, result if ok else self._failure(result)
+        
+        async def attempt():
+            if mode != 'single':
+                result = await self._amap_reduce(
+                    pdf_path, task_type, content_hash, mode == 'map_reduce', force_refresh, config
+                )
+                if result is not None:
+                    return self.last_llm_ok, result
+            
+            prompt, error = await self._run_blocking(
+                self.prepare_prompt, document_id, pdf_path, task_type, content_hash, global_id
+            )
+            if error:
+                return False, error
+            with self._stage('llm'):
+                result = await self.acall_llm_api(prompt, config=config)
+            return self.last_llm_ok, result
+        
+        if self.single_flight is None:
+            ok, result = await compute()
         else:
+            ok, result, shared = await self.single_flight.ado(key, compute, since=requested_at)
+            if shared:
+                self.cache_info = {'status': 'coalesced'}
+                CACHE_REQUESTS.inc(cache='result', status='coalesced')
+        return self._finish_result(key, ok, result)
+    
+    def _failure(self, error):
+        """失败结果带上是否为上游失败，经single-flight合并的调用者据此返回相同的状态码"""
+        return {'error': error, 'upstream_failed': self.upstream_failed}
+    
+    def _finish_result(self, key, ok, result):
+        """成功时写入结果缓存；失败时按_failure的内容设置last_error和upstream_failed"""
+        self.last_llm_ok = ok
+        if ok:
+            self._store_result(key, result)
+            return result
+        self.last_error = result['error']
+        self.upstream_failed = result['upstream_failed']
+        return self.last_error
+    
+    async def _run_blocking(self, fn, *args):
+        """在共享线程池中执行阻塞步骤（带上当前上下文，剖析记录等可见）"""
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(_get_blocking_executor(), call)
+    
+    @property
+    def error_status(self):
+        """失败时视图返回的状态码：上游失败502，文档或参数问题422"""
+        return 502 if self.upstream_failed else 422
+    
+    def _compute_result(self, document_id, pdf_path, task_type, content_hash, mode, force_refresh,
+                        global_id=None):
+        """生成结果，返回(是否成功, 结果或错误信息)"""
+        if mode != 'single':
+            result = self._map_reduce(pdf_path, task_type, content_hash, mode == 'map_reduce', force_refresh)
+            if result is not None:
+                return self.last_llm_ok, result
+        
+        prompt, error = self.prepare_prompt(document_id, pdf_path, task_type, content_hash, global_id)
+        if error:
+            return False, error
+        
+        with self._stage('llm'):
+            result = self.call_llm_api(prompt)
+        return self.last_llm_ok, result
+    
+    def _map_reduce(self, pdf_path, task_type, content_hash, always, force_refresh=False):
+        """分组并发摘要（map）后用任务模板合并（reduce）
+
+        always为False且全部分段放得进上下文预算时返回None，交给单次调用处理。
+        """
+        builder = self._prompt_builder(task_type)
+        if builder is None:
+            return "未知的任务类型"
+        with self._stage('chunks'):
+            chunks = self.load_chunks(pdf_path, content_hash)
+        if not chunks:
+            return "无法从PDF提取文本"
+        
+        budget = self._context_budget(estimate_tokens(builder([])))
+        if not always and len(group_chunks(chunks, budget)) <= 1:
+            return None
+        
+        self.last_llm_ok = False
+        partials, level = chunks, 0
+        with self._stage('map'):
+            # 第0层摘要原文分组，摘要仍放不下时逐层再合并，直到能放进一次reduce
+            while level == 0 or len(group_chunks(partials, budget)) > 1:
+                groups = group_chunks(partials, budget if level else self.map_group_tokens)
+                if level and len(groups) >= len(partials):
+                    break
+                partials, error = self._map_groups(groups, level, force_refresh)
+                if error:
+                    return error
+                level += 1
+        
+        with self._stage('reduce'):
+            return self.call_llm_api(builder(partials))
+    
+    async def _amap_reduce(self, pdf_path, task_type, content_hash, always, force_refresh, config):
+        """_map_reduce的异步版本"""
+        builder = self._prompt_builder(task_type)
+        if builder is None:
             return "未知的任务类型"
+        with self._stage('chunks'):
+            chunks = await self._run_blocking(self.load_chunks, pdf_path, content_hash)
+        if not chunks:
+            return "无法从PDF提取文本"
+        
+        budget = self._context_budget(estimate_tokens(builder([])))
+        if not always and len(group_chunks(chunks, budget)) <= 1:
+            return None
+        
+        self.last_llm_ok = False
+        partials, level = chunks, 0
+        with self._stage('map'):
+            while level == 0 or len(group_chunks(partials, budget)) > 1:
+                groups = group_chunks(partials, budget if level else self.map_group_tokens)
+                if level and len(groups) >= len(partials):
+                    break
+                partials, error = await self._amap_groups(groups, level, force_refresh, config)
+                if error:
+                    return error
+                level += 1
+        
+        with self._stage('reduce'):
+            return await self.acall_llm_api(builder(partials), config=config)
+    
+    def _map_cache_key(self, text, level):
+        """分段摘要缓存键：只依赖分组内容和map参数，与任务类型无关，可被各任务复用"""
+        config = self._get_active_config()
+        raw = json.dumps([
+            MAP_TEMPLATE_VERSION, level, config['model_name'], self.map_temperature,
+            self.map_max_tokens, config['simulation_mode'], text,
+        ])
+        return "map:" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _map_lookup(self, groups, level, force_refresh=False):
+        """返回(分组文本, 缓存键, 已缓存的摘要或None)"""
+        cache = get_result_cache()
+        texts = ["\n".join(group) for group in groups]
+        keys = [self._map_cache_key(text, level) for text in texts]
+        summaries = [None] * len(texts) if force_refresh else [
+            cached['result'] if cached else None
+            for cached in (cache.get(key) for key in keys)
+        ]
+        hits = sum(summary is not None for summary in summaries)
+        CACHE_REQUESTS.inc(hits, cache='map', status='hit')
+        CACHE_REQUESTS.inc(len(texts) - hits, cache='map', status='miss')
+        print(f"map阶段第{level}层: {len(texts)}组，缓存命中{hits}组")
+        return texts, keys, summaries
+    
+    @staticmethod
+    def _map_store(key, summary):
+        get_result_cache().set(key, {'result': summary, 'created_at': time.time()})
+    
+    def _map_groups(self, groups, level, force_refresh=False):
+        """并发摘要各组，返回(摘要列表, 错误信息)；命中缓存的组不再调用上游"""
+        texts, keys, summaries = self._map_lookup(groups, level, force_refresh)
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        
+        def summarize(i):
+            return i, self._chat_completion(
+                self._create_map_prompt(texts[i]), self.map_temperature, self.map_max_tokens
+            )
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.map_concurrency)) as executor:
+            for i, (ok, content) in executor.map(summarize, missing):
+                if not ok:
+                    self.upstream_failed = True
+                    return None, content
+                summaries[i] = content
+                self._map_store(keys[i], content)
+        return summaries, None
+    
+    async def _amap_groups(self, groups, level, force_refresh=False, config=None):
+        """_map_groups的异步版本，并发数同样受MAP_REDUCE_CONCURRENCY限制"""
+        texts, keys, summaries = self._map_lookup(groups, level, force_refresh)
+        semaphore = asyncio.Semaphore(max(1, self.map_concurrency))
+        
+        async def summarize(i):
+            async with semaphore:
+                ok, content = await self._achat_completion(
+                    self._create_map_prompt(texts[i]), self.map_temperature, self.map_max_tokens, config
+                )
+            if ok:
+                summaries[i] = content
+                self._map_store(keys[i], content)
+            return ok, content
+        
+        outcomes = await asyncio.gather(*(summarize(i) for i, s in enumerate(summaries) if s is None))
+        for ok, content in outcomes:
+            if not ok:
+                self.upstream_failed = True
+                return None, content
+        return summaries, None
+    
+    def stream_document(self, document_id, pdf_path, task_type, force_refresh=False, global_id=None,
+                        content_hash=None):
+        """流式处理文档，逐段yield LLM输出"""
+        self.stage_timings = {}
+        key, content_hash, cached = self._lookup_result(
+            pdf_path, task_type, force_refresh, content_hash=content_hash
+        )
+        if cached is not None:
+            yield cached
+            return
         
-        result = self.call_llm_api(prompt)
-        return result
+        prompt, error = self.prepare_prompt(document_id, pdf_path, task_type, content_hash, global_id)
+        if error:
+            raise LLMStreamError(error)
+        
+        parts = []
+        with self._stage('llm'):
+            for delta in self.stream_llm_api(prompt):
+                parts.append(delta)
+                yield delta
+        if parts:
+            self._store_result(key, "".join(parts))
+    
+    def _create_map_prompt(self, text):
+        """map阶段：提炼一组分段的要点（与任务类型无关）"""
+        return f"""以下是一份长文档中的连续片段，请提炼其中的要点：
+
+{text}
+
+要求：
+- 保留关键事实、数据、概念、论点和结论
+- 按原文顺序用简洁的条目列出，不要添加原文没有的内容
+- 不要写开场白或总结语"""
     
     def _create_summary_prompt(self, chunks):
         """创建总结要点prompt"""
-        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks[:10])])
+        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks)])
         
         prompt = f"""请基于以下文档内容，生成一个结构化的总结要点：
 
@@ -401,7 +1343,7 @@ class DocumentProcessor:
     
     def _create_analysis_prompt(self, chunks):
         """创建详细分析prompt"""
-        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks[:15])])
+        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks)])
         
         prompt = f"""请对以下文档内容进行详细分析：
 
@@ -425,7 +1367,7 @@ class DocumentProcessor:
     
     def _create_questions_prompt(self, chunks):
         """创建出题prompt"""
-        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks[:12])])
+        context = "\n".join([f"{i+1}. {chunk}" for i, chunk in enumerate(chunks)])
         
         prompt = f"""基于以下文档内容，请创建多种题型的测试题目：
 
@@ -456,6 +1398,22 @@ class DocumentProcessor:
 请确保题目覆盖文档的核心内容，难度适中，并包含正确答案。"""
         return prompt
 
+_blocking_executor = None
+_blocking_executor_lock = threading.Lock()
+
+
+def _get_blocking_executor():
+    """异步路径中执行阻塞步骤的共享线程池，大小固定，不随在途请求数增长"""
+    global _blocking_executor
+    with _blocking_executor_lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_BLOCKING_WORKERS', 4),
+                thread_name_prefix='ai-blocking',
+            )
+        return _blocking_executor
+
+
 def get_processor():
     """获取新的处理器实例"""
     return DocumentProcessor()
\ No newline at end of file
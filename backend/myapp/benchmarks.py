@@ -0,0 +1,197 @@
+"""文档处理流水线的微基准测试
+
+在生成的PDF上分别计时各阶段，嵌入使用模拟模式，不需要网络。
+通过 python manage.py run_benchmarks 运行。
+"""
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import nullcontext, redirect_stdout
+from django.test import override_settings
+from .pdf_fixtures import build_text_pdf
+
+STAGES = ('extract', 'clean', 'chunk', 'index_build', 'search_cold', 'search')
+DEFAULT_PAGE_COUNTS = (10, 100, 1000)
+
+_WORDS = (
+    "learning student course chapter theory method result analysis model data "
+    "system network energy history language market policy research example "
+    "function value structure process teacher question answer important"
+).split()
+
+SIMULATION_CONFIG = {
+    'api_key': '',
+    'base_url': '',
+    'model_name': 'gpt-3.5-turbo',
+    'embedding_model': 'text-embedding-ada-002',
+    'temperature': 0.7,
+    'max_tokens': 2000,
+    'simulation_mode': True,
+}
+
+
+def generate_pages(page_count, lines_per_page=40, seed=0):
+    """生成确定性的英文页面文本"""
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(page_count):
+        lines = []
+        for _ in range(lines_per_page):
+            words = rng.choices(_WORDS, k=rng.randint(6, 12))
+            lines.append(" ".join(words).capitalize() + ".")
+        pages.append("\n".join(lines))
+    return pages
+
+
+def _measure(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return {'median': statistics.median(samples), 'min': min(samples)}, result
+
+
+def benchmark_document(processor, pdf_path, repeat=3, queries=20):
+    """对一个PDF逐阶段计时，返回{阶段: {'median': 秒, 'min': 秒}}"""
+    from .caches import index_cache
+
+    timings = {}
+    timings['extract'], text = _measure(lambda: processor.extract_text_from_pdf(pdf_path), repeat)
+    timings['clean'], cleaned = _measure(lambda: processor.clean_text(text), repeat)
+    timings['chunk'], chunks = _measure(lambda: processor.chunk_text(cleaned), repeat)
+    timings['index_build'], _ = _measure(
+        lambda: processor.create_faiss_index('bench', chunks), repeat
+    )
+
+    def cold_search():
+        index_cache.clear()
+        return processor.search_similar_chunks('bench', 'student analysis')
+
+    timings['search_cold'], _ = _measure(cold_search, repeat)
+
+    def warm_search():
+        for i in range(queries):
+            processor.search_similar_chunks('bench', _WORDS[i % len(_WORDS)])
+
+    warm, _ = _measure(warm_search, repeat)
+    timings['search'] = {key: value / queries for key, value in warm.items()}
+    return timings
+
+
+def run_benchmarks(page_counts=DEFAULT_PAGE_COUNTS, repeat=3, queries=20, quiet=True):
+    """在临时目录中运行全部基准，不影响faiss_index/等数据目录"""
+    from .ai_service import DocumentProcessor
+
+    tmp_dir = tempfile.mkdtemp(prefix='tutorhub-bench-')
+    try:
+        with override_settings(BASE_DIR=tmp_dir, EMBEDDING_CACHE_ENABLED=False):
+            processor = DocumentProcessor()
+            processor._get_active_config = lambda: SIMULATION_CONFIG
+            results = {}
+            for page_count in page_counts:
+                pdf_path = os.path.join(tmp_dir, f'{page_count}.pdf')
+                with open(pdf_path, 'wb') as f:
+                    f.write(build_text_pdf(generate_pages(page_count)))
+                # 模拟模式的print不计入耗时
+                with redirect_stdout(io.StringIO()) if quiet else nullcontext():
+                    results[str(page_count)] = benchmark_document(processor, pdf_path, repeat, queries)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'queries': queries,
+        },
+        'results': results,
+    }
+
+
+def _clustered_vectors(count, dim, rng, clusters=50):
+    """带聚类结构的单位向量，比均匀随机向量更接近真实嵌入"""
+    import numpy as np
+
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def benchmark_index_types(vectors=2000, dim=1536, queries=100, top_k=10, seed=0,
+                          index_types=None, pq_m=64, pq_nbits=8):
+    """比较各索引类型的体积、构建/查询耗时和相对flat的recall@top_k"""
+    import numpy as np
+    from .index_types import INDEX_TYPES, build_index, index_nbytes, index_type_of
+
+    rng = np.random.default_rng(seed)
+    data = _clustered_vectors(vectors, dim, rng)
+    picks = data[rng.integers(0, vectors, queries)]
+    query_vectors = picks + 0.1 * rng.standard_normal(picks.shape).astype('float32')
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    exact = build_index(data, 'flat')
+    _, truth = exact.search(query_vectors, top_k)
+
+    results = {}
+    for index_type in index_types or INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_index(data, index_type, pq_m, pq_nbits)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        _, found = index.search(query_vectors, top_k)
+        search_seconds = (time.perf_counter() - start) / queries
+        hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+        size = index_nbytes(index)
+        results[index_type] = {
+            'actual_type': index_type_of(index),
+            'bytes': size,
+            'bytes_per_vector': size / vectors,
+            'recall': hits / (queries * top_k),
+            'build': build_seconds,
+            'search': search_seconds,
+        }
+    return {'vectors': vectors, 'dim': dim, 'queries': queries, 'top_k': top_k, 'results': results}
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25, min_delta=0.001):
+    """找出比基线慢超过tolerance比例（且绝对差超过min_delta秒）的阶段"""
+    regressions = []
+    for page_count, stages in report['results'].items():
+        base_stages = baseline.get('results', {}).get(page_count, {})
+        for stage, timing in stages.items():
+            base = base_stages.get(stage)
+            if not base:
+                continue
+            current, previous = timing['median'], base['median']
+            if current - previous > min_delta and current > previous * (1 + tolerance):
+                regressions.append({
+                    'pages': page_count,
+                    'stage': stage,
+                    'baseline': previous,
+                    'current': current,
+                    'ratio': current / previous if previous else float('inf'),
+                })
+    return regressions
+
+
+def load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
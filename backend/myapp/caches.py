@@ -0,0 +1,121 @@
+"""进程内缓存"""
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import register_collector
+
+
+class IndexCache:
+    """已加载的FAISS索引和分段列表的LRU缓存
+
+    按条目数和估算内存两个上限淘汰，文件mtime变化时自动失效。
+    """
+
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _mtimes(index_file, chunks_file):
+        return (index_file.stat().st_mtime_ns, chunks_file.stat().st_mtime_ns)
+
+    @staticmethod
+    def _estimate_size(index, chunks):
+        vectors = index.ntotal * index.d * 4
+        # mmap的ChunkStore只计偏移数组，文本按需从页缓存读取
+        chunk_bytes = getattr(chunks, 'memory_size', None)
+        if chunk_bytes is None:
+            chunk_bytes = sum(len(chunk) for chunk in chunks) * 4
+        return vectors + chunk_bytes
+
+    def get(self, index_file, chunks_file, loader):
+        """返回(index, chunks)，未命中或文件已变化时调用loader加载"""
+        key = str(index_file)
+        mtimes = self._mtimes(index_file, chunks_file)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtimes:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        index, chunks = loader()
+        # 按加载前的mtime记录：加载期间文件被改写时下次访问会重新加载
+        self._store(key, mtimes, index, chunks)
+        return index, chunks
+
+    def put(self, index_file, chunks_file, index, chunks):
+        """写回索引文件后调用，按写回后的mtime缓存新对象，避免下次访问重复加载"""
+        self._store(str(index_file), self._mtimes(index_file, chunks_file), index, chunks)
+
+    def _store(self, key, mtimes, index, chunks):
+        size = self._estimate_size(index, chunks)
+        with self._lock:
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (mtimes, index, chunks, size)
+                self._bytes += size
+                self._evict()
+
+    def invalidate(self, index_file):
+        with self._lock:
+            self._remove(str(index_file))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[3]
+            self.evictions += 1
+
+
+index_cache = IndexCache(
+    max_entries=getattr(settings, 'FAISS_INDEX_CACHE_SIZE', 32),
+    max_bytes=getattr(settings, 'FAISS_INDEX_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+)
+
+
+@register_collector
+def _index_cache_metrics():
+    stats = index_cache.stats()
+    return [
+        ('pdfai_index_cache_hits_total', 'counter', 'FAISS索引缓存命中次数', [({}, stats['hits'])]),
+        ('pdfai_index_cache_misses_total', 'counter', 'FAISS索引缓存未命中次数', [({}, stats['misses'])]),
+        ('pdfai_index_cache_evictions_total', 'counter', 'FAISS索引缓存淘汰次数', [({}, stats['evictions'])]),
+        ('pdfai_index_cache_bytes', 'gauge', 'FAISS索引缓存估算内存', [({}, stats['bytes'])]),
+    ]
+
+
+def get_result_cache():
+    """LLM结果缓存，使用Django缓存框架（默认LocMemCache，TTL+LRU淘汰）"""
+    return caches[getattr(settings, 'RESULT_CACHE_ALIAS', 'results')]
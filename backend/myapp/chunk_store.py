@@ -0,0 +1,85 @@
+"""二进制分段存储，替代 {id}_chunks.json
+
+文件格式（小端）：
+    4字节魔数 b'CHNK' | uint32 版本 | uint64 分段数n
+    uint64 偏移数组 [n+1]
+    UTF-8 文本区（各分段首尾相接）
+读取时mmap整个文件，偏移数组直接映射为numpy视图，取第i段只解码对应切片，
+不需要解析整个文件；未访问的文本页不会常驻内存。
+"""
+import json
+import mmap
+import os
+import struct
+import uuid
+from pathlib import Path
+import numpy as np
+
+MAGIC = b'CHNK'
+VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+
+
+def write_chunks(path, chunks):
+    """原子写入分段列表"""
+    path = Path(path)
+    encoded = [chunk.encode('utf-8') for chunk in chunks]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    if encoded:
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(encoded)))
+        f.write(offsets.tobytes())
+        for data in encoded:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """只读的mmap分段序列，支持len()、下标和迭代"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"不是有效的分段文件: {self.path}")
+        self._count = count
+        self._offsets = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=_HEADER.size)
+        self._data_start = _HEADER.size + (count + 1) * 8
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        start = self._data_start + int(self._offsets[i])
+        end = self._data_start + int(self._offsets[i + 1])
+        return self._mmap[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    @property
+    def memory_size(self):
+        """常驻内存估算：只计偏移数组，文本区按需由页缓存提供"""
+        return self._offsets.nbytes
+
+
+def migrate_json(json_path, remove=True):
+    """把旧的 {id}_chunks.json 转换为 {id}.chunks，返回新文件路径"""
+    json_path = Path(json_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    target = json_path.with_name(json_path.name[:-len('_chunks.json')] + '.chunks')
+    write_chunks(target, chunks)
+    if remove:
+        json_path.unlink()
+    return target
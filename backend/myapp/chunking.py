@@ -0,0 +1,139 @@
+"""文本清洗与分段
+
+分段器是可插拔的：在CHUNKERS中注册，通过get_chunker按名称创建。
+所有分段器都以页文本的可迭代对象为输入，按流式方式产出带页码和偏移量的Chunk。
+"""
+import re
+from dataclasses import dataclass, asdict
+
+# 一次扫描完成空白合并和非法字符删除
+_CLEAN_PATTERN = re.compile(
+    r'(\s+)|[^\w\s\u4e00-\u9fff，。！？；：\u201c\u201d\u2018\u2019（）《》.,!?;:\'"()\-]+'
+)
+# 中文句末标点直接断句；英文句末标点后须跟空白或文本结束
+_SENTENCE_END = re.compile(r'[。！？；]+[\u201d\u2019）》]*|[.!?]+[\'")]*(?=\s|$)')
+_CJK_CHAR = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def clean_text(text):
+    """合并空白并删除不支持的字符"""
+    return _CLEAN_PATTERN.sub(lambda m: ' ' if m.group(1) else '', text).strip()
+
+
+def estimate_tokens(text):
+    """粗略估计token数：中日韩字符每个约1个token，其余约4个字符1个token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(text):
+    """按中英文句末标点断句，yield (句子, 起始偏移)"""
+    pos = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        sentence = text[pos:end]
+        if sentence.strip():
+            yield sentence, pos
+        pos = end
+    if text[pos:].strip():
+        yield text[pos:], pos
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: int      # 起始页（从1开始）
+    end_page: int  # 结束页
+    start: int     # 在清洗后全文中的起始偏移
+    end: int
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class SentenceChunker:
+    """按句子累积到大小上限的分段器，支持按字符或估算token计量和句子级重叠"""
+
+    name = 'sentence'
+
+    def __init__(self, max_size=400, overlap=0, unit='chars'):
+        if unit not in ('chars', 'tokens'):
+            raise ValueError(f"不支持的分段单位: {unit}")
+        self.max_size = max_size
+        # 重叠部分不超过上限的一半，保证每段都有新内容
+        self.overlap = min(overlap, max_size // 2)
+        self.unit = unit
+        self._measure = len if unit == 'chars' else estimate_tokens
+
+    def signature(self):
+        return f"{self.name}-{self.unit}-{self.max_size}-{self.overlap}"
+
+    def _pieces(self, pages):
+        """yield (句子, 页码, 全文偏移)，超长句子按上限硬切"""
+        offset = 0
+        for page_number, page_text in enumerate(pages, start=1):
+            cleaned = clean_text(page_text)
+            for sentence, start in split_sentences(cleaned):
+                sentence_start = offset + start
+                if self._measure(sentence) <= self.max_size:
+                    yield sentence, page_number, sentence_start
+                    continue
+                step = self.max_size if self.unit == 'chars' else self.max_size * 2
+                while self._measure(sentence[:step]) > self.max_size and step > 1:
+                    step //= 2
+                for i in range(0, len(sentence), step):
+                    yield sentence[i:i + step], page_number, sentence_start + i
+            # 页与页之间以一个空格相连
+            offset += len(cleaned) + 1
+
+    def chunk_pages(self, pages):
+        """流式分段，pages为页文本的可迭代对象"""
+        window = []  # [(句子, 页码, 偏移, 大小)]
+        size = 0
+        for sentence, page, start in self._pieces(pages):
+            sentence_size = self._measure(sentence)
+            if window and size + sentence_size > self.max_size:
+                yield self._emit(window)
+                window, size = self._overlap_tail(window, sentence_size)
+            window.append((sentence, page, start, sentence_size))
+            size += sentence_size
+        if window:
+            yield self._emit(window)
+
+    def chunk_text(self, text):
+        return self.chunk_pages([text])
+
+    def _overlap_tail(self, window, next_size):
+        """保留末尾不超过overlap大小的句子作为下一段的开头，且加上下一句后不超过上限"""
+        limit = min(self.overlap, self.max_size - next_size)
+        tail, size = [], 0
+        for item in reversed(window):
+            if size + item[3] > limit:
+                break
+            tail.append(item)
+            size += item[3]
+        tail.reverse()
+        return tail, size
+
+    @staticmethod
+    def _emit(window):
+        first, last = window[0], window[-1]
+        text = "".join(item[0] for item in window).strip()
+        return Chunk(
+            text=text,
+            page=first[1],
+            end_page=last[1],
+            start=first[2],
+            end=last[2] + len(last[0]),
+        )
+
+
+CHUNKERS = {
+    SentenceChunker.name: SentenceChunker,
+}
+
+
+def get_chunker(name='sentence', **options):
+    if name not in CHUNKERS:
+        raise ValueError(f"未知的分段器: {name}")
+    return CHUNKERS[name](**options)
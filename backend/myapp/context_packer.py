@@ -0,0 +1,85 @@
+"""按token预算为prompt挑选最有代表性的分段
+
+预算 = min(PROMPT_CONTEXT_MAX_TOKENS, 模型上下文窗口 - max_tokens - 模板token - 余量)。
+有向量时用MMR挑选：与文档整体（向量均值）相近、且与已选分段不重复的分段优先，
+选完后按原文顺序排列；没有向量时按原文顺序装到预算为止。
+"""
+import numpy as np
+from .chunking import estimate_tokens
+
+# 每个分段在prompt中的编号和换行
+CHUNK_OVERHEAD_TOKENS = 3
+
+
+def context_window(model_name, windows, default):
+    """按最长前缀匹配模型名，返回上下文窗口大小"""
+    best = None
+    for prefix in windows:
+        if model_name.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return windows[best] if best is not None else default
+
+
+def context_budget(window, max_tokens, template_tokens, max_context, safety_margin=200):
+    """分段可用的token数，不小于0"""
+    available = window - max_tokens - template_tokens - safety_margin
+    return max(0, min(max_context, available))
+
+
+def _fill_in_order(chunks, budget):
+    selected, used = [], 0
+    for i, chunk in enumerate(chunks):
+        cost = estimate_tokens(chunk) + CHUNK_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        selected.append(i)
+        used += cost
+    return selected
+
+
+def select_chunks(chunks, budget, vectors=None, diversity=0.5):
+    """返回选中分段的下标（按原文顺序）
+
+    vectors与chunks一一对应时按MMR选择，diversity越大越偏向覆盖不同内容。
+    放不下的长分段会被跳过，继续尝试后面更短的分段。
+    """
+    if not chunks or budget <= 0:
+        return []
+    if vectors is None or len(vectors) != len(chunks):
+        return _fill_in_order(chunks, budget)
+
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    centroid = vectors.mean(axis=0)
+    relevance = vectors @ centroid
+
+    costs = np.array([estimate_tokens(chunk) + CHUNK_OVERHEAD_TOKENS for chunk in chunks])
+    candidates = costs <= budget
+    redundancy = np.full(len(chunks), -1.0, dtype='float32')
+    selected, used = [], 0
+    while candidates.any():
+        scores = (1 - diversity) * relevance - diversity * np.maximum(redundancy, 0)
+        scores[~candidates] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        used += costs[best]
+        candidates[best] = False
+        candidates &= costs <= budget - used
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return sorted(selected)
+
+
+def group_chunks(chunks, budget):
+    """按原文顺序把分段装成每组不超过budget token的若干组（超长分段单独成组）"""
+    groups, current, used = [], [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk) + CHUNK_OVERHEAD_TOKENS
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
@@ -0,0 +1,83 @@
+"""本地嵌入向量缓存，按(embedding_model, sha256(文本))存储在SQLite中"""
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS embeddings ("
+                        " model TEXT NOT NULL,"
+                        " text_hash TEXT NOT NULL,"
+                        " vector BLOB NOT NULL,"
+                        " PRIMARY KEY (model, text_hash))"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def get_many(self, model, hashes):
+        """返回{text_hash: list[float]}，只包含命中的条目"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        conn = self._connection()
+        # SQLite默认变量数上限为999
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings"
+                f" WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *part],
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype='float32').tolist()
+        return found
+
+    def put_many(self, model, items):
+        """items: [(text_hash, embedding), ...]"""
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, key, np.asarray(vector, dtype='float32').tobytes())
+             for key, vector in items],
+        )
+        conn.commit()
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path):
+    """同一路径在进程内共享一个实例"""
+    key = str(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = EmbeddingStore(key)
+            _stores[key] = store
+        return store
@@ -0,0 +1,221 @@
+"""本地OpenAI兼容接口替身，用于压测时代替AIHubMix
+
+实现 /embeddings 和 /chat/completions，可配置延迟分布、错误率、429比例和流式输出。
+通过 python manage.py fake_ai_server 启动。
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+MOCK_REPLY = (
+    "## 主要内容概述\n这是本地替身服务生成的响应，用于压测。\n\n"
+    "## 关键要点\n1. 要点一\n2. 要点二\n3. 要点三\n\n"
+    "## 重要结论\n压测响应结束。"
+)
+
+
+class LatencyModel:
+    """延迟分布（毫秒）：fixed、uniform 或 lognormal"""
+
+    def __init__(self, dist='fixed', mean_ms=100.0, spread_ms=0.0, seed=None):
+        if dist not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"未知的延迟分布: {dist}")
+        self.dist = dist
+        self.mean_ms = mean_ms
+        self.spread_ms = spread_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """返回一次延迟（秒）"""
+        with self._lock:
+            if self.dist == 'fixed' or self.mean_ms <= 0:
+                ms = self.mean_ms
+            elif self.dist == 'uniform':
+                ms = self._rng.uniform(self.mean_ms - self.spread_ms, self.mean_ms + self.spread_ms)
+            else:
+                # 以mean_ms为中位数，spread_ms/mean_ms为对数标准差
+                sigma = self.spread_ms / self.mean_ms if self.mean_ms else 0
+                ms = self.mean_ms * self._rng.lognormvariate(0, sigma)
+        return max(ms, 0) / 1000.0
+
+
+class FakeAIConfig:
+    def __init__(self, chat_latency=None, embedding_latency=None, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, dim=1536, stream_chunk_ms=20.0, seed=None):
+        self.chat_latency = chat_latency or LatencyModel(mean_ms=500)
+        self.embedding_latency = embedding_latency or LatencyModel(mean_ms=50)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.dim = dim
+        self.stream_chunk_ms = stream_chunk_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {'embeddings': 0, 'chat': 0, 'errors': 0, 'throttled': 0}
+        self.in_flight = 0
+        self.peak_in_flight = 0  # 同时处理中的请求数峰值，用于确认客户端请求确实并发
+
+    def roll(self):
+        """决定本次请求返回 'ok'、'error' 还是 'throttle'"""
+        with self._lock:
+            value = self._rng.random()
+        if value < self.throttle_rate:
+            return 'throttle'
+        if value < self.throttle_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def fake_embedding(text, dim):
+    """按文本内容生成确定性的单位向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype('float32')
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector.tolist()
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class FakeAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None  # 由make_server注入
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'invalid json'}})
+
+        path = self.path.rstrip('/')
+        self.config.enter()
+        try:
+            if path.endswith('/embeddings'):
+                return self._embeddings(payload)
+            if path.endswith('/chat/completions'):
+                return self._chat(payload)
+            return self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+        finally:
+            self.config.leave()
+
+    def _fail_if_needed(self):
+        outcome = self.config.roll()
+        if outcome == 'throttle':
+            self.config.count('throttled')
+            self._send_json(429, {'error': {'message': 'rate limit exceeded'}},
+                            {'Retry-After': str(self.config.retry_after)})
+            return True
+        if outcome == 'error':
+            self.config.count('errors')
+            self._send_json(500, {'error': {'message': 'injected upstream error'}})
+            return True
+        return False
+
+    def _embeddings(self, payload):
+        self.config.count('embeddings')
+        time.sleep(self.config.embedding_latency.sample())
+        if self._fail_if_needed():
+            return
+        texts = payload.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        self._send_json(200, {
+            'object': 'list',
+            'model': payload.get('model'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, self.config.dim)}
+                for i, text in enumerate(texts)
+            ],
+            'usage': {
+                'prompt_tokens': sum(_estimate_tokens(t) for t in texts),
+                'total_tokens': sum(_estimate_tokens(t) for t in texts),
+            },
+        })
+
+    def _chat(self, payload):
+        self.config.count('chat')
+        latency = self.config.chat_latency.sample()
+        prompt = "".join(m.get('content', '') for m in payload.get('messages', []))
+        usage = {
+            'prompt_tokens': _estimate_tokens(prompt),
+            'completion_tokens': _estimate_tokens(MOCK_REPLY),
+            'total_tokens': _estimate_tokens(prompt) + _estimate_tokens(MOCK_REPLY),
+        }
+
+        if not payload.get('stream'):
+            time.sleep(latency)
+            if self._fail_if_needed():
+                return
+            return self._send_json(200, {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': MOCK_REPLY},
+                             'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+
+        # 流式：延迟作为首个token前的等待，之后每个分片间隔stream_chunk_ms
+        pieces = [MOCK_REPLY[i:i + 8] for i in range(0, len(MOCK_REPLY), 8)]
+        time.sleep(latency)
+        if self._fail_if_needed():
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for piece in pieces:
+            chunk = {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.config.stream_chunk_ms / 1000.0)
+        final = {'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+
+class FakeAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认listen backlog为5，压测同时建立大量连接时多出的连接会被重置
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=9000, config=None):
+    """创建替身服务，调用serve_forever()开始处理请求"""
+    handler = type('ConfiguredFakeAIHandler', (FakeAIHandler,), {'config': config or FakeAIConfig()})
+    return FakeAIServer((host, port), handler)
@@ -0,0 +1,249 @@
+"""跨文档的全局向量索引
+
+向量id编码为 (document_id << 20) | chunk_index，每个文档最多约100万个分段。
+向量较少时使用IndexIDMap2(IndexFlatIP)精确检索；数量达到训练阈值后
+用已有向量训练IndexIVFFlat并迁移，查询只扫描nprobe个聚类，随语料增长保持亚线性。
+IVF本身按id存储向量并支持remove_ids，因此不再包一层IndexIDMap
+（IndexIDMap的删除逻辑假设底层索引会压缩编号，只适用于Flat）。
+
+磁盘上是快照（global.index）加增量日志（global.index.log）：添加、删除文档
+只在日志末尾追加一条记录，成本与该文档的向量数成正比，不随语料增长；
+日志超过快照大小的 compact_ratio 倍（或需要迁移到IVF）时合并写回快照并清空日志。
+各进程缓存索引，只重放自己尚未应用的日志记录；快照或日志被替换后整体重新读取。
+记录都是“替换/删除某文档的全部向量”，重复重放结果不变。
+"""
+import os
+import threading
+import uuid
+from pathlib import Path
+import faiss
+import numpy as np
+from django.conf import settings
+from .locks import file_lock
+
+CHUNK_BITS = 20
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# 日志记录：int64的[操作, 文档id, 向量数]，之后是float32向量
+OP_ADD = 1
+OP_REMOVE = 2
+RECORD_HEADER = np.dtype('int64').itemsize * 3
+# 日志小于该大小时不合并，避免快照很小时频繁重写
+COMPACT_MIN_BYTES = 1 << 20
+
+
+def encode_id(document_id, chunk_index):
+    return (int(document_id) << CHUNK_BITS) | int(chunk_index)
+
+
+def decode_id(vector_id):
+    return int(vector_id) >> CHUNK_BITS, int(vector_id) & CHUNK_MASK
+
+
+class GlobalIndex:
+    def __init__(self, path, dim, nlist=100, nprobe=8, train_threshold=None, compact_ratio=0.5):
+        self.path = Path(path)
+        self.log_path = self.path.with_name(self.path.name + '.log')
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        # IVF每个聚类至少需要约39个训练样本
+        self.train_threshold = train_threshold or nlist * 39
+        self.compact_ratio = compact_ratio
+        self._index = None
+        self._mtime = None  # 已读取快照的mtime
+        self._log_inode = None  # 已重放日志的inode，日志被替换后不再沿用偏移
+        self._log_offset = 0
+        self._lock = threading.Lock()
+
+    # ---- 读写 ----
+    def _new_flat(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+
+    def _read(self):
+        if self.path.exists():
+            return faiss.read_index(str(self.path))
+        return self._new_flat()
+
+    def _write(self, index):
+        tmp_path = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.tmp")
+        faiss.write_index(index, str(tmp_path))
+        os.replace(tmp_path, self.path)
+
+    def _current(self):
+        """返回本进程缓存的最新索引，须持有self._lock"""
+        mtime = self.path.stat().st_mtime_ns if self.path.exists() else None
+        try:
+            log_stat = self.log_path.stat()
+            log_inode, log_size = log_stat.st_ino, log_stat.st_size
+        except FileNotFoundError:
+            log_inode, log_size = None, 0
+        if (self._index is None or mtime != self._mtime or log_inode != self._log_inode
+                or log_size < self._log_offset):
+            self._index = self._read()
+            self._mtime = mtime
+            self._log_inode = log_inode
+            self._log_offset = 0
+        if log_size > self._log_offset:
+            self._replay()
+        return self._index
+
+    def _replay(self):
+        """应用日志中self._log_offset之后的完整记录；写了一半的记录留到下次"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_ino != self._log_inode:
+                    return
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        pos = 0
+        while len(data) - pos >= RECORD_HEADER:
+            op, document_id, count = np.frombuffer(data, dtype='int64', count=3, offset=pos)
+            end = pos + RECORD_HEADER + int(count) * self.dim * 4
+            if end > len(data):
+                break
+            vectors = np.frombuffer(
+                data, dtype='float32', count=int(count) * self.dim, offset=pos + RECORD_HEADER
+            ).reshape(int(count), self.dim)
+            self._apply(self._index, int(op), int(document_id), vectors)
+            pos = end
+        self._log_offset += pos
+
+    def _apply(self, index, op, document_id, vectors):
+        """在内存索引上执行一条记录，返回删除的旧向量数"""
+        removed = index.remove_ids(self._document_selector(document_id))
+        if op == OP_ADD and len(vectors):
+            ids = np.array([encode_id(document_id, i) for i in range(len(vectors))], dtype='int64')
+            index.add_with_ids(vectors, ids)
+        return removed
+
+    def _update(self, op, document_id, vectors):
+        """在跨进程锁内把记录应用到最新索引并追加到日志，返回删除的旧向量数"""
+        with file_lock(self.lock_path), self._lock:
+            index = self._current()
+            removed = self._apply(index, op, document_id, vectors)
+            if op == OP_REMOVE and not removed:
+                return 0
+            header = np.array([op, int(document_id), len(vectors)], dtype='int64')
+            with open(self.log_path, 'ab') as f:
+                f.write(header.tobytes() + vectors.tobytes())
+                log_stat = os.fstat(f.fileno())
+            self._log_inode, self._log_offset = log_stat.st_ino, log_stat.st_size
+            if self._needs_compaction(index, log_stat.st_size):
+                self._compact(index)
+            return removed
+
+    def _needs_compaction(self, index, log_size):
+        if not self._is_ivf(index) and index.ntotal >= self.train_threshold:
+            return True
+        base_size = self.path.stat().st_size if self.path.exists() else 0
+        return log_size > max(COMPACT_MIN_BYTES, base_size * self.compact_ratio)
+
+    def _compact(self, index):
+        """把内存索引写成新快照并清空日志，须持有两把锁"""
+        index = self._maybe_upgrade(index)
+        self._write(index)
+        tmp_path = self.log_path.with_name(f"{self.log_path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.touch()
+        os.replace(tmp_path, self.log_path)
+        self._index = index
+        self._mtime = self.path.stat().st_mtime_ns
+        self._log_inode, self._log_offset = self.log_path.stat().st_ino, 0
+
+    # ---- IVF迁移 ----
+    @staticmethod
+    def _is_ivf(index):
+        return isinstance(index, faiss.IndexIVF)
+
+    def _all_vectors(self, index):
+        """取出索引中的全部向量和id（用于Flat迁移到IVF）"""
+        ids = faiss.vector_to_array(index.id_map).astype('int64')
+        vectors = index.index.reconstruct_n(0, index.ntotal)
+        return vectors, ids
+
+    def _maybe_upgrade(self, index):
+        if self._is_ivf(index) or index.ntotal < self.train_threshold:
+            return index
+        vectors, ids = self._all_vectors(index)
+        quantizer = faiss.IndexFlatIP(self.dim)
+        ivf = faiss.IndexIVFFlat(quantizer, self.dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+        ivf.train(vectors)
+        ivf.add_with_ids(vectors, ids)
+        print(f"全局索引已迁移为IVF（{index.ntotal}个向量，{self.nlist}个聚类）")
+        return ivf
+
+    # ---- 公共接口 ----
+    def add_document(self, document_id, embeddings):
+        """添加（或替换）一个文档的全部分段向量"""
+        vectors = np.ascontiguousarray(embeddings, dtype='float32').reshape(-1, self.dim)
+        self._update(OP_ADD, document_id, vectors)
+
+    def remove_document(self, document_id):
+        """删除一个文档的全部向量，返回删除的数量"""
+        if not self.path.exists() and not self.log_path.exists():
+            return 0
+        return self._update(OP_REMOVE, document_id, np.empty((0, self.dim), dtype='float32'))
+
+    @staticmethod
+    def _document_selector(document_id):
+        start = int(document_id) << CHUNK_BITS
+        return faiss.IDSelectorRange(start, start + (1 << CHUNK_BITS))
+
+    def search(self, query_vector, top_k=5):
+        """返回[(document_id, chunk_index, score), ...]"""
+        query = np.ascontiguousarray(query_vector, dtype='float32').reshape(1, -1)
+        # 索引在原处更新，检索与重放、写入互斥
+        with self._lock:
+            index = self._current()
+            if index.ntotal == 0:
+                return []
+            if self._is_ivf(index):
+                index.nprobe = self.nprobe
+            scores, ids = index.search(query, top_k)
+        return [
+            (*decode_id(vector_id), float(score))
+            for score, vector_id in zip(scores[0], ids[0])
+            if vector_id >= 0
+        ]
+
+    def rebuild(self, documents):
+        """documents: [(document_id, embeddings), ...]，整体重建快照并清空日志"""
+        index = self._new_flat()
+        for document_id, embeddings in documents:
+            vectors = np.ascontiguousarray(embeddings, dtype='float32')
+            ids = np.array([encode_id(document_id, i) for i in range(len(vectors))], dtype='int64')
+            index.add_with_ids(vectors, ids)
+        with file_lock(self.lock_path), self._lock:
+            self._compact(index)
+
+    def stats(self):
+        with self._lock:
+            index = self._current()
+            return {
+                'vectors': index.ntotal,
+                'type': 'ivf' if self._is_ivf(index) else 'flat',
+            }
+
+
+_global_indexes = {}
+_global_lock = threading.Lock()
+
+
+def get_global_index(index_dir, dim):
+    """同一目录在进程内共享一个实例"""
+    path = Path(index_dir) / "global.index"
+    with _global_lock:
+        index = _global_indexes.get(str(path))
+        if index is None:
+            index = GlobalIndex(
+                path, dim,
+                nlist=getattr(settings, 'GLOBAL_INDEX_NLIST', 100),
+                nprobe=getattr(settings, 'GLOBAL_INDEX_NPROBE', 8),
+                train_threshold=getattr(settings, 'GLOBAL_INDEX_TRAIN_THRESHOLD', None),
+                compact_ratio=getattr(settings, 'GLOBAL_INDEX_COMPACT_RATIO', 0.5),
+            )
+            _global_indexes[str(path)] = index
+        return index
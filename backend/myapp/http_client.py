@@ -0,0 +1,79 @@
+"""上游AI接口共享的HTTP连接池"""
+import asyncio
+import threading
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    import httpx
+except ImportError:  # 未安装时异步视图退回线程中调用同步客户端
+    httpx = None
+
+_sessions = {}
+_lock = threading.Lock()
+# AsyncClient绑定创建它的事件循环，按循环分别缓存
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _build_session():
+    pool_size = getattr(settings, 'AI_HTTP_POOL_MAXSIZE', 20)
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, 'AI_HTTP_POOL_CONNECTIONS', 4),
+        pool_maxsize=pool_size,
+        pool_block=getattr(settings, 'AI_HTTP_POOL_BLOCK', False),
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    return session
+
+
+def get_session(base_url):
+    """按base_url返回复用的Session，所有处理器实例共享同一个连接池"""
+    key = (base_url or '').rstrip('/')
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session()
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """关闭所有连接池（配置变更或测试时使用）"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _build_async_client():
+    limits = httpx.Limits(
+        max_connections=getattr(settings, 'AI_ASYNC_MAX_CONNECTIONS', 500),
+        max_keepalive_connections=getattr(settings, 'AI_HTTP_POOL_MAXSIZE', 20),
+    )
+    return httpx.AsyncClient(limits=limits)
+
+
+def get_async_client(base_url):
+    """返回当前事件循环中按base_url复用的httpx.AsyncClient，未安装httpx时返回None"""
+    if httpx is None:
+        return None
+    key = (base_url or '').rstrip('/')
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = _build_async_client()
+    return client
+
+
+async def aclose_async_clients():
+    """关闭当前事件循环中的异步客户端"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
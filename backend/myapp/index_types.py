@@ -0,0 +1,59 @@
+"""文档向量索引的存储类型
+
+flat  原始float32，精确检索（每个1536维向量6KB）
+fp16  半精度标量量化，体积1/2，召回几乎无损
+sq8   int8标量量化，体积1/4
+pq    乘积量化，每个向量pq_m字节，但码本固定占 dim*2**pq_nbits*4 字节
+      （1536维约1.5MB）；分段数少于4*2**pq_nbits时码本摊不平且训练样本不足，
+      该文档退回sq8
+全部使用内积度量，与原IndexFlatIP一致。
+"""
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'fp16', 'sq8', 'pq')
+
+
+def build_index(vectors, index_type='flat', pq_m=64, pq_nbits=8):
+    """按index_type创建索引并加入vectors（需要训练的类型用这批向量训练）"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    dim = vectors.shape[1]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型: {index_type}")
+
+    if index_type == 'pq' and len(vectors) < 4 * (1 << pq_nbits):
+        index_type = 'sq8'
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == 'fp16':
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'sq8':
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexPQ(dim, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def index_type_of(index):
+    """返回已加载索引对应的类型名，无法识别时返回None"""
+    if isinstance(index, faiss.IndexFlat):
+        return 'flat'
+    if isinstance(index, faiss.IndexPQ):
+        return 'pq'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        qtype = index.sq.qtype
+        if qtype == faiss.ScalarQuantizer.QT_fp16:
+            return 'fp16'
+        if qtype == faiss.ScalarQuantizer.QT_8bit:
+            return 'sq8'
+    return None
+
+
+def index_nbytes(index):
+    """序列化后的字节数"""
+    return int(faiss.serialize_index(index).nbytes)
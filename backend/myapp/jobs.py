@@ -0,0 +1,189 @@
+"""基于数据库的文档处理任务队列和上传后的预处理，无需外部消息中间件"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .locks import file_lock
+from .models import PDFDocument, ProcessingJob
+
+INGEST_TASK = 'ingest'
+
+_ingest_executor = None
+_ingest_lock = threading.Lock()
+_enqueue_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """排队任务数已达上限"""
+
+
+def _enqueue_lock_file():
+    return Path(getattr(settings, 'PROCESS_JOB_LOCK_PATH', None)
+                or Path(settings.BASE_DIR) / ".job_queue.lock")
+
+
+def enqueue_job(document, task_type):
+    """创建排队任务，超过PROCESS_JOB_QUEUE_LIMIT时抛出QueueFull
+
+    计数和插入在跨进程锁内完成并提交，并发请求不会越过上限。
+    """
+    limit = getattr(settings, 'PROCESS_JOB_QUEUE_LIMIT', 100)
+    if not limit:
+        return ProcessingJob.objects.create(document=document, task_type=task_type)
+    with _enqueue_lock, file_lock(_enqueue_lock_file()), transaction.atomic():
+        pending = ProcessingJob.objects.filter(status=ProcessingJob.STATUS_PENDING).count()
+        if pending >= limit:
+            raise QueueFull(f"排队任务已达上限({limit})")
+        return ProcessingJob.objects.create(document=document, task_type=task_type)
+
+
+def requeue_stale_jobs():
+    """把开始超过PROCESS_JOB_TIMEOUT秒仍在running的任务放回队列（worker崩溃后遗留），返回数量"""
+    timeout = getattr(settings, 'PROCESS_JOB_TIMEOUT', 30 * 60)
+    if not timeout:
+        return 0
+    requeued = ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=ProcessingJob.STATUS_PENDING, started_at=None)
+    if requeued:
+        print(f"{requeued}个任务超时未完成，已重新排队")
+    return requeued
+
+
+def claim_next_job():
+    """原子地领取一个排队任务，多个worker进程并发领取也不会重复"""
+    requeue_stale_jobs()
+    candidates = ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_PENDING
+    ).values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        claimed = ProcessingJob.objects.filter(
+            pk=pk, status=ProcessingJob.STATUS_PENDING
+        ).update(status=ProcessingJob.STATUS_RUNNING, started_at=timezone.now())
+        if claimed:
+            return ProcessingJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """执行单个任务并写回结果和阶段耗时"""
+    from .ai_service import get_processor
+
+    close_old_connections()
+    processor = get_processor()
+    try:
+        document = job.document
+        pdf_path = os.path.join(settings.MEDIA_ROOT, document.pdf_file.name)
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError('PDF文件不存在')
+
+        if job.task_type == INGEST_TASK:
+            ingest_document(document.pk, processor)
+            document.refresh_from_db()
+            if document.ingest_status != PDFDocument.INGEST_READY:
+                raise RuntimeError(document.ingest_error or '预处理失败')
+            result = document.ingest_status
+        else:
+            result = processor.process_document(
+                document.index_key, pdf_path, job.task_type, global_id=document.pk,
+                content_hash=document.content_hash
+            )
+            if processor.last_error:
+                raise RuntimeError(processor.last_error)
+        job.status = ProcessingJob.STATUS_SUCCEEDED
+        job.result = result
+    except Exception as e:
+        job.status = ProcessingJob.STATUS_FAILED
+        job.error = f'处理失败: {str(e)}'
+    finally:
+        job.stage_timings = processor.stage_timings
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'error', 'stage_timings', 'finished_at'])
+        close_old_connections()
+    return job
+
+
+def run_worker(workers=None, poll_interval=1.0, once=False, stop_event=None):
+    """轮询数据库并用有界线程池执行任务
+
+    once=True时处理完当前排队任务即返回。
+    """
+    workers = workers or getattr(settings, 'PROCESS_JOB_WORKERS', 2)
+    stop_event = stop_event or threading.Event()
+    slots = threading.BoundedSemaphore(workers)
+
+    def _run(job):
+        try:
+            run_job(job)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not stop_event.is_set():
+            slots.acquire()
+            job = claim_next_job()
+            if job is None:
+                slots.release()
+                if once:
+                    break
+                stop_event.wait(poll_interval)
+                continue
+            print(f"开始处理任务 {job.pk}: 文档{job.document_id} {job.task_type}")
+            executor.submit(_run, job)
+
+
+def ingest_document(document_id, processor=None):
+    """提取、分段并建立向量索引，使首次处理请求只需调用LLM"""
+    from .ai_service import get_processor
+
+    close_old_connections()
+    documents = PDFDocument.objects.filter(pk=document_id)
+    document = documents.first()
+    if document is None:
+        return
+    documents.update(ingest_status=PDFDocument.INGEST_RUNNING, ingest_error='')
+
+    processor = processor or get_processor()
+    status, error = PDFDocument.INGEST_READY, ''
+    try:
+        pdf_path = os.path.join(settings.MEDIA_ROOT, document.pdf_file.name)
+        chunks = processor.load_chunks(pdf_path, document.content_hash)
+        if not chunks:
+            raise ValueError('无法从PDF提取文本')
+        # 内容相同的文档共用索引，已由其他文档建好时直接复用
+        if not processor.ensure_index(document.index_key, chunks, global_id=document.pk):
+            raise RuntimeError('创建向量索引失败')
+    except Exception as e:
+        print(f"文档{document_id}预处理失败: {e}")
+        status, error = PDFDocument.INGEST_FAILED, str(e)
+    finally:
+        documents.update(ingest_status=status, ingest_error=error, ingested_at=timezone.now())
+        close_old_connections()
+
+
+def _get_ingest_executor():
+    global _ingest_executor
+    with _ingest_lock:
+        if _ingest_executor is None:
+            _ingest_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'INGEST_WORKERS', 2),
+                thread_name_prefix='ingest',
+            )
+        return _ingest_executor
+
+
+def schedule_ingest(document):
+    """上传后在后台启动预处理
+
+    INGEST_BACKEND为'thread'时在本进程线程池执行，为'queue'时交给process_jobs worker。
+    """
+    backend = getattr(settings, 'INGEST_BACKEND', 'thread')
+    if backend == 'queue':
+        ProcessingJob.objects.create(document=document, task_type=INGEST_TASK)
+    elif backend == 'thread':
+        _get_ingest_executor().submit(ingest_document, document.pk)
@@ -0,0 +1,199 @@
+"""针对Django接口的并发压测驱动
+
+场景：upload（上传PDF）、process（/api/process/）、search（文档内检索）。
+通过 python manage.py load_test 运行，可配合 fake_ai_server 使用。
+"""
+import itertools
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .benchmarks import generate_pages
+from .pdf_fixtures import build_text_pdf
+
+SCENARIOS = ('upload', 'process', 'search')
+TASK_TYPES = ('summary', 'analysis', 'questions')
+
+
+def percentile(samples, pct):
+    """最近秩百分位数"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def parse_mix(text):
+    """'upload:1,process:5,search:10' -> {'upload': 1, ...}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition(':')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"未知场景: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {name: [] for name in SCENARIOS}
+        self.errors = {name: 0 for name in SCENARIOS}
+
+    def record(self, scenario, seconds, ok):
+        with self._lock:
+            self.latencies[scenario].append(seconds)
+            if not ok:
+                self.errors[scenario] += 1
+
+    def summary(self, elapsed):
+        report = {}
+        for name in SCENARIOS:
+            samples = self.latencies[name]
+            if not samples:
+                continue
+            report[name] = {
+                'requests': len(samples),
+                'errors': self.errors[name],
+                'throughput': len(samples) / elapsed if elapsed else 0.0,
+                'p50': percentile(samples, 50),
+                'p95': percentile(samples, 95),
+                'p99': percentile(samples, 99),
+                'max': max(samples),
+            }
+        return report
+
+
+class LoadDriver:
+    def __init__(self, target, concurrency=10, pages=5, timeout=120, seed=0, same_pdf=False):
+        """same_pdf：每次上传相同内容（只压测去重命中的路径），默认每次生成不同的PDF"""
+        self.target = target.rstrip('/')
+        self.concurrency = concurrency
+        self.pages = pages
+        self.seed = seed
+        self.same_pdf = same_pdf
+        self.timeout = timeout
+        self.stats = Stats()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pdf_bytes = build_text_pdf(generate_pages(pages, seed=seed)) if same_pdf else None
+        self.document_ids = []
+        self._rng = random.Random(seed)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._previous_active = []
+        self._config_id = None
+
+    # ---- AIConfig ----
+    def use_upstream(self, base_url, api_key='loadtest', model_name='gpt-3.5-turbo'):
+        """创建并激活指向替身服务的AIConfig，暂时停用其他激活配置"""
+        url = f"{self.target}/api/ai-configs/"
+        configs = self.session.get(url, timeout=self.timeout).json()
+        for config in configs:
+            if config.get('is_active'):
+                self._previous_active.append(config['id'])
+                self.session.patch(f"{url}{config['id']}/", json={'is_active': False}, timeout=self.timeout)
+        response = self.session.post(url, json={
+            'name': 'loadtest', 'api_key': api_key, 'base_url': base_url,
+            'model_name': model_name, 'is_active': True,
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        self._config_id = response.json()['id']
+
+    def restore_config(self):
+        url = f"{self.target}/api/ai-configs/"
+        if self._config_id is not None:
+            self.session.delete(f"{url}{self._config_id}/", timeout=self.timeout)
+            self._config_id = None
+        for config_id in self._previous_active:
+            self.session.patch(f"{url}{config_id}/", json={'is_active': True}, timeout=self.timeout)
+        self._previous_active = []
+
+    # ---- 场景 ----
+    def pdf_for(self, n):
+        """第n次上传的PDF；服务端按内容去重，内容不同才会真正写入文件和建索引"""
+        if self.same_pdf:
+            return self.pdf_bytes
+        return build_text_pdf(generate_pages(self.pages, seed=self.seed + n))
+
+    def upload(self):
+        n = next(self._counter)
+        response = self.session.post(
+            f"{self.target}/api/pdfs/",
+            data={'title': f'loadtest-{int(time.time())}-{n}'},
+            files={'pdf_file': (f'loadtest-{n}.pdf', self.pdf_for(n), 'application/pdf')},
+            timeout=self.timeout,
+        )
+        if response.status_code == 201:
+            with self._lock:
+                self.document_ids.append(response.json()['id'])
+        return response.status_code == 201
+
+    def _pick_document(self):
+        with self._lock:
+            return self._rng.choice(self.document_ids) if self.document_ids else None
+
+    def process(self):
+        document_id = self._pick_document()
+        if document_id is None:
+            return self.upload()
+        response = self.session.post(f"{self.target}/api/process/", json={
+            'document_id': document_id,
+            'task_type': self._rng.choice(TASK_TYPES),
+        }, timeout=self.timeout)
+        return response.status_code == 200 and response.json().get('success', False)
+
+    def search(self):
+        document_id = self._pick_document()
+        if document_id is None:
+            return self.upload()
+        response = self.session.get(
+            f"{self.target}/api/pdfs/{document_id}/search/",
+            params={'q': self._rng.choice(('student', 'analysis', 'method', 'teacher'))},
+            timeout=self.timeout,
+        )
+        return response.status_code == 200
+
+    def cleanup(self):
+        for document_id in self.document_ids:
+            self.session.delete(f"{self.target}/api/pdfs/{document_id}/", timeout=self.timeout)
+        self.document_ids = []
+
+    # ---- 运行 ----
+    def _run_one(self, scenario):
+        start = time.perf_counter()
+        try:
+            ok = getattr(self, scenario)()
+        except requests.RequestException:
+            ok = False
+        self.stats.record(scenario, time.perf_counter() - start, ok)
+
+    def run(self, mix, requests_count=None, duration=None, warmup_uploads=1):
+        """按权重随机选择场景并发执行，返回汇总报告"""
+        for _ in range(warmup_uploads):
+            self.upload()
+        self.stats = Stats()
+
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = itertools.count() if requests_count is None else iter(range(requests_count))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            slots = threading.BoundedSemaphore(self.concurrency * 2)
+            for _ in remaining:
+                if deadline and time.perf_counter() >= deadline:
+                    break
+                slots.acquire()
+                scenario = self._rng.choices(names, weights)[0]
+                future = executor.submit(self._run_one, scenario)
+                future.add_done_callback(lambda _: slots.release())
+        elapsed = time.perf_counter() - start
+        return {'elapsed': elapsed, 'concurrency': self.concurrency, 'scenarios': self.stats.summary(elapsed)}
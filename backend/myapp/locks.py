@@ -0,0 +1,52 @@
+"""跨进程文件锁（Linux/macOS用fcntl，Windows用msvcrt）"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock(fd, blocking):
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.flock(fd, flags)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    if not blocking:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """持有path对应的排他锁；blocking=False且锁被占用时抛出BlockingIOError"""
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            _lock(fd, blocking)
+        except OSError as e:
+            raise BlockingIOError(str(e))
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,31 @@
+import faiss
+from django.core.management.base import BaseCommand
+from myapp.ai_service import get_processor
+from myapp.models import PDFDocument
+
+
+class Command(BaseCommand):
+    help = '根据已有的文档向量索引重建跨文档全局索引'
+
+    def handle(self, *args, **options):
+        processor = get_processor()
+        if processor.global_index is None:
+            self.stdout.write('GLOBAL_INDEX_ENABLED为False，跳过')
+            return
+
+        # 内容相同的文档共用一个索引，全局索引中只记在id最小的文档名下
+        documents, seen = [], set()
+        for document in PDFDocument.objects.order_by('pk').only('pk', 'content_hash'):
+            key = document.index_key
+            index_file = processor.index_path / f"{key}.index"
+            if key in seen or not index_file.exists():
+                continue
+            seen.add(key)
+            index = faiss.read_index(str(index_file))
+            documents.append((document.pk, index.reconstruct_n(0, index.ntotal)))
+
+        processor.global_index.rebuild(documents)
+        stats = processor.global_index.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"全局索引已重建：{len(documents)}个文档，{stats['vectors']}个向量（{stats['type']}）"
+        ))
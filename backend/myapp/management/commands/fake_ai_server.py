@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from myapp.fake_ai_server import FakeAIConfig, LatencyModel, make_server
+
+
+class Command(BaseCommand):
+    help = '启动本地OpenAI兼容替身服务（/embeddings、/chat/completions），用于压测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9000)
+        parser.add_argument('--latency-dist', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+        parser.add_argument('--chat-latency-ms', type=float, default=800.0, help='对话接口延迟中位数')
+        parser.add_argument('--chat-spread-ms', type=float, default=300.0)
+        parser.add_argument('--embedding-latency-ms', type=float, default=60.0, help='嵌入接口延迟中位数')
+        parser.add_argument('--embedding-spread-ms', type=float, default=20.0)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的比例')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回429的比例')
+        parser.add_argument('--retry-after', type=int, default=1, help='429响应的Retry-After秒数')
+        parser.add_argument('--stream-chunk-ms', type=float, default=20.0, help='流式输出分片间隔')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        dist = options['latency_dist']
+        config = FakeAIConfig(
+            chat_latency=LatencyModel(dist, options['chat_latency_ms'], options['chat_spread_ms'], options['seed']),
+            embedding_latency=LatencyModel(
+                dist, options['embedding_latency_ms'], options['embedding_spread_ms'], options['seed']
+            ),
+            error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'],
+            retry_after=options['retry_after'],
+            stream_chunk_ms=options['stream_chunk_ms'],
+            seed=options['seed'],
+        )
+        server = make_server(options['host'], options['port'], config)
+        self.stdout.write(f"替身服务已启动: http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"请求统计: {config.counters}")
@@ -0,0 +1,55 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from myapp.loadtest import LoadDriver, parse_mix
+
+
+class Command(BaseCommand):
+    help = '对运行中的Django服务进行并发压测，报告p50/p95/p99延迟和吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='http://127.0.0.1:8000', help='Django服务地址')
+        parser.add_argument('--upstream', default=None,
+                            help='替身服务base_url（如 http://127.0.0.1:9000/v1），会创建并激活对应AIConfig')
+        parser.add_argument('--mix', default='upload:1,process:4,search:10', help='场景及权重')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=None, help='总请求数')
+        parser.add_argument('--duration', type=float, default=30.0, help='持续时间（秒），与--requests二选一')
+        parser.add_argument('--pages', type=int, default=5, help='上传PDF的页数')
+        parser.add_argument('--same-pdf', action='store_true',
+                            help='每次上传相同内容（只压测按内容去重后的上传路径）')
+        parser.add_argument('--output', default=None, help='把报告写入JSON文件')
+        parser.add_argument('--keep-documents', action='store_true', help='结束后保留压测上传的文档')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        driver = LoadDriver(
+            options['target'], options['concurrency'], options['pages'], same_pdf=options['same_pdf']
+        )
+        if options['upstream']:
+            driver.use_upstream(options['upstream'])
+        try:
+            report = driver.run(
+                mix,
+                requests_count=options['requests'],
+                duration=None if options['requests'] else options['duration'],
+            )
+        finally:
+            if not options['keep_documents']:
+                driver.cleanup()
+            if options['upstream']:
+                driver.restore_config()
+
+        self.stdout.write(f"耗时 {report['elapsed']:.1f}s，并发 {report['concurrency']}")
+        self.stdout.write(f"{'场景':<8}{'请求':>8}{'错误':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for name, row in report['scenarios'].items():
+            self.stdout.write(
+                f"{name:<8}{row['requests']:>8}{row['errors']:>6}{row['throughput']:>9.2f}"
+                f"{row['p50'] * 1000:>7.0f}ms{row['p95'] * 1000:>7.0f}ms{row['p99'] * 1000:>7.0f}ms"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from myapp.ai_service import get_processor
+from myapp.caches import index_cache
+from myapp.chunk_store import migrate_json
+
+
+class Command(BaseCommand):
+    help = '把faiss_index下旧的 {id}_chunks.json 转换为二进制 {id}.chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-json', action='store_true',
+                            help='转换后保留原JSON文件')
+
+    def handle(self, *args, **options):
+        processor = get_processor()
+        converted = failed = 0
+        for json_path in sorted(processor.index_path.glob('*_chunks.json')):
+            try:
+                migrate_json(json_path, remove=not options['keep_json'])
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"{json_path.name} 转换失败: {e}")
+                continue
+            document_id = json_path.name[:-len('_chunks.json')]
+            index_cache.invalidate(processor.index_path / f"{document_id}.index")
+            converted += 1
+        self.stdout.write(self.style.SUCCESS(f"已转换{converted}个分段文件，失败{failed}个"))
@@ -0,0 +1,56 @@
+import os
+from django.core.management.base import BaseCommand
+from myapp.ai_service import file_sha256, get_processor
+from myapp.caches import index_cache
+from myapp.models import PDFDocument
+from myapp.storage import content_path, get_pdf_storage
+
+
+class Command(BaseCommand):
+    help = '把按标题命名的旧PDF迁移为按内容哈希存储，相同内容的文档合并文件和向量索引'
+
+    def handle(self, *args, **options):
+        processor = get_processor()
+        storage = get_pdf_storage()
+        migrated = merged = missing = 0
+        for document in PDFDocument.objects.filter(content_hash='').order_by('pk'):
+            old_path = storage.path(document.pdf_file.name)
+            if not os.path.isfile(old_path):
+                missing += 1
+                self.stderr.write(f"文档{document.pk}的文件不存在: {document.pdf_file.name}")
+                continue
+            digest = file_sha256(old_path)
+            ext = os.path.splitext(document.pdf_file.name)[1].lstrip('.') or 'pdf'
+            name = content_path(digest, ext)
+            new_path = storage.path(name)
+            # 与上传写入、释放最后引用时的删除互斥，文件和引用一起落地
+            with storage.content_lock(name):
+                if os.path.exists(new_path):
+                    os.remove(old_path)
+                else:
+                    os.replace(old_path, new_path)
+                PDFDocument.objects.filter(pk=document.pk).update(content_hash=digest, pdf_file=name)
+
+            if (processor.index_path / f"{digest}.index").exists():
+                # 该内容已有索引：丢弃本文档的重复索引和全局索引条目
+                processor.invalidate_document(document.pk)
+                merged += 1
+            else:
+                self._move_index(processor, str(document.pk), digest)
+                migrated += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"已迁移{migrated}个文档，合并{merged}个重复内容的文档，{missing}个文件不存在"
+        ))
+
+    @staticmethod
+    def _move_index(processor, old_key, new_key):
+        """把旧索引和分段文件改名为内容哈希（全局索引仍记在原文档id下）"""
+        old_index = processor.index_path / f"{old_key}.index"
+        if not old_index.exists():
+            return
+        for suffix in ('.chunks', '_chunks.json'):
+            old_chunks = processor.index_path / f"{old_key}{suffix}"
+            if old_chunks.exists():
+                os.replace(old_chunks, processor.index_path / f"{new_key}{suffix}")
+        os.replace(old_index, processor.index_path / f"{new_key}.index")
+        index_cache.invalidate(old_index)
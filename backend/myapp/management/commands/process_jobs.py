@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from myapp.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = '运行文档处理任务worker（轮询数据库队列）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='并发执行的任务数，默认使用PROCESS_JOB_WORKERS')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true',
+                            help='处理完当前排队任务后退出')
+
+    def handle(self, *args, **options):
+        self.stdout.write('任务worker已启动')
+        try:
+            run_worker(
+                workers=options['workers'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('任务worker已停止')
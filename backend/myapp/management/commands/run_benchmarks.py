@@ -0,0 +1,78 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from myapp.benchmarks import (
+    DEFAULT_PAGE_COUNTS,
+    STAGES,
+    benchmark_index_types,
+    compare_to_baseline,
+    load_report,
+    run_benchmarks,
+    save_report,
+)
+
+
+class Command(BaseCommand):
+    help = '运行文档处理流水线微基准测试，并与基线比较'
+
+    def add_arguments(self, parser):
+        default_dir = os.path.join(settings.BASE_DIR, 'benchmarks')
+        parser.add_argument('--pages', type=int, nargs='+', default=list(DEFAULT_PAGE_COUNTS),
+                            help='生成PDF的页数，可指定多个')
+        parser.add_argument('--repeat', type=int, default=3, help='每个阶段重复次数，取中位数')
+        parser.add_argument('--queries', type=int, default=20, help='热缓存检索的查询次数')
+        parser.add_argument('--output', default=os.path.join(default_dir, 'latest.json'),
+                            help='结果JSON路径')
+        parser.add_argument('--baseline', default=os.path.join(default_dir, 'baseline.json'),
+                            help='基线JSON路径')
+        parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='允许比基线慢的比例，超过即视为回归')
+        parser.add_argument('--index-types', action='store_true',
+                            help='只比较各FAISS索引类型的体积与召回率')
+        parser.add_argument('--vectors', type=int, default=2000,
+                            help='--index-types 使用的向量数')
+
+    def handle(self, *args, **options):
+        if options['index_types']:
+            return self._index_types(options)
+
+        report = run_benchmarks(options['pages'], options['repeat'], options['queries'])
+        save_report(report, options['output'])
+
+        header = f"{'pages':>6} " + " ".join(f"{stage:>12}" for stage in STAGES)
+        self.stdout.write(header)
+        for page_count, stages in report['results'].items():
+            row = " ".join(f"{stages[stage]['median'] * 1000:>10.2f}ms" for stage in STAGES)
+            self.stdout.write(f"{page_count:>6} {row}")
+        self.stdout.write(f"结果已写入 {options['output']}")
+
+        if options['save_baseline']:
+            save_report(report, options['baseline'])
+            self.stdout.write(f"基线已更新 {options['baseline']}")
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write('未找到基线，使用 --save-baseline 创建')
+            return
+
+        regressions = compare_to_baseline(report, load_report(options['baseline']), options['tolerance'])
+        for item in regressions:
+            self.stdout.write(self.style.ERROR(
+                f"回归: {item['pages']}页 {item['stage']} "
+                f"{item['baseline'] * 1000:.2f}ms -> {item['current'] * 1000:.2f}ms (x{item['ratio']:.2f})"
+            ))
+        if regressions:
+            raise CommandError(f'{len(regressions)}个阶段慢于基线')
+        self.stdout.write(self.style.SUCCESS('未发现性能回归'))
+
+    def _index_types(self, options):
+        report = benchmark_index_types(vectors=options['vectors'], queries=options['queries'])
+        self.stdout.write(f"{report['vectors']}个{report['dim']}维向量，recall@{report['top_k']}相对flat")
+        self.stdout.write(f"{'type':>6} {'bytes/vec':>10} {'total':>10} {'recall':>7} {'build':>9} {'search':>9}")
+        for index_type, item in report['results'].items():
+            name = index_type if item['actual_type'] == index_type else f"{index_type}*"
+            self.stdout.write(
+                f"{name:>6} {item['bytes_per_vector']:>10.0f} {item['bytes'] / 1024 / 1024:>8.2f}MB "
+                f"{item['recall']:>7.3f} {item['build'] * 1000:>7.1f}ms {item['search'] * 1000:>7.3f}ms"
+            )
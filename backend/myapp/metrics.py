@@ -0,0 +1,176 @@
+"""进程内指标，以Prometheus文本格式从 /metrics 输出
+
+- pdfai_stage_seconds：处理阶段耗时直方图。stage取值：
+    extract（PDF解析）、chunk（清洗和分句分段，与解析按页交替进行）、
+    embed、index_build、search，以及process_document记录的
+    chunks、index、context、llm、map、reduce
+- pdfai_cache_requests_total：各级缓存的命中/未命中
+- pdfai_upstream_errors_total：上游接口失败（最终结果，重试成功的不计）
+- pdfai_llm_tokens_total：上游返回的usage
+上游限流器和索引缓存的统计在抓取时通过collector读取。
+指标只在当前进程内累计，多进程部署时需逐个进程抓取。
+METRICS_ENABLED=False时所有记录函数直接返回。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        if not enabled():
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 标签 -> [各桶计数（不累加）, 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        if not enabled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = _format_labels(labels + [('le', _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('pdfai_stage_seconds', '处理阶段耗时（秒）', ['stage'])
+CACHE_REQUESTS = Counter('pdfai_cache_requests_total', '缓存查询次数', ['cache', 'status'])
+UPSTREAM_ERRORS = Counter('pdfai_upstream_errors_total', '上游接口失败次数', ['endpoint', 'reason'])
+LLM_TOKENS = Counter('pdfai_llm_tokens_total', '上游usage中的token数', ['model', 'type'])
+
+_metrics = [STAGE_SECONDS, CACHE_REQUESTS, UPSTREAM_ERRORS, LLM_TOKENS]
+_collectors = []
+
+
+def register_collector(fn):
+    """fn()返回[(名称, 类型, 说明, [(标签dict, 值), ...])]，抓取时调用"""
+    _collectors.append(fn)
+    return fn
+
+
+def record_usage(model, usage):
+    """累计响应usage字段中的token数"""
+    if not usage or not enabled():
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        value = usage.get(kind)
+        if isinstance(value, int):
+            LLM_TOKENS.inc(value, model=model, type=kind[:-len('_tokens')])
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            print(f"读取指标失败: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in _metrics:
+        metric.clear()
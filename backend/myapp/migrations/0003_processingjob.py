@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_aiconfig'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_type', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pending', '排队中'), ('running', '处理中'), ('succeeded', '已完成'), ('failed', '失败')], db_index=True, default='pending', max_length=20)),
+                ('result', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('stage_timings', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='myapp.pdfdocument')),
+            ],
+            options={
+                'verbose_name': '处理任务',
+                'verbose_name_plural': '处理任务',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='ingest_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='ingest_status',
+            field=models.CharField(choices=[('pending', '等待预处理'), ('running', '预处理中'), ('ready', '已就绪'), ('failed', '预处理失败')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='ingested_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+import myapp.models
+import myapp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_pdfdocument_ingest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='pdfdocument',
+            name='pdf_file',
+            field=models.FileField(storage=myapp.storage.get_pdf_storage, upload_to=myapp.models.pdf_upload_path),
+        ),
+    ]
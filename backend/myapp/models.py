@@ -1,9 +1,11 @@
 
-from django.db import models
-from django.db.models.signals import post_delete
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 import os
 import json
+import functools
+from .storage import content_path, content_sha256, get_pdf_storage, is_content_path
 
 class Task(models.Model):
     title = models.CharField(max_length=200)
@@ -16,32 +18,120 @@ class Task(models.Model):
     
 
 def pdf_upload_path(instance, filename):
-    # 使用文档标题作为文件名，保留PDF扩展名
+    # 按内容哈希命名，相同内容的上传共用一个文件（哈希在pre_save中计算）
     ext = filename.split('.')[-1]
+    if instance.content_hash:
+        return content_path(instance.content_hash, ext)
     return f"pdfs/{instance.title}.{ext}"
 
 class PDFDocument(models.Model):
+    INGEST_PENDING = 'pending'
+    INGEST_RUNNING = 'running'
+    INGEST_READY = 'ready'
+    INGEST_FAILED = 'failed'
+    INGEST_STATUS_CHOICES = [
+        (INGEST_PENDING, '等待预处理'),
+        (INGEST_RUNNING, '预处理中'),
+        (INGEST_READY, '已就绪'),
+        (INGEST_FAILED, '预处理失败'),
+    ]
+
     title = models.CharField(max_length=255)
-    pdf_file = models.FileField(upload_to=pdf_upload_path)
+    pdf_file = models.FileField(upload_to=pdf_upload_path, storage=get_pdf_storage)
+    # 文件内容的SHA-256；旧数据为空，运行migrate_pdf_storage后补齐
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file_size = models.IntegerField(default=0)
+    # 上传后后台完成文本提取、分段和向量索引
+    ingest_status = models.CharField(max_length=20, choices=INGEST_STATUS_CHOICES, default=INGEST_PENDING)
+    ingest_error = models.TextField(blank=True)
+    ingested_at = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
         return self.title
     
     def filename(self):
+        if is_content_path(self.pdf_file.name):
+            return f"{self.title}{os.path.splitext(self.pdf_file.name)[1]}"
         return os.path.basename(self.pdf_file.name)
     
+    @property
+    def index_key(self):
+        """向量索引、分段文件的命名键：内容相同的文档共用，旧数据沿用文档id"""
+        return self.content_hash or str(self.pk)
+    
+
+def release_pdf_content(document_id, content_hash, file_name):
+    """文档不再使用某份内容时调用（删除或替换文件）
+
+    还有其他文档使用该内容时只把全局索引中的向量转记到其中一个文档下；
+    没有引用时删除文件、向量索引、分段和文本缓存。须在删除/替换提交后调用，
+    引用检查和删除在内容锁内进行，与并发上传的写入互斥。
+    """
+    from .ai_service import get_processor
+    processor = get_processor()
+    storage = get_pdf_storage()
+    file_path = storage.path(file_name)
+    if not content_hash:
+        processor.invalidate_document(document_id, file_path)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        return
+
+    with storage.content_lock(file_name):
+        survivor = (PDFDocument.objects.filter(content_hash=content_hash)
+                    .exclude(pk=document_id).order_by('pk').first())
+        if survivor is None:
+            processor.invalidate_document(content_hash, file_path)
+            processor.remove_global_entries(document_id)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            return
+    processor.transfer_global_entries(content_hash, document_id, survivor.pk)
+    
 
 ## 神必reciever写法
 @receiver(post_delete, sender=PDFDocument)
 def delete_pdf_file(sender, instance, **kwargs):
     """
-    当PDFDocument实例被删除时，同时删除对应的文件
+    当PDFDocument实例被删除时，同时删除对应的文件（其他文档仍在使用时保留）
     """
     if instance.pdf_file:
-        if os.path.isfile(instance.pdf_file.path):
-            os.remove(instance.pdf_file.path)
+        transaction.on_commit(functools.partial(
+            release_pdf_content, instance.pk, instance.content_hash, instance.pdf_file.name
+        ))
+
+
+@receiver(pre_save, sender=PDFDocument)
+def invalidate_replaced_pdf(sender, instance, **kwargs):
+    """
+    新文件计算内容哈希；PDF文件被替换时在提交后释放旧内容
+    """
+    if not instance.pdf_file or instance.pdf_file._committed:
+        return
+    instance.content_hash = content_sha256(instance.pdf_file.file)
+    # 保存后pdf_file只剩文件名，留住上传内容供restore_pdf_content使用
+    instance._pdf_content = instance.pdf_file.file
+    if not instance.pk:
+        return
+    old = PDFDocument.objects.filter(pk=instance.pk).first()
+    if old and old.pdf_file and (old.content_hash != instance.content_hash or not old.content_hash):
+        transaction.on_commit(functools.partial(
+            release_pdf_content, old.pk, old.content_hash, old.pdf_file.name
+        ))
+
+
+@receiver(post_save, sender=PDFDocument)
+def restore_pdf_content(sender, instance, **kwargs):
+    """
+    引用提交后确认内容文件仍在：保存时文件已存在而跳过写入，但在提交前
+    最后一个旧引用被释放、文件被删除时，用本次上传的内容重新写入
+    """
+    content = instance.__dict__.pop('_pdf_content', None)
+    if content is None or not is_content_path(instance.pdf_file.name):
+        return
+    name = instance.pdf_file.name
+    transaction.on_commit(functools.partial(get_pdf_storage().ensure_content, name, content))
 
 
 class AIConfig(models.Model):
@@ -62,4 +152,46 @@ class AIConfig(models.Model):
 
     class Meta:
         verbose_name = 'AI配置'
-        verbose_name_plural = 'AI配置'
\ No newline at end of file
+        verbose_name_plural = 'AI配置'
+
+
+@receiver(post_save, sender=AIConfig)
+@receiver(post_delete, sender=AIConfig)
+def invalidate_ai_config(sender, instance, **kwargs):
+    """
+    AI配置变更后，所有进程中缓存的激活配置失效
+    """
+    from .ai_service import invalidate_active_config
+    invalidate_active_config()
+
+
+class ProcessingJob(models.Model):
+    """文档处理异步任务"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '排队中'),
+        (STATUS_RUNNING, '处理中'),
+        (STATUS_SUCCEEDED, '已完成'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    document = models.ForeignKey(PDFDocument, on_delete=models.CASCADE, related_name='jobs')
+    task_type = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    stage_timings = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.document_id}:{self.task_type}:{self.status}"
+
+    class Meta:
+        ordering = ['created_at']
+        verbose_name = '处理任务'
+        verbose_name_plural = '处理任务'
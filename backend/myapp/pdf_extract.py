@@ -0,0 +1,47 @@
+"""按页流式提取PDF文本，大文件按页范围分发到进程池
+
+本模块不依赖Django，进程池的子进程只需导入PyPDF2。
+"""
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+
+
+def _extract_range(pdf_path, start, stop):
+    """子进程中提取[start, stop)页的文本"""
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+def iter_page_texts(pdf_path, workers=1, pool_threshold=100, pages_per_task=20):
+    """按页序yield每页文本
+
+    页数达到pool_threshold且workers>1时，按pages_per_task页一组交给进程池，
+    同时最多有workers*2组在处理中，内存占用受限于在途页数。
+    workers不超过CPU核数，单核机器上进程池只会更慢。
+    """
+    workers = min(workers, os.cpu_count() or 1)
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        total = len(reader.pages)
+        if workers <= 1 or total < pool_threshold:
+            for page in reader.pages:
+                yield page.extract_text() or ""
+            return
+
+    ranges = [(start, min(start + pages_per_task, total))
+              for start in range(0, total, pages_per_task)]
+    max_in_flight = workers * 2
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < max_in_flight:
+                start, stop = ranges[next_range]
+                pending.append(executor.submit(_extract_range, str(pdf_path), start, stop))
+                next_range += 1
+            yield from pending.popleft().result()
@@ -0,0 +1,234 @@
+"""按需的请求级性能剖析
+
+触发方式（ProfilingMiddleware）：
+- 管理员请求带 X-Profile: 1 头或 ?profile=1 参数；管理员指已登录的staff用户，
+  或 X-Profile-Token 头与 PROFILE_TOKEN 一致
+- 路径以 PROFILE_SAMPLE_PATHS 中任一前缀开头的请求按 PROFILE_SAMPLE_RATE 抽样
+
+同步请求用cProfile记录调用栈（只覆盖处理请求的线程，嵌入批次等线程池任务
+只体现为等待）。Python 3.12起同一解释器只能有一个cProfile在运行，因此同时只
+剖析一个同步请求，其余请求照常处理、不剖析；异步请求只记录阶段耗时，整体CPU时间不记录（事件循环线程
+同时在处理其他请求）。DocumentProcessor._stage 把各阶段的墙钟时间和所在线程
+的CPU时间报告给当前请求的剖析记录。流式响应只覆盖到响应对象返回为止。
+结果写入 PROFILE_DIR：<id>.json（摘要）和 <id>.prof（pstats格式，可用
+snakeviz等工具查看），只保留最近 PROFILE_KEEP 个。
+"""
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+_current = contextvars.ContextVar('profile', default=None)
+# 同一时间只允许一个cProfile处于启用状态
+_profiler_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, request, reason):
+        self.created_at = time.time()
+        # id按时间排序，文件名即可确定新旧
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created_at))
+        self.id = f"{stamp}-{int(self.created_at * 1e6) % 1000000:06d}-{uuid.uuid4().hex[:6]}"
+        self.method = request.method
+        self.path = request.path
+        self.reason = reason
+        self.stages = {}
+        self.profiler = None
+
+    def record_stage(self, name, wall, cpu):
+        """同名阶段（如map的多层）累加"""
+        stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        stage['calls'] += 1
+
+
+def record_stage(name, wall, cpu):
+    profile = _current.get()
+    if profile is not None:
+        profile.record_stage(name, wall, cpu)
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', None) or Path(settings.BASE_DIR) / 'profiles')
+
+
+def is_profile_admin(request):
+    """staff用户，或X-Profile-Token与PROFILE_TOKEN一致"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    token = getattr(settings, 'PROFILE_TOKEN', '')
+    supplied = request.headers.get('X-Profile-Token', '')
+    return bool(token) and hmac.compare_digest(token.encode('utf-8'), supplied.encode('utf-8'))
+
+
+def profile_reason(request):
+    """需要剖析时返回触发原因（'requested'或'sampled'），否则None"""
+    requested = request.headers.get('X-Profile') == '1' or request.GET.get('profile') == '1'
+    if requested and is_profile_admin(request):
+        return 'requested'
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+    if rate > 0 and request.path.startswith(tuple(getattr(settings, 'PROFILE_SAMPLE_PATHS', ()))):
+        if random.random() < rate:
+            return 'sampled'
+    return None
+
+
+def _top_functions(profiler, limit=30):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def save_profile(profile, status_code, wall, cpu):
+    """写入摘要和pstats文件，返回摘要"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    summary = {
+        'id': profile.id,
+        'method': profile.method,
+        'path': profile.path,
+        'reason': profile.reason,
+        'status': status_code,
+        'created_at': profile.created_at,
+        'wall': round(wall, 4),
+        'cpu': round(cpu, 4) if cpu is not None else None,
+        'stages': {
+            name: {'wall': round(s['wall'], 4), 'cpu': round(s['cpu'], 4), 'calls': s['calls']}
+            for name, s in profile.stages.items()
+        },
+        'has_stats': profile.profiler is not None,
+    }
+    if profile.profiler is not None:
+        summary['top'] = _top_functions(profile.profiler)
+        profile.profiler.dump_stats(str(directory / f"{profile.id}.prof"))
+    tmp_path = directory / f"{profile.id}.json.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False)
+    os.replace(tmp_path, directory / f"{profile.id}.json")
+    _prune(directory, getattr(settings, 'PROFILE_KEEP', 50))
+    return summary
+
+
+def _prune(directory, keep):
+    summaries = sorted(directory.glob('*.json'), key=lambda p: p.name, reverse=True)
+    for path in summaries[keep:]:
+        for stale in (path, path.with_suffix('.prof')):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=50):
+    """最近的剖析摘要（不含调用栈文本），按时间倒序"""
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    results = []
+    for path in sorted(directory.glob('*.json'), key=lambda p: p.name, reverse=True)[:limit]:
+        summary = _read_summary(path)
+        if summary is not None:
+            summary.pop('top', None)
+            results.append(summary)
+    return results
+
+
+def load_profile(profile_id):
+    """按id读取摘要，id不合法或不存在时返回None"""
+    if not _valid_id(profile_id):
+        return None
+    return _read_summary(profile_dir() / f"{profile_id}.json")
+
+
+def stats_path(profile_id):
+    """pstats文件路径，不存在时返回None"""
+    if not _valid_id(profile_id):
+        return None
+    path = profile_dir() / f"{profile_id}.prof"
+    return path if path.exists() else None
+
+
+def _valid_id(profile_id):
+    return bool(profile_id) and all(c.isalnum() or c == '-' for c in profile_id)
+
+
+def _read_summary(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ProfilingMiddleware:
+    """按请求开启剖析，响应中带 X-Profile-Id 头"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        reason = profile_reason(request)
+        if reason is None:
+            return self.get_response(request)
+        if not _profiler_lock.acquire(blocking=False):
+            print("已有请求正在剖析，本次请求不剖析")
+            return self.get_response(request)
+
+        try:
+            profile = RequestProfile(request, reason)
+            profile.profiler = cProfile.Profile()
+            token = _current.set(profile)
+            wall, cpu = time.perf_counter(), time.thread_time()
+            profile.profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.profiler.disable()
+                _current.reset(token)
+        finally:
+            _profiler_lock.release()
+        return self._finish(profile, response, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    async def __acall__(self, request):
+        reason = profile_reason(request)
+        if reason is None:
+            return await self.get_response(request)
+
+        profile = RequestProfile(request, reason)
+        token = _current.set(profile)
+        wall = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(profile, response, time.perf_counter() - wall, None)
+
+    @staticmethod
+    def _finish(profile, response, wall, cpu):
+        try:
+            save_profile(profile, response.status_code, wall, cpu)
+            response['X-Profile-Id'] = profile.id
+        except OSError as e:
+            print(f"保存剖析结果失败: {e}")
+        return response
@@ -9,6 +9,7 @@ from rest_framework import serializers
 from .models import Task
 from .models import PDFDocument
 from .models import AIConfig
+from .models import ProcessingJob
 
 
 # ----------------------------------------------------------------------------
@@ -36,6 +37,9 @@ class PDFDocumentSerializer(serializers.ModelSerializer):
     - uploaded_at: datetime when the file was uploaded (read-only)
     - file_size: integer file size in bytes (read-only)
     - filename: read-only field that typically contains the original file name
+    - ingest_status: background ingest state (pending/running/ready/failed)
+    - ingest_error: reason for a failed ingest, empty otherwise
+    - ingested_at: datetime when the last ingest finished
 
     The `filename` field is declared as ReadOnlyField here
     """
@@ -55,10 +59,19 @@ class PDFDocumentSerializer(serializers.ModelSerializer):
             "uploaded_at",
             "file_size",
             "filename",
+            "ingest_status",
+            "ingest_error",
+            "ingested_at",
         ]
         # These fields are managed by the server and must not be writable by
         # clients.
-        read_only_fields = ["uploaded_at", "file_size"]
+        read_only_fields = [
+            "uploaded_at",
+            "file_size",
+            "ingest_status",
+            "ingest_error",
+            "ingested_at",
+        ]
 
 
 # ----------------------------------------------------------------------------
@@ -71,3 +84,32 @@ class AIConfigSerializer(serializers.ModelSerializer):
     class Meta:
         model = AIConfig
         fields = "__all__"
+
+
+# ----------------------------------------------------------------------------
+# ProcessingJobSerializer
+# ----------------------------------------------------------------------------
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    """Read-only serializer for ProcessingJob status polling.
+
+    `stage_timings` maps pipeline stage names (chunks, index, llm) to seconds.
+    """
+
+    document_title = serializers.CharField(source="document.title", read_only=True)
+
+    class Meta:
+        model = ProcessingJob
+        fields = [
+            "id",
+            "document",
+            "document_title",
+            "task_type",
+            "status",
+            "result",
+            "error",
+            "stage_timings",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
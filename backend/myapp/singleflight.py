@@ -0,0 +1,192 @@
+"""合并重复的并发计算（single-flight）
+
+同一key同时只有一个调用者（leader）真正执行，其余调用者等待并拿到同一结果：
+- 同进程内的线程等待leader的Event，直接共享返回值
+- 其他进程阻塞在 lock_dir/<hash>.lock 的文件锁上；leader把成功结果写入
+  <hash>.result，等待者拿到锁后读取在自己开始等待之后写入的结果，
+  没有（leader失败）则自己执行
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from .locks import file_lock
+
+# 清理超过该时间未使用的锁文件和结果文件
+STALE_SECONDS = 3600
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.outcome = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir):
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._calls = {}
+        self._async_calls = weakref.WeakKeyDictionary()  # 事件循环 -> {key: Future}
+        self._mutex = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _paths(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return self.lock_dir / f"{name}.lock", self.lock_dir / f"{name}.result"
+
+    @contextmanager
+    def lock(self, key):
+        """key对应的排他锁；每次调用单独打开锁文件，同进程的其他线程同样会被阻塞"""
+        lock_path, _ = self._paths(key)
+        with file_lock(lock_path):
+            os.utime(lock_path)
+            yield
+        self._maybe_sweep()
+
+    def do(self, key, fn, since=None):
+        """fn返回(ok, value)；返回(ok, value, shared)，shared表示结果来自其他调用者
+
+        since：调用者开始请求的时间，只接受其他进程在此之后写入的结果。
+        """
+        with self._mutex:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return (*call.outcome, True)
+
+        started = since if since is not None else time.time()
+        _, result_path = self._paths(key)
+        try:
+            with self.lock(key):
+                shared = self._read_result(result_path, started)
+                if shared is not None:
+                    call.outcome = (True, shared)
+                    return True, shared, True
+                ok, value = fn()
+                if ok:
+                    self._write_result(result_path, value)
+                call.outcome = (ok, value)
+                return ok, value, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._mutex:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn, since=None):
+        """do()的异步版本，fn为返回(ok, value)的协程函数
+
+        同一事件循环内的调用者等待leader的Future；只有leader在线程池中等待文件锁。
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            return (*await asyncio.shield(future), True)
+
+        future = calls[key] = loop.create_future()
+        # 没有等待者时也不报"exception was never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        started = since if since is not None else time.time()
+        lock_path, result_path = self._paths(key)
+        try:
+            lock = file_lock(lock_path)
+            await self._acquire(loop, lock)
+            try:
+                os.utime(lock_path)
+                shared = self._read_result(result_path, started)
+                if shared is not None:
+                    future.set_result((True, shared))
+                    return True, shared, True
+                ok, value = await fn()
+                if ok:
+                    self._write_result(result_path, value)
+                future.set_result((ok, value))
+                return ok, value, False
+            finally:
+                lock.__exit__(None, None, None)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            calls.pop(key, None)
+            self._maybe_sweep()
+
+    @staticmethod
+    async def _acquire(loop, lock):
+        """在线程池中获取文件锁；等待期间被取消时，拿到锁后立即释放"""
+        acquiring = loop.run_in_executor(None, lock.__enter__)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            def release(f):
+                if not f.cancelled() and f.exception() is None:
+                    lock.__exit__(None, None, None)
+            acquiring.add_done_callback(release)
+            raise
+
+    @staticmethod
+    def _read_result(path, not_before):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('created_at', 0) < not_before:
+            return None
+        return data.get('value')
+
+    @staticmethod
+    def _write_result(path, value):
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created_at': time.time(), 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            print(f"写入合并结果失败: {e}")
+
+    def _maybe_sweep(self):
+        """每隔一段时间删除长期未使用的锁文件和结果文件"""
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        cutoff = time.time() - STALE_SECONDS
+        for path in self.lock_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(lock_dir):
+    """同一目录在进程内共享一个实例（进程内合并依赖共享状态）"""
+    with _flights_lock:
+        flight = _flights.get(str(lock_dir))
+        if flight is None:
+            flight = _flights[str(lock_dir)] = SingleFlight(lock_dir)
+        return flight
@@ -0,0 +1,130 @@
+"""按内容寻址的PDF存储
+
+上传时的文件块在写入临时文件（或内存）的同时计算SHA-256（Hashing*UploadHandler），
+文件以 pdfs/sha256/<前两位>/<哈希>.pdf 保存：内容相同的上传只保留一份，
+多个PDFDocument指向同一个文件，并共用按哈希命名的向量索引和分段。
+非上传来源的文件（脚本、测试）在生成文件名时补算一次哈希。
+
+写入文件和删除最后一个引用的文件在同一把跨进程锁下进行：删除前在锁内确认
+数据库中已没有引用；保存方在引用提交后再在锁内确认文件仍在，被并发删除时
+重新写入（见models中的release_pdf_content和restore_pdf_content）。
+"""
+import hashlib
+import os
+import uuid
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from .locks import file_lock
+
+CONTENT_PREFIX = 'pdfs/sha256/'
+
+
+def content_path(digest, ext='pdf'):
+    return f"{CONTENT_PREFIX}{digest[:2]}/{digest}.{ext}"
+
+
+def is_content_path(name):
+    return bool(name) and name.replace('\\', '/').startswith(CONTENT_PREFIX)
+
+
+def content_sha256(file):
+    """上传处理器已算好时直接返回，否则读一遍文件计算"""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    file.sha256 = hasher.hexdigest()
+    return file.sha256
+
+
+class _HashingMixin:
+    def new_file(self, *args, **kwargs):
+        self._hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self._hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    """小文件留在内存中，同时计算哈希"""
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    """大文件边写临时文件边计算哈希，保存时直接移动临时文件，不再复制"""
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """内容寻址路径已存在时不再写入；其他路径保持FileSystemStorage的行为"""
+
+    def get_available_name(self, name, max_length=None):
+        if is_content_path(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def content_lock(self, name):
+        """内容文件写入与删除的互斥锁，按哈希前两位的目录加锁"""
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        return file_lock(os.path.join(directory, '.lock'))
+
+    def _save(self, name, content):
+        if not is_content_path(name):
+            return super()._save(name, content)
+        with self.content_lock(name):
+            self._write_content(name, content)
+        return name
+
+    def ensure_content(self, name, content):
+        """引用提交后调用：文件在保存之后被删掉时用content重新写入，返回是否重写"""
+        with self.content_lock(name):
+            if os.path.exists(self.path(name)):
+                return False
+            self._write_content(name, content)
+            return True
+
+    def _write_content(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return
+        if hasattr(content, 'temporary_file_path') and os.path.exists(content.temporary_file_path()):
+            try:
+                os.replace(content.temporary_file_path(), full_path)
+                self._chmod(full_path)
+                return
+            except OSError:
+                pass  # 跨文件系统时退回复制
+        # 先写同目录的临时文件再替换：并发保存相同内容时结果一致，读者看不到半个文件
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                content.seek(0)
+                for chunk in content.chunks():
+                    f.write(chunk)
+            self._chmod(tmp_path)
+            os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _chmod(self, path):
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+
+def get_pdf_storage():
+    return pdf_storage
+
+
+pdf_storage = ContentAddressedStorage()
@@ -0,0 +1,527 @@
+from django.test import TestCase, override_settings
+from unittest import mock
+from myapp.ai_service import (
+    DocumentProcessor,
+    file_sha256,
+    get_active_config,
+    invalidate_active_config,
+)
+from myapp.models import AIConfig
+from myapp.pdf_extract import iter_page_texts
+from myapp.pdf_fixtures import build_text_pdf
+from myapp.caches import IndexCache, index_cache, get_result_cache
+from myapp.http_client import get_session, close_sessions
+from myapp.global_index import GlobalIndex
+from myapp.chunk_store import ChunkStore, write_chunks
+from myapp.index_types import build_index, index_type_of
+from myapp.chunking import estimate_tokens
+import faiss
+from django.core.management import call_command
+import io
+import json
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+class DocumentProcessorTestCase(TestCase):
+    def setUp(self):
+        # keep faiss_index/ and text_cache/ out of the repo during tests
+        self._tmp_base = tempfile.mkdtemp()
+        self._settings = override_settings(BASE_DIR=self._tmp_base)
+        self._settings.enable()
+        self.processor = DocumentProcessor()
+        invalidate_active_config()
+        index_cache.clear()
+        get_result_cache().clear()
+
+        self.pdf_path = os.path.join(self._tmp_base, "doc.pdf")
+        with open(self.pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 sample content")
+
+    def tearDown(self):
+        # rolled-back AIConfig rows must not linger in the config cache
+        invalidate_active_config()
+        self._settings.disable()
+        shutil.rmtree(self._tmp_base)
+
+
+class TextCacheTests(DocumentProcessorTestCase):
+    def test_second_load_skips_pdf_parsing(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]) as pages:
+            first = self.processor.load_chunks(self.pdf_path)
+            second = DocumentProcessor().load_chunks(self.pdf_path)
+
+        self.assertEqual(pages.call_count, 1)
+        self.assertEqual(first, second)
+
+    def test_chunk_size_is_part_of_the_key(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]) as pages:
+            self.processor.load_chunks(self.pdf_path)
+            self.processor.chunk_size = 200
+            self.processor.load_chunks(self.pdf_path)
+
+        self.assertEqual(pages.call_count, 2)
+
+    def test_invalidate_removes_cache_and_index(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]):
+            self.processor.load_chunks(self.pdf_path)
+        index_file = self.processor.index_path / "1.index"
+        index_file.write_bytes(b"")
+
+        self.processor.invalidate_document(1, self.pdf_path)
+
+        self.assertFalse(index_file.exists())
+        content_hash = file_sha256(self.pdf_path)
+        self.assertEqual(list(self.processor.text_cache_path.glob(f"{content_hash}_*")), [])
+
+
+class PdfExtractTests(DocumentProcessorTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.pdf_path, "wb") as f:
+            f.write(build_text_pdf([f"page {i}" for i in range(12)]))
+
+    def test_pages_are_yielded_in_order(self):
+        pages = list(iter_page_texts(self.pdf_path))
+
+        self.assertEqual(len(pages), 12)
+        self.assertEqual(pages[0].strip(), "page 0")
+        self.assertEqual(pages[11].strip(), "page 11")
+
+    def test_process_pool_matches_sequential_extraction(self):
+        sequential = list(iter_page_texts(self.pdf_path))
+        with mock.patch("myapp.pdf_extract.os.cpu_count", return_value=2):
+            pooled = list(iter_page_texts(self.pdf_path, workers=2, pool_threshold=5, pages_per_task=5))
+
+        self.assertEqual(pooled, sequential)
+
+    def test_extract_text_joins_pages(self):
+        text = self.processor.extract_text_from_pdf(self.pdf_path)
+
+        self.assertIn("page 0", text)
+        self.assertLess(text.index("page 3"), text.index("page 10"))
+
+
+class IndexCacheTests(DocumentProcessorTestCase):
+    def test_search_reuses_loaded_index(self):
+        self.assertTrue(self.processor.create_faiss_index("1", ["a", "b", "c"]))
+        with mock.patch.object(
+            DocumentProcessor, "_load_index", wraps=self.processor._load_index
+        ) as load:
+            self.processor.search_similar_chunks("1", "query")
+            self.processor.search_similar_chunks("1", "query")
+
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(index_cache.stats()["hits"], 1)
+
+    def test_rewritten_index_is_reloaded(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+        self.processor.search_similar_chunks("1", "query")
+        self.processor.create_faiss_index("1", ["c", "d", "e"])
+
+        results = self.processor.search_similar_chunks("1", "query", top_k=3)
+
+        self.assertEqual(sorted(r["text"] for r in results), ["c", "d", "e"])
+
+    def test_lru_eviction_by_entry_count(self):
+        cache = IndexCache(max_entries=1)
+        for name in ("1", "2"):
+            self.processor.create_faiss_index(name, ["a"])
+            index_file = self.processor.index_path / f"{name}.index"
+            chunks_file = self.processor._chunks_file(name)
+            cache.get(index_file, chunks_file,
+                      lambda: self.processor._load_index(index_file, chunks_file))
+
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["evictions"], 1)
+
+
+class ChunkStoreTests(DocumentProcessorTestCase):
+    def test_round_trip_with_random_access(self):
+        path = os.path.join(self._tmp_base, "1.chunks")
+        chunks = ["第一段", "", "third chunk", "最后一段"]
+        write_chunks(path, chunks)
+
+        store = ChunkStore(path)
+
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store[2], "third chunk")
+        self.assertEqual(store[-1], "最后一段")
+        self.assertEqual(list(store), chunks)
+        with self.assertRaises(IndexError):
+            store[4]
+
+    def test_search_reads_chunk_store(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+
+        self.assertTrue((self.processor.index_path / "1.chunks").exists())
+        self.assertFalse((self.processor.index_path / "1_chunks.json").exists())
+        results = self.processor.search_similar_chunks("1", "query", top_k=2)
+        self.assertEqual(sorted(r["text"] for r in results), ["a", "b"])
+
+    def test_migration_converts_legacy_json(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+        (self.processor.index_path / "1.chunks").unlink()
+        legacy_file = self.processor.index_path / "1_chunks.json"
+        legacy_file.write_text(json.dumps(["旧a", "旧b"], ensure_ascii=False), encoding="utf-8")
+        # 迁移前仍可读取旧格式
+        self.assertEqual(len(self.processor.search_similar_chunks("1", "query", top_k=2)), 2)
+
+        call_command("migrate_chunk_store", stdout=io.StringIO())
+
+        self.assertFalse(legacy_file.exists())
+        self.assertEqual(list(ChunkStore(self.processor.index_path / "1.chunks")), ["旧a", "旧b"])
+        results = self.processor.search_similar_chunks("1", "query", top_k=2)
+        self.assertEqual(sorted(r["text"] for r in results), ["旧a", "旧b"])
+
+
+class IndexTypeTests(DocumentProcessorTestCase):
+    def test_quantized_index_is_written_and_searchable(self):
+        self.processor.index_type = "sq8"
+        self.processor.create_faiss_index("1", ["a", "b", "c"])
+
+        index = faiss.read_index(str(self.processor.index_path / "1.index"))
+        self.assertEqual(index_type_of(index), "sq8")
+        results = self.processor.search_similar_chunks("1", "query", top_k=5)
+        self.assertEqual(sorted(r["text"] for r in results), ["a", "b", "c"])
+
+    def test_flat_index_is_migrated_on_load(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+        index_file = self.processor.index_path / "1.index"
+        self.assertEqual(index_type_of(faiss.read_index(str(index_file))), "flat")
+
+        self.processor.index_type = "fp16"
+        self.processor.search_similar_chunks("1", "query")
+
+        self.assertEqual(index_type_of(faiss.read_index(str(index_file))), "fp16")
+
+    def test_migrated_index_is_cached_with_new_mtime(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+        self.processor.index_type = "fp16"
+        with mock.patch.object(
+            DocumentProcessor, "_load_index", wraps=self.processor._load_index
+        ) as load:
+            self.processor.search_similar_chunks("1", "query")
+            self.processor.search_similar_chunks("1", "query")
+
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(index_cache.stats()["hits"], 1)
+
+    def test_pq_falls_back_for_small_documents(self):
+        vectors = np.random.default_rng(0).standard_normal((10, 16)).astype("float32")
+        self.assertEqual(index_type_of(build_index(vectors, "pq", pq_m=4)), "sq8")
+
+
+class GlobalIndexTests(DocumentProcessorTestCase):
+    def _vectors(self, n, dim=8, seed=0):
+        vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def test_search_returns_document_and_chunk(self):
+        index = GlobalIndex(os.path.join(self._tmp_base, "g.index"), dim=8)
+        first, second = self._vectors(3, seed=1), self._vectors(2, seed=2)
+        index.add_document(1, first)
+        index.add_document(2, second)
+
+        document_id, chunk_index, score = index.search(second[1], top_k=1)[0]
+
+        self.assertEqual((document_id, chunk_index), (2, 1))
+        self.assertAlmostEqual(score, 1.0, places=4)
+
+    def test_remove_and_replace_document(self):
+        index = GlobalIndex(os.path.join(self._tmp_base, "g.index"), dim=8)
+        index.add_document(1, self._vectors(3, seed=1))
+        index.add_document(2, self._vectors(2, seed=2))
+        index.add_document(1, self._vectors(1, seed=3))
+        self.assertEqual(index.stats()["vectors"], 3)
+
+        index.remove_document(1)
+
+        self.assertEqual({r[0] for r in index.search(self._vectors(1)[0], top_k=5)}, {2})
+
+    def test_switches_to_ivf_past_threshold(self):
+        path = os.path.join(self._tmp_base, "g.index")
+        index = GlobalIndex(path, dim=8, nlist=4, nprobe=4, train_threshold=200)
+        index.add_document(1, self._vectors(150, seed=1))
+        self.assertEqual(index.stats()["type"], "flat")
+        vectors = self._vectors(100, seed=2)
+        index.add_document(2, vectors)
+
+        # 另一个进程看到的是同一份磁盘文件
+        reopened = GlobalIndex(path, dim=8, nlist=4, nprobe=4)
+        self.assertEqual(reopened.stats(), {"vectors": 250, "type": "ivf"})
+        self.assertEqual(reopened.search(vectors[7], top_k=1)[0][:2], (2, 7))
+        reopened.remove_document(1)
+        self.assertEqual(reopened.stats()["vectors"], 100)
+
+    def test_updates_append_to_log_until_compaction(self):
+        path = os.path.join(self._tmp_base, "g.index")
+        index = GlobalIndex(path, dim=8)
+        index.rebuild([(1, self._vectors(3, seed=1))])
+        snapshot_mtime = os.stat(path).st_mtime_ns
+
+        vectors = self._vectors(2, seed=2)
+        index.add_document(2, vectors)
+        index.remove_document(1)
+
+        self.assertEqual(os.stat(path).st_mtime_ns, snapshot_mtime)
+        # 另一个进程从快照加日志恢复出同样的内容
+        reopened = GlobalIndex(path, dim=8)
+        self.assertEqual(reopened.stats()["vectors"], 2)
+        self.assertEqual(reopened.search(vectors[1], top_k=1)[0][:2], (2, 1))
+
+        with mock.patch("myapp.global_index.COMPACT_MIN_BYTES", 0):
+            index.add_document(3, self._vectors(4, seed=3))
+        self.assertEqual(os.path.getsize(index.log_path), 0)
+        self.assertEqual(reopened.stats()["vectors"], 6)
+
+    def test_processor_keeps_global_index_in_sync(self):
+        self.processor.create_faiss_index("1", ["a", "b"])
+        self.processor.create_faiss_index("2", ["c"])
+
+        results = self.processor.search_library("query", top_k=5)
+        self.assertEqual(sorted((r["document_id"], r["text"]) for r in results),
+                         [(1, "a"), (1, "b"), (2, "c")])
+
+        self.processor.invalidate_document("1")
+        results = self.processor.search_library("query", top_k=5)
+        self.assertEqual([r["document_id"] for r in results], [2])
+
+
+class PromptContextTests(DocumentProcessorTestCase):
+    def test_prompt_respects_token_budget(self):
+        pages = ["。".join(f"第{p}页第{i}句内容" for i in range(200)) + "。" for p in range(5)]
+        self.processor.context_max_tokens = 500
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=pages):
+            prompt, error = self.processor.prepare_prompt("1", self.pdf_path, "summary")
+            template_only = self.processor._create_summary_prompt([])
+
+        self.assertIsNone(error)
+        self.assertIn("context", self.processor.stage_timings)
+        context_tokens = estimate_tokens(prompt) - estimate_tokens(template_only)
+        self.assertGreater(context_tokens, 0)
+        self.assertLessEqual(context_tokens, 500)
+
+
+class EmbeddingBatchTests(DocumentProcessorTestCase):
+    def setUp(self):
+        super().setUp()
+        config = {
+            "api_key": "k", "base_url": "http://upstream", "model_name": "m",
+            "embedding_model": "e", "temperature": 0.7, "max_tokens": 100,
+            "simulation_mode": False,
+        }
+        self.processor._get_active_config = lambda: config
+        self.processor.embedding_batch_size = 2
+
+    def test_batches_are_reassembled_in_order(self):
+        def fake_request(config, texts):
+            return [[float(t)] for t in texts]
+
+        with mock.patch.object(self.processor, "_request_embeddings", side_effect=fake_request) as req:
+            result = self.processor.get_embeddings([str(i) for i in range(7)])
+
+        self.assertEqual(req.call_count, 4)
+        self.assertEqual(result, [[float(i)] for i in range(7)])
+
+    def test_failed_batch_is_not_retried_again(self):
+        # 可重试的错误已在upstream_post中重试过，这里不再套一层
+        def failing_request(config, texts):
+            return None if texts[0] == "2" else [[float(t)] for t in texts]
+
+        with mock.patch.object(self.processor, "_request_embeddings", side_effect=failing_request) as req:
+            result = self.processor.get_embeddings([str(i) for i in range(6)])
+
+        self.assertEqual(req.call_count, 3)
+        self.assertIsNone(result)
+        self.assertTrue(self.processor.upstream_failed)
+
+
+    def test_cached_embeddings_are_not_refetched(self):
+        def fake_request(config, texts):
+            return [[float(t)] for t in texts]
+
+        with mock.patch.object(self.processor, "_request_embeddings", side_effect=fake_request) as req:
+            self.processor.get_embeddings(["1", "2", "3"])
+            req.reset_mock()
+            result = self.processor.get_embeddings(["3", "4", "1", "4"])
+
+        sent = [text for call in req.call_args_list for text in call.args[1]]
+        self.assertEqual(sent, ["4"])
+        self.assertEqual(result, [[3.0], [4.0], [1.0], [4.0]])
+
+
+class ResultCacheTests(DocumentProcessorTestCase):
+    def _process(self, **kwargs):
+        processor = DocumentProcessor()
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]), \
+                mock.patch("myapp.ai_service.time.sleep"):
+            result = processor.process_document("1", self.pdf_path, "summary", **kwargs)
+        return processor, result
+
+    def test_repeated_request_is_served_from_cache(self):
+        with mock.patch.object(
+            DocumentProcessor, "_generate_mock_response", return_value="总结"
+        ) as generate:
+            first, _ = self._process()
+            second, result = self._process()
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first.cache_info["status"], "miss")
+        self.assertEqual(second.cache_info["status"], "hit")
+        self.assertEqual(result, "总结")
+
+    def test_force_refresh_bypasses_cache(self):
+        with mock.patch.object(
+            DocumentProcessor, "_generate_mock_response", return_value="总结"
+        ) as generate:
+            self._process()
+            processor, _ = self._process(force_refresh=True)
+
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(processor.cache_info["status"], "bypass")
+
+    def test_upstream_errors_are_not_cached(self):
+        with mock.patch.object(DocumentProcessor, "call_llm_api", return_value="AIHubMix API错误: x"):
+            self._process()
+            processor, _ = self._process()
+
+        self.assertEqual(processor.cache_info["status"], "miss")
+
+
+class MapReduceTests(DocumentProcessorTestCase):
+    PAGES = ["。".join(f"第{p}页第{i}句内容" for i in range(60)) + "。" for p in range(4)]
+
+    def setUp(self):
+        super().setUp()
+        self.prompts = []
+
+    def _fake_completion(self, prompt, temperature=None, max_tokens=None):
+        self.prompts.append(prompt)
+        return True, f"摘要{len(self.prompts)}"
+
+    def _process(self, task_type, mode="map_reduce", completion=None):
+        processor = DocumentProcessor()
+        processor.map_group_tokens = 300
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=self.PAGES), \
+                mock.patch.object(DocumentProcessor, "_chat_completion",
+                                  side_effect=completion or self._fake_completion):
+            result = processor.process_document("1", self.pdf_path, task_type, mode=mode)
+        return processor, result
+
+    def _map_prompts(self):
+        return [p for p in self.prompts if p.startswith("以下是一份长文档中的连续片段")]
+
+    def test_groups_are_mapped_then_reduced(self):
+        processor, result = self._process("summary")
+
+        map_prompts = self._map_prompts()
+        self.assertGreater(len(map_prompts), 1)
+        self.assertEqual(len(self.prompts), len(map_prompts) + 1)
+        reduce_prompt = self.prompts[-1]
+        self.assertIn("结构化的总结要点", reduce_prompt)
+        self.assertIn("摘要1", reduce_prompt)
+        self.assertEqual(result, f"摘要{len(self.prompts)}")
+        self.assertIn("map", processor.stage_timings)
+        self.assertIn("reduce", processor.stage_timings)
+
+    def test_map_outputs_are_reused_by_other_tasks(self):
+        self._process("summary")
+        first_run = len(self.prompts)
+
+        self._process("questions")
+
+        self.assertEqual(len(self.prompts), first_run + 1)
+        self.assertIn("测试题目", self.prompts[-1])
+
+    def test_map_failure_is_reported_and_not_cached(self):
+        def failing(prompt, temperature=None, max_tokens=None):
+            return False, "AIHubMix API错误: x"
+
+        processor, result = self._process("summary", completion=failing)
+        self.assertEqual(result, "AIHubMix API错误: x")
+        self.assertFalse(processor.last_llm_ok)
+
+        self._process("summary")
+        self.assertGreater(len(self._map_prompts()), 1)
+
+    def test_auto_uses_single_call_when_document_fits(self):
+        self.PAGES = ["第一句。第二句。"]
+
+        self._process("summary", mode="auto")
+
+        self.assertEqual(len(self.prompts), 1)
+        self.assertEqual(self._map_prompts(), [])
+
+
+class StreamLLMTests(DocumentProcessorTestCase):
+    def test_upstream_deltas_are_yielded(self):
+        self.processor._get_active_config = lambda: {
+            "api_key": "k", "base_url": "http://upstream", "model_name": "m",
+            "embedding_model": "e", "temperature": 0.7, "max_tokens": 100,
+            "simulation_mode": False,
+        }
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = [
+            line.encode("utf-8") for line in (
+                'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+                "",
+                'data: {"choices": [{"delta": {"content": "你"}}]}',
+                'data: {"choices": [{"delta": {"content": "好"}}]}',
+                "data: [DONE]",
+            )
+        ]
+        session = mock.Mock()
+        session.post.return_value = response
+
+        with mock.patch("myapp.upstream.get_session", return_value=session):
+            deltas = list(self.processor.stream_llm_api("prompt"))
+
+        self.assertEqual(deltas, ["你", "好"])
+        self.assertTrue(session.post.call_args.kwargs["json"]["stream"])
+
+
+class ActiveConfigCacheTests(DocumentProcessorTestCase):
+    def test_repeated_lookups_do_not_query_the_database(self):
+        get_active_config()
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                self.processor._get_active_config()
+
+    def test_saving_config_invalidates_cache(self):
+        self.assertTrue(get_active_config()["simulation_mode"])
+        AIConfig.objects.create(name="c", api_key="key", model_name="gpt-test")
+
+        config = get_active_config()
+
+        self.assertFalse(config["simulation_mode"])
+        self.assertEqual(config["model_name"], "gpt-test")
+
+    @override_settings(AI_CONFIG_STAMP_CHECK_INTERVAL=0)
+    def test_stamp_change_from_another_process_invalidates_cache(self):
+        get_active_config()
+        # another worker saved an AIConfig: only the shared stamp changes
+        AIConfig.objects.bulk_create([AIConfig(name="c", api_key="key", model_name="gpt-other")])
+        self.assertTrue(get_active_config()["simulation_mode"])
+
+        stamp_file = self.processor.index_path.parent / ".aiconfig_version"
+        stamp_file.write_text("changed-elsewhere", encoding="utf-8")
+
+        self.assertEqual(get_active_config()["model_name"], "gpt-other")
+
+
+class HTTPSessionTests(TestCase):
+    def tearDown(self):
+        close_sessions()
+
+    def test_session_is_shared_per_base_url(self):
+        first = get_session("https://api.example.com/v1/")
+        second = get_session("https://api.example.com/v1")
+        other = get_session("https://other.example.com/v1")
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
@@ -0,0 +1,153 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest import mock
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+from myapp.caches import get_result_cache
+from myapp.fake_ai_server import FakeAIConfig, LatencyModel, make_server
+from myapp.models import PDFDocument
+from myapp.upstream import reset_limiters
+
+
+class AsyncUpstreamTests(SimpleTestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(BASE_DIR=self._tmp, AI_MAX_CONCURRENCY=50, AI_RETRY_MAX=0)
+        self._settings.enable()
+        reset_limiters()
+        get_result_cache().clear()
+        self.config = FakeAIConfig(
+            chat_latency=LatencyModel(mean_ms=300), embedding_latency=LatencyModel(mean_ms=0), dim=8
+        )
+        self.server = make_server("127.0.0.1", 0, self.config)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.upstream = {
+            "api_key": "k", "base_url": f"http://{host}:{port}/v1", "model_name": "m",
+            "embedding_model": "e", "temperature": 0.7, "max_tokens": 100,
+            "simulation_mode": False,
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        reset_limiters()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def test_slow_calls_overlap_on_one_event_loop(self):
+        async def run():
+            processor = DocumentProcessor()
+            return await asyncio.gather(*(
+                processor.acall_llm_api(f"prompt {i}", config=self.upstream) for i in range(20)
+            ))
+
+        start = time.perf_counter()
+        replies = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(any("主要内容概述" in reply for reply in replies))
+        # 请求在替身服务端同时处理中，串行需要约6秒
+        self.assertGreaterEqual(self.config.peak_in_flight, 10)
+        self.assertLess(elapsed, 3)
+
+    def test_upstream_errors_are_reported(self):
+        self.config.error_rate = 1.0
+        processor = DocumentProcessor()
+
+        reply = asyncio.run(processor.acall_llm_api("hello", config=self.upstream))
+
+        self.assertFalse(processor.last_llm_ok)
+        self.assertIn("injected upstream error", reply)
+
+    def test_process_document_end_to_end(self):
+        pdf_path = f"{self._tmp}/doc.pdf"
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 sample content")
+        processor = DocumentProcessor()
+        processor.vector_dim = 8
+        processor.embedding_store = None
+        processor.global_index = None
+        processor._get_active_config = lambda: self.upstream
+
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]):
+            result = asyncio.run(processor.aprocess_document("1", pdf_path, "summary"))
+
+        self.assertIn("主要内容概述", result)
+        self.assertTrue(processor.last_llm_ok)
+        self.assertIn("llm", processor.stage_timings)
+
+    def test_request_config_does_not_outlive_the_call(self):
+        pdf_path = f"{self._tmp}/doc.pdf"
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 sample content")
+        processor = DocumentProcessor()
+        processor.vector_dim = 8
+        processor.embedding_store = None
+        processor.global_index = None
+        later = dict(self.upstream, model_name="later")
+
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch("myapp.ai_service.get_active_config", return_value=self.upstream):
+            asyncio.run(processor.aprocess_document("1", pdf_path, "summary"))
+
+        self.assertTrue(processor.last_llm_ok)
+        with mock.patch("myapp.ai_service.get_active_config", return_value=later):
+            self.assertEqual(processor._get_active_config()["model_name"], "later")
+
+    def test_sync_fallback_uses_supplied_config(self):
+        saved = dict(self.upstream, base_url="http://127.0.0.1:9/v1")
+        processor = DocumentProcessor()
+
+        with mock.patch("myapp.ai_service.get_async_client", return_value=None), \
+                mock.patch("myapp.ai_service.get_active_config", return_value=saved):
+            reply = asyncio.run(processor.acall_llm_api("hello", config=self.upstream))
+
+        self.assertTrue(processor.last_llm_ok)
+        self.assertIn("主要内容概述", reply)
+        self.assertEqual(self.config.counters["chat"], 1)
+
+
+class AsyncProcessViewTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp)
+        self._settings.enable()
+        invalidate_active_config()
+        get_result_cache().clear()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        invalidate_active_config()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    async def test_async_endpoint_returns_result(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]), \
+                mock.patch.object(DocumentProcessor, "_achat_completion",
+                                  new=mock.AsyncMock(return_value=(True, "总结"))):
+            response = await self.async_client.post(
+                "/api/async/process/",
+                {"document_id": self.document.id, "task_type": "summary"},
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["result"], "总结")
+        self.assertEqual(body["document_title"], "doc")
+        self.assertEqual(body["cache"]["status"], "miss")
+
+    async def test_unknown_document(self):
+        response = await self.async_client.post(
+            "/api/async/process/", {"document_id": 999, "task_type": "summary"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,18 @@
+from django.test import SimpleTestCase
+from myapp.benchmarks import STAGES, compare_to_baseline, run_benchmarks
+
+
+class BenchmarkSuiteTests(SimpleTestCase):
+    def test_reports_every_stage_per_page_count(self):
+        report = run_benchmarks(page_counts=(2,), repeat=1, queries=2)
+
+        self.assertEqual(set(report["results"]["2"]), set(STAGES))
+        self.assertIn("cpu_count", report["meta"])
+
+    def test_compare_flags_only_significant_slowdowns(self):
+        baseline = {"results": {"10": {"extract": {"median": 0.010}, "chunk": {"median": 0.010}}}}
+        report = {"results": {"10": {"extract": {"median": 0.020}, "chunk": {"median": 0.0105}}}}
+
+        regressions = compare_to_baseline(report, baseline, tolerance=0.25)
+
+        self.assertEqual([r["stage"] for r in regressions], ["extract"])
@@ -0,0 +1,60 @@
+from django.test import SimpleTestCase
+from myapp.chunking import clean_text, estimate_tokens, get_chunker, split_sentences
+
+
+class CleanTextTests(SimpleTestCase):
+    def test_whitespace_and_symbols_in_one_pass(self):
+        self.assertEqual(clean_text("  Hello,\n\n world! @#这是 测试。 "), "Hello, world! 这是 测试。")
+
+
+class SentenceSplitTests(SimpleTestCase):
+    def test_mixed_cjk_and_latin_boundaries(self):
+        sentences = [s.strip() for s, _ in split_sentences("第一句。Second one. 3.14 stays! 最后")]
+
+        self.assertEqual(sentences, ["第一句。", "Second one.", "3.14 stays!", "最后"])
+
+
+class SentenceChunkerTests(SimpleTestCase):
+    def test_english_text_is_split_into_several_chunks(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = list(get_chunker(max_size=100).chunk_text(text))
+
+        self.assertGreater(len(chunks), 5)
+        self.assertTrue(all(len(c.text) <= 100 for c in chunks))
+
+    def test_long_sentence_is_hard_split(self):
+        chunks = list(get_chunker(max_size=50).chunk_text("字" * 180))
+
+        self.assertEqual([len(c.text) for c in chunks], [50, 50, 50, 30])
+
+    def test_overlap_repeats_trailing_sentences(self):
+        text = "Alpha one. Beta two. Gamma three. Delta four."
+        chunks = [c.text for c in get_chunker(max_size=25, overlap=12).chunk_text(text)]
+
+        self.assertEqual(chunks[0], "Alpha one. Beta two.")
+        self.assertTrue(chunks[1].startswith("Beta two."))
+
+    def test_overlap_never_exceeds_max_size(self):
+        text = "a" * 40 + ". " + "b" * 40 + ". " + "c" * 80 + ". " + "d" * 80 + ". "
+        chunks = list(get_chunker(max_size=100, overlap=50).chunk_text(text))
+
+        self.assertTrue(all(len(c.text) <= 100 for c in chunks))
+        self.assertEqual(sum(c.text.count("c") for c in chunks), 80)
+
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = list(get_chunker(max_size=60, overlap=30).chunk_text(text))
+        self.assertTrue(all(len(c.text) <= 60 for c in chunks))
+
+    def test_token_unit_counts_estimated_tokens(self):
+        text = "word " * 200
+        chunks = list(get_chunker(max_size=20, unit="tokens").chunk_text(text))
+
+        self.assertTrue(all(estimate_tokens(c.text) <= 20 for c in chunks))
+
+    def test_chunks_record_pages_and_offsets(self):
+        chunks = list(get_chunker(max_size=30).chunk_pages(["First page text.", "Second page text."]))
+
+        self.assertEqual((chunks[0].page, chunks[0].end_page), (1, 1))
+        self.assertEqual(chunks[-1].end_page, 2)
+        joined = "First page text. Second page text."
+        self.assertEqual(joined[chunks[-1].start:chunks[-1].end].strip(), chunks[-1].text)
@@ -0,0 +1,52 @@
+from django.test import SimpleTestCase
+import numpy as np
+from myapp.chunking import estimate_tokens
+from myapp.context_packer import (
+    CHUNK_OVERHEAD_TOKENS,
+    context_budget,
+    context_window,
+    select_chunks,
+)
+
+
+class BudgetTests(SimpleTestCase):
+    def test_longest_prefix_wins(self):
+        windows = {"gpt-4": 8192, "gpt-4o": 128000}
+
+        self.assertEqual(context_window("gpt-4o-mini", windows, 4096), 128000)
+        self.assertEqual(context_window("gpt-4-0613", windows, 4096), 8192)
+        self.assertEqual(context_window("unknown", windows, 4096), 4096)
+
+    def test_budget_leaves_room_for_completion(self):
+        self.assertEqual(context_budget(8192, 2000, 300, max_context=100000, safety_margin=0), 5892)
+        self.assertEqual(context_budget(8192, 2000, 300, max_context=3000), 3000)
+        self.assertEqual(context_budget(1000, 2000, 300, max_context=3000), 0)
+
+
+class SelectChunksTests(SimpleTestCase):
+    def test_without_vectors_fills_in_order(self):
+        chunks = ["一二三四五"] * 5
+        cost = estimate_tokens(chunks[0]) + CHUNK_OVERHEAD_TOKENS
+
+        self.assertEqual(select_chunks(chunks, cost * 3), [0, 1, 2])
+
+    def test_mmr_covers_distinct_topics_within_budget(self):
+        rng = np.random.default_rng(0)
+        topics = rng.standard_normal((2, 16)).astype("float32")
+        # 前6段都是主题A，最后2段是主题B
+        vectors = np.vstack([topics[0] + 0.01 * rng.standard_normal(16) for _ in range(6)]
+                            + [topics[1] + 0.01 * rng.standard_normal(16) for _ in range(2)])
+        chunks = [f"chunk {i} text" for i in range(8)]
+        cost = estimate_tokens(chunks[0]) + CHUNK_OVERHEAD_TOKENS
+
+        selected = select_chunks(chunks, cost * 2, vectors, diversity=0.5)
+
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(selected, sorted(selected))
+        self.assertTrue(any(i < 6 for i in selected) and any(i >= 6 for i in selected))
+
+    def test_oversized_chunk_is_skipped(self):
+        chunks = ["x" * 4000, "short", "also short"]
+        vectors = np.eye(3, dtype="float32")
+
+        self.assertEqual(select_chunks(chunks, 20, vectors), [1, 2])
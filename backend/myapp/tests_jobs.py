@@ -0,0 +1,117 @@
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from rest_framework.test import APIClient
+from unittest import mock
+from myapp.models import PDFDocument, ProcessingJob
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+from myapp.caches import get_result_cache
+from myapp.jobs import claim_next_job, run_job, ingest_document, INGEST_TASK
+from datetime import timedelta
+import tempfile
+import shutil
+
+
+class JobTestCase(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp)
+        self._settings.enable()
+        invalidate_active_config()
+        self.client = APIClient()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        get_result_cache().clear()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+
+class ProcessingJobTests(JobTestCase):
+    def test_async_process_returns_job_id(self):
+        response = self.client.post(
+            "/api/process/",
+            {"document_id": self.document.id, "task_type": "summary", "async": True},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 202)
+        job = ProcessingJob.objects.get(id=response.data["job_id"])
+        self.assertEqual(job.status, ProcessingJob.STATUS_PENDING)
+
+    @override_settings(PROCESS_JOB_QUEUE_LIMIT=1)
+    def test_queue_limit_rejects_new_jobs(self):
+        ProcessingJob.objects.create(document=self.document, task_type="summary")
+        response = self.client.post(
+            "/api/process/",
+            {"document_id": self.document.id, "task_type": "summary", "async": True},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_worker_runs_job_and_records_timings(self):
+        job = ProcessingJob.objects.create(document=self.document, task_type="summary")
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", return_value=(True, "总结")):
+            claimed = claim_next_job()
+            self.assertEqual(claimed.pk, job.pk)
+            self.assertIsNone(claim_next_job())
+            run_job(claimed)
+
+        response = self.client.get(f"/api/jobs/{job.id}/")
+        self.assertEqual(response.data["status"], ProcessingJob.STATUS_SUCCEEDED)
+        self.assertEqual(response.data["result"], "总结")
+        self.assertIn("llm", response.data["stage_timings"])
+
+
+    @override_settings(PROCESS_JOB_TIMEOUT=60)
+    def test_stale_running_job_is_requeued(self):
+        now = timezone.now()
+        stale = ProcessingJob.objects.create(
+            document=self.document, task_type="summary",
+            status=ProcessingJob.STATUS_RUNNING, started_at=now - timedelta(seconds=120),
+        )
+        ProcessingJob.objects.create(
+            document=self.document, task_type="analysis",
+            status=ProcessingJob.STATUS_RUNNING, started_at=now,
+        )
+
+        claimed = claim_next_job()
+
+        self.assertEqual(claimed.pk, stale.pk)
+        self.assertEqual(claimed.status, ProcessingJob.STATUS_RUNNING)
+        self.assertGreater(claimed.started_at, now)
+        self.assertIsNone(claim_next_job())
+
+
+class IngestTests(JobTestCase):
+    def test_ingest_builds_index_and_marks_ready(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]):
+            ingest_document(self.document.pk)
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.ingest_status, PDFDocument.INGEST_READY)
+        self.assertTrue(DocumentProcessor().index_path.joinpath(f"{self.document.index_key}.index").exists())
+
+    def test_ingest_failure_is_recorded(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=[""]):
+            ingest_document(self.document.pk)
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.ingest_status, PDFDocument.INGEST_FAILED)
+        self.assertIn("无法从PDF提取文本", self.document.ingest_error)
+
+    @override_settings(INGEST_BACKEND="queue")
+    def test_upload_schedules_ingest_after_commit(self):
+        upload = SimpleUploadedFile("new.pdf", b"%PDF-1.4 new")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/pdfs/", {"title": "new", "pdf_file": upload})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["ingest_status"], PDFDocument.INGEST_PENDING)
+        self.assertTrue(
+            ProcessingJob.objects.filter(document_id=response.data["id"], task_type=INGEST_TASK).exists()
+        )
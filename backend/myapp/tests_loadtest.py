@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase, override_settings
+from myapp.ai_service import DocumentProcessor
+from myapp.fake_ai_server import FakeAIConfig, LatencyModel, make_server
+from myapp.http_client import close_sessions
+from myapp.loadtest import LoadDriver, parse_mix, percentile
+from myapp.upstream import limiter_stats, reset_limiters
+import threading
+
+
+class FakeAIServerTests(SimpleTestCase):
+    def setUp(self):
+        self.config = FakeAIConfig(
+            chat_latency=LatencyModel(mean_ms=0), embedding_latency=LatencyModel(mean_ms=0), dim=8
+        )
+        reset_limiters()
+        self.server = make_server("127.0.0.1", 0, self.config)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.processor = DocumentProcessor()
+        self.processor.vector_dim = 8
+        self.processor.embedding_store = None
+        upstream = {
+            "api_key": "k", "base_url": f"http://{host}:{port}/v1", "model_name": "m",
+            "embedding_model": "e", "temperature": 0.7, "max_tokens": 100,
+            "simulation_mode": False,
+        }
+        self.processor._get_active_config = lambda: upstream
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        close_sessions()
+
+    def test_processor_talks_to_stand_in(self):
+        embeddings = self.processor.get_embeddings(["a", "b"])
+        reply = self.processor.call_llm_api("hello")
+        streamed = "".join(self.processor.stream_llm_api("hello"))
+
+        self.assertEqual(len(embeddings), 2)
+        self.assertEqual(len(embeddings[0]), 8)
+        self.assertIn("主要内容概述", reply)
+        self.assertEqual(streamed, reply)
+
+    def test_throttled_requests_are_retried_then_fail(self):
+        self.config.throttle_rate = 1.0
+        self.config.retry_after = 0
+
+        with override_settings(AI_RETRY_MAX=2, AI_RETRY_BACKOFF_BASE=0.01):
+            reset_limiters()
+            self.assertIsNone(self.processor.get_embeddings(["a"]))
+
+        self.assertEqual(self.config.counters["throttled"], 3)
+        stats = list(limiter_stats().values())[0]
+        self.assertEqual((stats["throttled"], stats["retries"], stats["in_flight"]), (3, 2, 0))
+
+    def test_throttled_chat_is_reported_as_failure(self):
+        self.config.throttle_rate = 1.0
+        self.config.retry_after = 0
+
+        with override_settings(AI_RETRY_MAX=0):
+            reset_limiters()
+            reply = self.processor.call_llm_api("hello")
+
+        self.assertFalse(self.processor.last_llm_ok)
+        self.assertIn("rate limit", reply)
+
+
+class LoadDriverHelperTests(SimpleTestCase):
+    def test_percentile_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+
+    def test_uploads_use_distinct_pdfs_unless_requested(self):
+        driver = LoadDriver("http://127.0.0.1:1", pages=1)
+        self.assertNotEqual(driver.pdf_for(0), driver.pdf_for(1))
+
+        same = LoadDriver("http://127.0.0.1:1", pages=1, same_pdf=True)
+        self.assertEqual(same.pdf_for(0), same.pdf_for(1))
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("upload:1,search:3"), {"upload": 1, "search": 3})
+        with self.assertRaises(ValueError):
+            parse_mix("delete:1")
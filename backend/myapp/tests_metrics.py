@@ -0,0 +1,126 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from myapp import metrics
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+from myapp.caches import get_result_cache
+from myapp.fake_ai_server import FakeAIConfig, LatencyModel, make_server
+from myapp.http_client import close_sessions
+from myapp.models import PDFDocument
+from myapp.upstream import reset_limiters
+import shutil
+import tempfile
+import threading
+
+
+class MetricTypeTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram("t_seconds", "t", ["stage"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="a")
+        histogram.observe(0.5, stage="a")
+        histogram.observe(5, stage="a")
+
+        lines = histogram.render()
+        self.assertIn('t_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('t_seconds_bucket{stage="a",le="1.0"} 2', lines)
+        self.assertIn('t_seconds_bucket{stage="a",le="+Inf"} 3', lines)
+        self.assertIn('t_seconds_count{stage="a"} 3', lines)
+
+    def test_counter_escapes_label_values(self):
+        counter = metrics.Counter("t_total", "t", ["reason"])
+        counter.inc(2, reason='say "hi"')
+
+        self.assertIn('t_total{reason="say \\"hi\\""} 2', counter.render())
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_record_nothing(self):
+        counter = metrics.Counter("t_total", "t")
+        histogram = metrics.Histogram("t_seconds", "t")
+        counter.inc()
+        with histogram.time():
+            pass
+
+        self.assertEqual(counter.value(), 0)
+        self.assertEqual(histogram.count(), 0)
+
+
+class UpstreamMetricsTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        reset_limiters()
+        self.config = FakeAIConfig(
+            chat_latency=LatencyModel(mean_ms=0), embedding_latency=LatencyModel(mean_ms=0), dim=8
+        )
+        self.server = make_server("127.0.0.1", 0, self.config)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.processor = DocumentProcessor()
+        upstream = {
+            "api_key": "k", "base_url": f"http://{host}:{port}/v1", "model_name": "m",
+            "embedding_model": "e", "temperature": 0.7, "max_tokens": 100,
+            "simulation_mode": False,
+        }
+        self.processor._get_active_config = lambda: upstream
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        close_sessions()
+        reset_limiters()
+
+    def test_usage_tokens_are_counted(self):
+        self.processor.call_llm_api("hello")
+
+        self.assertGreater(metrics.LLM_TOKENS.value(model="m", type="prompt"), 0)
+        self.assertGreater(metrics.LLM_TOKENS.value(model="m", type="completion"), 0)
+
+    @override_settings(AI_RETRY_MAX=0)
+    def test_final_upstream_errors_are_counted(self):
+        self.config.throttle_rate = 1.0
+        self.config.retry_after = 0
+
+        self.processor.call_llm_api("hello")
+
+        self.assertEqual(metrics.UPSTREAM_ERRORS.value(endpoint="chat/completions", reason=429), 1)
+
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp)
+        self._settings.enable()
+        invalidate_active_config()
+        get_result_cache().clear()
+        metrics.reset()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        get_result_cache().clear()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def test_processing_stages_are_exported(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", return_value=(True, "总结")):
+            for _ in range(2):
+                self.client.post(
+                    "/api/process/",
+                    {"document_id": self.document.id, "task_type": "summary"},
+                    content_type="application/json",
+                )
+
+        response = self.client.get("/metrics")
+        body = response.content.decode("utf-8")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        for stage in ("extract", "chunk", "embed", "index_build", "llm"):
+            self.assertIn(f'pdfai_stage_seconds_count{{stage="{stage}"}} 1', body)
+        self.assertIn('pdfai_cache_requests_total{cache="result",status="hit"} 1', body)
+        self.assertIn('pdfai_cache_requests_total{cache="result",status="miss"} 1', body)
+        self.assertIn("pdfai_index_cache_hits_total", body)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_endpoint_is_not_found(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
@@ -0,0 +1,85 @@
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+from myapp.caches import get_result_cache
+from myapp.models import PDFDocument
+import pstats
+import shutil
+import tempfile
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(
+            MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp, PROFILE_DIR=None, PROFILE_TOKEN="secret"
+        )
+        self._settings.enable()
+        invalidate_active_config()
+        get_result_cache().clear()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        get_result_cache().clear()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def _process(self, **headers):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", return_value=(True, "总结")):
+            return self.client.post(
+                "/api/process/",
+                {"document_id": self.document.id, "task_type": "summary", "force_refresh": True},
+                content_type="application/json",
+                headers=headers,
+            )
+
+    def test_admin_request_is_profiled_and_downloadable(self):
+        response = self._process(**{"X-Profile": "1", "X-Profile-Token": "secret"})
+        profile_id = response["X-Profile-Id"]
+        admin = {"X-Profile-Token": "secret"}
+
+        listing = self.client.get("/api/profiles/", headers=admin).json()["profiles"]
+        self.assertEqual([p["id"] for p in listing], [profile_id])
+
+        summary = self.client.get(f"/api/profiles/{profile_id}/", headers=admin).json()["profile"]
+        self.assertEqual(summary["reason"], "requested")
+        self.assertEqual(summary["path"], "/api/process/")
+        self.assertEqual(set(summary["stages"]["llm"]), {"wall", "cpu", "calls"})
+        self.assertIn("process_document", summary["top"])
+
+        download = self.client.get(f"/api/profiles/{profile_id}/?download=1", headers=admin)
+        path = f"{self._tmp}/downloaded.prof"
+        with open(path, "wb") as f:
+            f.write(b"".join(download.streaming_content))
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_header_without_admin_rights_is_ignored(self):
+        response = self._process(**{"X-Profile": "1", "X-Profile-Token": "wrong"})
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 403)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_KEEP=2)
+    def test_sampling_profiles_matching_paths_and_prunes(self):
+        ids = [self._process()["X-Profile-Id"] for _ in range(3)]
+        self.assertNotIn("X-Profile-Id", self.client.get("/api/active-config/"))
+
+        listing = self.client.get("/api/profiles/", headers={"X-Profile-Token": "secret"}).json()["profiles"]
+        self.assertEqual([p["id"] for p in listing], ids[:0:-1])
+        self.assertEqual(listing[0]["reason"], "sampled")
+
+    def test_request_is_served_unprofiled_while_another_is_profiled(self):
+        with mock.patch("myapp.profiling._profiler_lock") as lock:
+            lock.acquire.return_value = False
+            response = self._process(**{"X-Profile": "1", "X-Profile-Token": "secret"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+
+    def test_invalid_profile_id_is_not_found(self):
+        response = self.client.get("/api/profiles/..%2Fsecret/", headers={"X-Profile-Token": "secret"})
+        self.assertEqual(response.status_code, 404)
@@ -71,6 +71,16 @@ class TaskSerializerTests(TestCase):
 
 
 class AIConfigSerializerTests(TestCase):
+    def setUp(self):
+        # saving an AIConfig bumps the config version stamp; keep it out of BASE_DIR
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(AI_CONFIG_STAMP_PATH=f"{self._tmp}/.aiconfig_version")
+        self._settings.enable()
+
+    def tearDown(self):
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
     def test_ai_config_fields(self):
         cfg = AIConfig.objects.create(name="c1", api_key="SECRET123", model_name="gpt-test")
         s = AIConfigSerializer(cfg)
@@ -0,0 +1,137 @@
+from django.test import SimpleTestCase, override_settings
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import tempfile
+import threading
+import time
+from myapp.ai_service import DocumentProcessor
+from myapp.benchmarks import SIMULATION_CONFIG
+from myapp.caches import get_result_cache
+from myapp.locks import file_lock
+from myapp.singleflight import SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self.flight = SingleFlight(self._tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_concurrent_callers_share_one_execution(self):
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return True, "result"
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(self.flight.do, "key", compute) for _ in range(5)]
+            time.sleep(0.1)
+            release.set()
+            outcomes = [f.result() for f in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({(ok, value) for ok, value, _ in outcomes}, {(True, "result")})
+        self.assertEqual(sum(shared for _, _, shared in outcomes), 4)
+
+    def test_result_from_another_process_is_reused_only_if_newer(self):
+        since = time.time()
+        _, result_path = self.flight._paths("key")
+        self.flight._write_result(result_path, "from other process")
+
+        self.assertEqual(self.flight.do("key", lambda: (True, "mine"), since=since),
+                         (True, "from other process", True))
+        self.assertEqual(self.flight.do("key", lambda: (True, "mine"), since=time.time() + 1),
+                         (True, "mine", False))
+
+    def test_failed_results_are_not_published(self):
+        self.flight.do("key", lambda: (False, "error"))
+
+        _, result_path = self.flight._paths("key")
+        self.assertFalse(result_path.exists())
+
+    def test_lock_blocks_other_file_handles(self):
+        lock_path, _ = self.flight._paths("key")
+        with self.flight.lock("key"):
+            with self.assertRaises(BlockingIOError):
+                with file_lock(lock_path, blocking=False):
+                    pass
+        with file_lock(lock_path, blocking=False):
+            pass
+
+
+class CoalescedProcessingTests(SimpleTestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(BASE_DIR=self._tmp)
+        self._settings.enable()
+        get_result_cache().clear()
+        self.pdf_path = os.path.join(self._tmp, "doc.pdf")
+        with open(self.pdf_path, "wb") as f:
+            f.write(b"%PDF-1.4 sample content")
+
+    def tearDown(self):
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def test_duplicate_requests_make_one_llm_call(self):
+        completions = []
+
+        def slow_completion(prompt, temperature=None, max_tokens=None):
+            completions.append(prompt)
+            time.sleep(0.2)
+            return True, "总结"
+
+        def process(_):
+            processor = DocumentProcessor()
+            result = processor.process_document("1", self.pdf_path, "summary")
+            return result, processor.cache_info["status"]
+
+        with mock.patch.object(DocumentProcessor, "_get_active_config", return_value=SIMULATION_CONFIG), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", side_effect=slow_completion), \
+                mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]) as pages, \
+                mock.patch.object(DocumentProcessor, "create_faiss_index",
+                                  wraps=DocumentProcessor.create_faiss_index, autospec=True) as build:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                outcomes = list(executor.map(process, range(4)))
+
+        self.assertEqual(len(completions), 1)
+        self.assertEqual(pages.call_count, 1)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual({result for result, _ in outcomes}, {"总结"})
+        self.assertEqual(sorted(status for _, status in outcomes), ["coalesced"] * 3 + ["miss"])
+
+    def test_coalesced_callers_share_upstream_failure(self):
+        def failing_completion(prompt, temperature=None, max_tokens=None):
+            time.sleep(0.2)
+            return False, "上游错误"
+
+        def process(_):
+            processor = DocumentProcessor()
+            result = processor.process_document("1", self.pdf_path, "summary")
+            return result, processor.error_status, processor.last_llm_ok
+
+        with mock.patch.object(DocumentProcessor, "_get_active_config", return_value=SIMULATION_CONFIG), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", side_effect=failing_completion), \
+                mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                outcomes = list(executor.map(process, range(4)))
+
+        self.assertEqual(set(outcomes), {("上游错误", 502, False)})
+
+    def test_flags_are_reset_between_calls(self):
+        processor = DocumentProcessor()
+        processor.last_llm_ok = True
+        processor.upstream_failed = True
+
+        with mock.patch.object(DocumentProcessor, "_get_active_config", return_value=SIMULATION_CONFIG):
+            processor.process_document("1", self.pdf_path, "summary", mode="unknown")
+
+        self.assertFalse(processor.last_llm_ok)
+        self.assertEqual(processor.error_status, 422)
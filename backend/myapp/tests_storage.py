@@ -0,0 +1,180 @@
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from unittest import mock
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+from myapp.caches import get_result_cache
+from myapp.jobs import ingest_document
+from myapp.models import PDFDocument
+from myapp.storage import content_path
+from pathlib import Path
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+CONTENT = b"%PDF-1.4 shared content"
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+@override_settings(INGEST_BACKEND="queue")
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp)
+        self._settings.enable()
+        invalidate_active_config()
+        get_result_cache().clear()
+
+    def tearDown(self):
+        get_result_cache().clear()
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def _upload(self, title, content=CONTENT):
+        response = self.client.post(
+            "/api/pdfs/", {"title": title, "pdf_file": SimpleUploadedFile("x.pdf", content)}
+        )
+        self.assertEqual(response.status_code, 201)
+        return PDFDocument.objects.get(pk=response.data["id"])
+
+    def _blob_files(self):
+        return [p for p in Path(self._tmp, "pdfs").rglob("*.pdf") if p.is_file()]
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self._upload("a"), self._upload("b")
+
+        self.assertEqual(first.content_hash, DIGEST)
+        self.assertEqual(first.pdf_file.name, content_path(DIGEST))
+        self.assertEqual(second.pdf_file.name, first.pdf_file.name)
+        self.assertEqual(len(self._blob_files()), 1)
+        self.assertEqual(second.filename(), "b.pdf")
+
+    def test_same_title_different_content_does_not_collide(self):
+        first = self._upload("same", b"%PDF-1.4 one")
+        second = self._upload("same", b"%PDF-1.4 two")
+
+        self.assertNotEqual(first.pdf_file.name, second.pdf_file.name)
+        with open(second.pdf_file.path, "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 two")
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=4)
+    def test_large_upload_is_hashed_while_streaming(self):
+        # 哈希必须来自上传处理器，而不是保存时再读一遍文件
+        with mock.patch("myapp.models.content_sha256", side_effect=lambda f: f.sha256):
+            document = self._upload("big")
+
+        self.assertEqual(document.content_hash, DIGEST)
+        self.assertTrue(os.path.isfile(document.pdf_file.path))
+
+    def test_blob_and_index_removed_with_last_reference(self):
+        first, second = self._upload("a"), self._upload("b")
+        processor = DocumentProcessor()
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "get_embeddings", wraps=processor.get_embeddings) as embed:
+            ingest_document(first.pk)
+            ingest_document(second.pk)
+        self.assertEqual(embed.call_count, 1)
+        index_file = processor.index_path / f"{DIGEST}.index"
+        self.assertTrue(index_file.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.isfile(second.pdf_file.path))
+        self.assertTrue(index_file.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self._blob_files(), [])
+        self.assertFalse(index_file.exists())
+
+    def test_global_entries_move_to_surviving_document(self):
+        first, second = self._upload("a"), self._upload("b")
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]):
+            ingest_document(first.pk)
+        global_index = DocumentProcessor().global_index
+        vector = DocumentProcessor()._chunk_vectors(DIGEST)[0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+
+        self.assertEqual({hit[0] for hit in global_index.search(vector, top_k=2)}, {second.pk})
+
+    def test_release_waits_for_commit(self):
+        document = self._upload("a")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            document.delete()
+        self.assertTrue(os.path.isfile(document.pdf_file.path))
+
+        callbacks[0]()
+        self.assertEqual(self._blob_files(), [])
+
+    def test_blob_deleted_before_commit_is_rewritten(self):
+        # 新上传发现文件已存在而跳过写入，提交前另一请求释放最后一个旧引用删除了文件
+        self._upload("a")
+        with self.captureOnCommitCallbacks() as callbacks:
+            second = PDFDocument.objects.create(title="b", pdf_file=SimpleUploadedFile("x.pdf", CONTENT))
+        os.remove(second.pdf_file.path)
+
+        for callback in callbacks:
+            callback()
+
+        with open(second.pdf_file.path, "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_processed_upload_is_searchable_in_library(self):
+        document = self._upload("a")
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", return_value=(True, "总结")):
+            response = self.client.post(
+                "/api/process/", {"document_id": document.pk, "task_type": "summary"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        results = self.client.get("/api/search/", {"q": "第一句"}).json()["results"]
+
+        self.assertTrue(results)
+        self.assertEqual({r["document_id"] for r in results}, {document.pk})
+        self.assertEqual(results[0]["document_title"], "a")
+        self.assertTrue(results[0]["text"])
+
+    def test_processing_uses_stored_content_hash(self):
+        document = self._upload("a")
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]), \
+                mock.patch.object(DocumentProcessor, "_chat_completion", return_value=(True, "总结")), \
+                mock.patch("myapp.ai_service.file_sha256") as file_sha256:
+            ingest_document(document.pk)
+            for _ in range(2):
+                response = self.client.post(
+                    "/api/process/", {"document_id": document.pk, "task_type": "summary"},
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.data["cache"]["status"], "hit")
+        file_sha256.assert_not_called()
+
+    def test_migrate_legacy_files(self):
+        processor = DocumentProcessor()
+        os.makedirs(os.path.join(self._tmp, "pdfs"))
+        documents = []
+        for title in ("a", "b"):
+            with open(os.path.join(self._tmp, "pdfs", f"{title}.pdf"), "wb") as f:
+                f.write(CONTENT)
+            document = PDFDocument.objects.create(title=title, pdf_file=f"pdfs/{title}.pdf")
+            for suffix in (".index", ".chunks"):
+                (processor.index_path / f"{document.pk}{suffix}").write_bytes(b"x")
+            documents.append(document)
+
+        call_command("migrate_pdf_storage", stdout=io.StringIO())
+
+        for document in documents:
+            document.refresh_from_db()
+            self.assertEqual(document.content_hash, DIGEST)
+            self.assertEqual(document.pdf_file.name, content_path(DIGEST))
+            self.assertFalse((processor.index_path / f"{document.pk}.index").exists())
+        self.assertEqual(len(self._blob_files()), 1)
+        self.assertTrue((processor.index_path / f"{DIGEST}.chunks").exists())
@@ -0,0 +1,100 @@
+from django.test import SimpleTestCase
+from myapp.upstream import ConcurrencyLimiter, TokenBucket, UpstreamLimiter, parse_retry_after
+import asyncio
+import threading
+import time
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_paced(self):
+        bucket = TokenBucket(rate=10, burst=2)
+
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.02)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.02)
+
+    def test_refuses_when_wait_passes_deadline(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        bucket.reserve()
+
+        self.assertIsNone(bucket.reserve(deadline=time.monotonic() + 0.1))
+        # 被拒绝的预订不占用令牌
+        self.assertAlmostEqual(bucket.reserve(), 1.0, delta=0.05)
+
+    def test_zero_rate_is_unlimited(self):
+        bucket = TokenBucket(rate=0, burst=1)
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0.0] * 5)
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def test_release_hands_slot_to_waiting_thread(self):
+        slots = ConcurrencyLimiter(1)
+        self.assertTrue(slots.acquire())
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(slots.acquire(timeout=5)))
+        waiter.start()
+        while slots.waiting == 0:
+            time.sleep(0.001)
+
+        slots.release()
+        waiter.join()
+        self.assertEqual(acquired, [True])
+        self.assertEqual(slots.active, 1)
+
+    def test_timeout_leaves_no_waiter(self):
+        slots = ConcurrencyLimiter(1)
+        slots.acquire()
+
+        self.assertFalse(slots.acquire(timeout=0.01))
+        self.assertEqual(slots.waiting, 0)
+        slots.release()
+        self.assertEqual(slots.active, 0)
+
+    def test_threads_and_coroutines_share_slots(self):
+        slots = ConcurrencyLimiter(1)
+        slots.acquire()
+
+        async def wait_for_slot():
+            return await slots.aacquire(timeout=5)
+
+        async def main():
+            task = asyncio.ensure_future(wait_for_slot())
+            while slots.waiting == 0:
+                await asyncio.sleep(0.001)
+            threading.Thread(target=slots.release).start()
+            return await task
+
+        self.assertTrue(asyncio.run(main()))
+        self.assertEqual(slots.active, 1)
+
+    def test_async_timeout_returns_false(self):
+        slots = ConcurrencyLimiter(1)
+        slots.acquire()
+
+        self.assertFalse(asyncio.run(slots.aacquire(timeout=0.01)))
+        self.assertEqual(slots.waiting, 0)
+
+
+class RetryTests(SimpleTestCase):
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    def test_backoff_prefers_retry_after_and_caps(self):
+        limiter = UpstreamLimiter(backoff_base=0.5, backoff_max=2.0)
+
+        self.assertGreaterEqual(limiter.backoff(0, retry_after=5.0), 5.0)
+        self.assertTrue(all(limiter.backoff(10) <= 2.0 for _ in range(20)))
+
+    def test_no_retry_past_deadline_or_budget(self):
+        limiter = UpstreamLimiter(max_retries=1, backoff_base=0.01)
+        far = time.monotonic() + 60
+
+        self.assertIsNone(limiter._retry_delay(0, far, 429, retry_after=120))
+        self.assertIsNotNone(limiter._retry_delay(0, far, 503))
+        self.assertIsNone(limiter._retry_delay(1, far, 503))
+        self.assertEqual(limiter.stats()['throttled'], 1)
+        self.assertEqual(limiter.stats()['retries'], 1)
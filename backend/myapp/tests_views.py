@@ -0,0 +1,78 @@
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from myapp.models import PDFDocument
+from myapp.ai_service import DocumentProcessor, invalidate_active_config
+import tempfile
+import shutil
+
+
+class ProcessStreamViewTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(
+            MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp, SIMULATION_STREAM_DELAY=0
+        )
+        self._settings.enable()
+        invalidate_active_config()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def test_simulation_mode_streams_deltas(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。第二句。"]):
+            response = self.client.get(
+                "/api/process/stream/",
+                {"document_id": self.document.id, "task_type": "summary"},
+            )
+            body = b"".join(response.streaming_content).decode("utf-8")
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(body.startswith("event: start"))
+        self.assertGreater(body.count("event: delta"), 1)
+        self.assertTrue(body.rstrip().split("\n\n")[-1].startswith("event: done"))
+
+    def test_unknown_task_type_reports_error_event(self):
+        with mock.patch.object(DocumentProcessor, "iter_pdf_pages", return_value=["第一句。"]):
+            response = self.client.get(
+                "/api/process/stream/",
+                {"document_id": self.document.id, "task_type": "poem"},
+            )
+            body = b"".join(response.streaming_content).decode("utf-8")
+
+        self.assertIn("event: error", body)
+        self.assertIn("未知的任务类型", body)
+
+
+class LibrarySearchViewTests(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._settings = override_settings(MEDIA_ROOT=self._tmp, BASE_DIR=self._tmp)
+        self._settings.enable()
+        invalidate_active_config()
+        self.document = PDFDocument.objects.create(
+            title="doc", pdf_file=SimpleUploadedFile("doc.pdf", b"%PDF-1.4 sample")
+        )
+
+    def tearDown(self):
+        self._settings.disable()
+        shutil.rmtree(self._tmp)
+
+    def test_results_carry_document_title(self):
+        DocumentProcessor().create_faiss_index(
+            self.document.index_key, ["第一句。", "第二句。"], global_id=self.document.id
+        )
+
+        response = self.client.get("/api/search/", {"q": "句子", "top_k": 1})
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertEqual(result["document_id"], self.document.id)
+        self.assertEqual(result["document_title"], "doc")
+
+    def test_missing_query_is_rejected(self):
+        self.assertEqual(self.client.get("/api/search/").status_code, 400)
@@ -0,0 +1,395 @@
+"""上游AI接口的限流、并发上限、重试和截止时间
+
+每个AIConfig（按base_url和api_key区分）一个UpstreamLimiter：
+- 令牌桶限制请求速率（AI_RATE_LIMIT_RPS / AI_RATE_LIMIT_BURST）
+- 并发上限（AI_MAX_CONCURRENCY），同步线程和异步协程共用同一组名额
+- 429/5xx、超时和连接错误按指数退避+抖动重试，优先遵守Retry-After
+- 每次调用有截止时间（AI_REQUEST_DEADLINE），排队、重试和等待都计入，
+  来不及时直接按超时失败，不再排队
+"""
+import asyncio
+import email.utils
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+import requests
+from django.conf import settings
+from .http_client import get_async_client, get_session, httpx
+from .metrics import UPSTREAM_ERRORS, register_collector
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """令牌桶：rate为每秒补充的令牌数，burst为桶容量；rate<=0表示不限速"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline=None):
+        """预订一个令牌，返回需要等待的秒数；等到令牌会超过deadline时不预订并返回None"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                return None
+            # 允许令牌为负，后来者排在已预订的请求之后
+            self._tokens -= 1
+            return wait
+
+
+class ConcurrencyLimiter:
+    """可同时被线程和协程使用的公平信号量，释放时把名额按先来后到直接交给等待者"""
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            event = threading.Event()
+            self._waiters.append(event)
+        if event.wait(timeout):
+            return True
+        with self._lock:
+            if event in self._waiters:
+                self._waiters.remove(event)
+                return False
+        return True  # 超时的同时拿到了名额
+
+    async def aacquire(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            return False
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        """放弃等待；名额已经交过来的话还回去"""
+        with self._lock:
+            granted = waiter not in self._waiters
+            if not granted:
+                self._waiters.remove(waiter)
+        if granted:
+            self.release()
+        if not waiter[1].done():
+            waiter[1].cancel()
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(_grant, future)
+                    return
+                except RuntimeError:  # 等待者的事件循环已关闭
+                    continue
+            self.active -= 1
+
+
+def _grant(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def parse_retry_after(value):
+    """Retry-After可以是秒数或HTTP日期，返回秒数或None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class UpstreamLimiter:
+    def __init__(self, rate=0, burst=10, concurrency=8, max_retries=3,
+                 backoff_base=0.5, backoff_max=20.0, deadline=120.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = ConcurrencyLimiter(concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self.counters = {
+            'requests': 0, 'throttled': 0, 'retries': 0, 'deadline_exceeded': 0,
+            'queue_wait_seconds': 0.0, 'queue_wait_max': 0.0,
+        }
+
+    def count(self, key, value=1):
+        with self._lock:
+            self.counters[key] += value
+
+    def backoff(self, attempt, retry_after=None):
+        """第attempt次重试前的等待：有Retry-After时遵守它，否则full jitter指数退避"""
+        if retry_after is not None:
+            return retry_after + self._rng.uniform(0, self.backoff_base)
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record_wait(self, waited):
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['queue_wait_seconds'] += waited
+            self.counters['queue_wait_max'] = max(self.counters['queue_wait_max'], waited)
+
+    def _deadline_exceeded(self):
+        self.count('deadline_exceeded')
+        return f"上游请求超过截止时间（{self.deadline:g}秒）"
+
+    def acquire(self, deadline):
+        """拿到速率令牌和并发名额；截止前拿不到时抛出requests Timeout"""
+        start = time.monotonic()
+        wait = self.bucket.reserve(deadline)
+        if wait is None:
+            raise requests.exceptions.Timeout(self._deadline_exceeded())
+        time.sleep(wait)
+        if not self.slots.acquire(max(0.0, deadline - time.monotonic())):
+            raise requests.exceptions.Timeout(self._deadline_exceeded())
+        self._record_wait(time.monotonic() - start)
+
+    async def aacquire(self, deadline):
+        start = time.monotonic()
+        wait = self.bucket.reserve(deadline)
+        if wait is None:
+            raise httpx.TimeoutException(self._deadline_exceeded())
+        await asyncio.sleep(wait)
+        if not await self.slots.aacquire(max(0.0, deadline - time.monotonic())):
+            raise httpx.TimeoutException(self._deadline_exceeded())
+        self._record_wait(time.monotonic() - start)
+
+    def _retry_delay(self, attempt, deadline, status=None, retry_after=None):
+        """需要重试时返回等待秒数，不该重试或来不及时返回None"""
+        if status == 429:
+            self.count('throttled')
+        if attempt >= self.max_retries:
+            return None
+        delay = self.backoff(attempt, retry_after)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self.count('retries')
+        return delay
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['in_flight'] = self.slots.active
+        stats['waiting'] = self.slots.waiting
+        stats['concurrency'] = self.slots.limit
+        stats['rate'] = self.bucket.rate
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter_key(config):
+    key_hash = hashlib.sha256((config.get('api_key') or '').encode('utf-8')).hexdigest()[:12]
+    return f"{(config.get('base_url') or '').rstrip('/')}#{key_hash}"
+
+
+def get_limiter(config):
+    """每个AIConfig（base_url + api_key）共享一个限流器"""
+    key = _limiter_key(config)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = UpstreamLimiter(
+                rate=getattr(settings, 'AI_RATE_LIMIT_RPS', 0),
+                burst=getattr(settings, 'AI_RATE_LIMIT_BURST', 10),
+                concurrency=getattr(settings, 'AI_MAX_CONCURRENCY', 8),
+                max_retries=getattr(settings, 'AI_RETRY_MAX', 3),
+                backoff_base=getattr(settings, 'AI_RETRY_BACKOFF_BASE', 0.5),
+                backoff_max=getattr(settings, 'AI_RETRY_BACKOFF_MAX', 20.0),
+                deadline=getattr(settings, 'AI_REQUEST_DEADLINE', 120.0),
+            )
+        return limiter
+
+
+def limiter_stats():
+    """{上游标识: 统计}，上游标识中的api_key只保留哈希"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {key: limiter.stats() for key, limiter in limiters.items()}
+
+
+@register_collector
+def _limiter_metrics():
+    """限流器统计转为指标，upstream标签中的api_key只保留哈希"""
+    stats = limiter_stats()
+    families = [
+        ('pdfai_upstream_requests_total', 'counter', '发往上游的请求数（含重试）', 'requests'),
+        ('pdfai_upstream_throttled_total', 'counter', '上游返回429的次数', 'throttled'),
+        ('pdfai_upstream_retries_total', 'counter', '重试次数', 'retries'),
+        ('pdfai_upstream_deadline_exceeded_total', 'counter', '排队超过截止时间的次数', 'deadline_exceeded'),
+        ('pdfai_upstream_queue_wait_seconds_total', 'counter', '等待限流和并发名额的总时间', 'queue_wait_seconds'),
+        ('pdfai_upstream_in_flight', 'gauge', '当前在途请求数', 'in_flight'),
+        ('pdfai_upstream_waiting', 'gauge', '等待并发名额的请求数', 'waiting'),
+    ]
+    return [
+        (name, kind, documentation, [({'upstream': key}, item[field]) for key, item in stats.items()])
+        for name, kind, documentation, field in families
+    ]
+
+
+def _error_reason(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if httpx is not None and isinstance(error, httpx.TimeoutException):
+        return 'timeout'
+    return 'connection'
+
+
+def reset_limiters():
+    with _limiters_lock:
+        _limiters.clear()
+
+
+@contextmanager
+def upstream_post(config, path, payload, timeout, headers=None, stream=False):
+    """经过限流和重试发送POST，yield最终的响应；退出时释放并发名额
+
+    重试用尽或来不及重试时yield最后一次的错误响应，由调用方格式化错误；
+    超时和连接错误重试用尽后照常抛出requests异常。
+    """
+    limiter = get_limiter(config)
+    deadline = time.monotonic() + limiter.deadline
+    url = f"{config['base_url']}/{path}"
+    attempt = 0
+    while True:
+        try:
+            limiter.acquire(deadline)
+        except requests.exceptions.Timeout:
+            UPSTREAM_ERRORS.inc(endpoint=path, reason='deadline')
+            raise
+        try:
+            remaining = deadline - time.monotonic()
+            response = get_session(config['base_url']).post(
+                url, headers=headers, json=payload, timeout=max(0.1, min(timeout, remaining)), stream=stream
+            )
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            limiter.slots.release()
+            delay = limiter._retry_delay(attempt, deadline)
+            if delay is None:
+                UPSTREAM_ERRORS.inc(endpoint=path, reason=_error_reason(e))
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            limiter.slots.release()
+            raise
+
+        if response.status_code in RETRY_STATUSES:
+            delay = limiter._retry_delay(
+                attempt, deadline, response.status_code,
+                parse_retry_after(response.headers.get('Retry-After')),
+            )
+            if delay is not None:
+                response.close()
+                limiter.slots.release()
+                time.sleep(delay)
+                attempt += 1
+                continue
+        if response.status_code != 200:
+            UPSTREAM_ERRORS.inc(endpoint=path, reason=response.status_code)
+        try:
+            with response:
+                yield response
+        finally:
+            limiter.slots.release()
+        return
+
+
+@asynccontextmanager
+async def aupstream_post(config, path, payload, timeout, headers=None):
+    """upstream_post的异步版本（httpx.AsyncClient），等待和重试都不占用线程"""
+    limiter = get_limiter(config)
+    deadline = time.monotonic() + limiter.deadline
+    url = f"{config['base_url']}/{path}"
+    client = get_async_client(config['base_url'])
+    attempt = 0
+    while True:
+        try:
+            await limiter.aacquire(deadline)
+        except httpx.TimeoutException:
+            UPSTREAM_ERRORS.inc(endpoint=path, reason='deadline')
+            raise
+        try:
+            remaining = deadline - time.monotonic()
+            response = await client.post(
+                url, headers=headers, json=payload, timeout=max(0.1, min(timeout, remaining))
+            )
+        except httpx.TransportError as e:
+            limiter.slots.release()
+            delay = limiter._retry_delay(attempt, deadline)
+            if delay is None:
+                UPSTREAM_ERRORS.inc(endpoint=path, reason=_error_reason(e))
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            limiter.slots.release()
+            raise
+
+        if response.status_code in RETRY_STATUSES:
+            delay = limiter._retry_delay(
+                attempt, deadline, response.status_code,
+                parse_retry_after(response.headers.get('Retry-After')),
+            )
+            if delay is not None:
+                limiter.slots.release()
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+        if response.status_code != 200:
+            UPSTREAM_ERRORS.inc(endpoint=path, reason=response.status_code)
+        try:
+            yield response
+        finally:
+            limiter.slots.release()
+        return
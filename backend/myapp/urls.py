@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TaskViewSet, PDFDocumentViewSet, process_document, AIConfigViewSet, test_api_connection, get_active_config
+from .views import TaskViewSet, PDFDocumentViewSet, process_document, AIConfigViewSet, test_api_connection, get_active_config, get_job, process_document_stream, search_library
+from .views import process_document_async, test_api_connection_async, upstream_stats, metrics
+from .views import list_profiles, get_profile
 
 
 router = DefaultRouter()
@@ -11,6 +13,15 @@ router.register(r'ai-configs', AIConfigViewSet) # 新增AI配置路由
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/process/', process_document, name='process_document'),  
+    path('api/process/stream/', process_document_stream, name='process_document_stream'),
+    path('api/async/process/', process_document_async, name='process_document_async'),
+    path('api/async/test-connection/', test_api_connection_async, name='test_connection_async'),
      path('api/test-connection/', test_api_connection, name='test_connection'),  
     path('api/active-config/', get_active_config, name='active_config'),  
+    path('api/jobs/<int:job_id>/', get_job, name='get_job'),
+    path('api/search/', search_library, name='search_library'),
+    path('api/upstream-stats/', upstream_stats, name='upstream_stats'),
+    path('metrics', metrics, name='metrics'),
+    path('api/profiles/', list_profiles, name='list_profiles'),
+    path('api/profiles/<str:profile_id>/', get_profile, name='get_profile'),
 ]
\ No newline at end of file
@@ -1,13 +1,19 @@
 ## API视图给AI模块的
 ## Lucian
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from .models import Task, PDFDocument, AIConfig
-from .serializers import TaskSerializer, PDFDocumentSerializer, AIConfigSerializer
+from .models import Task, PDFDocument, AIConfig, ProcessingJob
+from .serializers import TaskSerializer, PDFDocumentSerializer, AIConfigSerializer, ProcessingJobSerializer
 import os
+import json
 from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from asgiref.sync import sync_to_async
 
 class TaskViewSet(viewsets.ModelViewSet):
     queryset = Task.objects.all()
@@ -22,19 +28,61 @@ class PDFDocumentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         pdf_file = self.request.FILES.get('pdf_file')
         file_size = pdf_file.size if pdf_file else 0
-        serializer.save(file_size=file_size)
+        document = serializer.save(file_size=file_size)
+        self._schedule_ingest(document)
+    
+    def perform_update(self, serializer):
+        pdf_file = self.request.FILES.get('pdf_file')
+        if not pdf_file:
+            serializer.save()
+            return
+        document = serializer.save(
+            file_size=pdf_file.size,
+            ingest_status=PDFDocument.INGEST_PENDING,
+            ingest_error='',
+            ingested_at=None
+        )
+        self._schedule_ingest(document)
+    
+    @action(detail=True, methods=['get'])
+    def search(self, request, pk=None):
+        """在单个文档中检索相似片段：GET /api/pdfs/<id>/search/?q=...&top_k=3"""
+        document = self.get_object()
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': '缺少参数'}, status=400)
+        try:
+            top_k = min(max(int(request.query_params.get('top_k', 3)), 1), 50)
+        except ValueError:
+            return Response({'error': 'top_k必须是整数'}, status=400)
+        
+        from .ai_service import get_processor
+        results = get_processor().search_similar_chunks(document.index_key, query, top_k=top_k)
+        return Response({'success': True, 'document_title': document.title, 'results': results})
+    
+    def _schedule_ingest(self, document):
+        """事务提交后再启动后台预处理，保证worker能读到新记录"""
+        from .jobs import schedule_ingest
+        transaction.on_commit(lambda: schedule_ingest(document))
 
 class AIConfigViewSet(viewsets.ModelViewSet):
     queryset = AIConfig.objects.all()
     serializer_class = AIConfigSerializer
     permission_classes = [AllowAny]
 
+def _is_true(value):
+    """解析布尔类型的请求参数"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def process_document(request):
-    """处理文档API"""
+    """处理文档API（async=true时放入任务队列并立即返回任务id）"""
     document_id = request.data.get('document_id')
     task_type = request.data.get('task_type')  # summary, analysis, questions
+    run_async = _is_true(request.data.get('async'))
+    force_refresh = _is_true(request.data.get('force_refresh'))
+    mode = request.data.get('mode')  # single, map_reduce, auto；默认PROCESS_MODE
     
     if not document_id or not task_type:
         return Response({'error': '缺少参数'}, status=400)
@@ -48,18 +96,43 @@ def process_document(request):
         if not os.path.exists(pdf_path):
             return Response({'error': 'PDF文件不存在'}, status=404)
         
+        if run_async:
+            from .jobs import enqueue_job, QueueFull
+            try:
+                job = enqueue_job(document, task_type)
+            except QueueFull as e:
+                return Response({'error': str(e)}, status=503)
+            return Response({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'task_type': task_type,
+                'document_title': document.title
+            }, status=202)
+        
         # 创建新的处理器实例（确保使用最新配置）
         from .ai_service import get_processor
         processor = get_processor()
         
         # 处理文档
-        result = processor.process_document(str(document_id), pdf_path, task_type)
+        result = processor.process_document(
+            document.index_key, pdf_path, task_type, force_refresh=force_refresh, mode=mode,
+            global_id=document.pk, content_hash=document.content_hash
+        )
+        if processor.last_error:
+            return Response({
+                'success': False,
+                'error': processor.last_error,
+                'task_type': task_type,
+                'document_title': document.title
+            }, status=processor.error_status)
         
         return Response({
             'success': True,
             'result': result,
             'task_type': task_type,
-            'document_title': document.title
+            'document_title': document.title,
+            'cache': processor.cache_info
         })
         
     except PDFDocument.DoesNotExist:
@@ -67,6 +140,175 @@ def process_document(request):
     except Exception as e:
         return Response({'error': f'处理失败: {str(e)}'}, status=500)
 
+def _sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def process_document_stream(request):
+    """流式处理文档API（SSE），GET用于EventSource，POST接受JSON"""
+    if request.method == 'GET':
+        params = request.GET
+    else:
+        try:
+            params = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': '请求体不是合法JSON'}, status=400)
+    
+    document_id = params.get('document_id')
+    task_type = params.get('task_type')
+    force_refresh = _is_true(params.get('force_refresh'))
+    
+    if not document_id or not task_type:
+        return JsonResponse({'error': '缺少参数'}, status=400)
+    
+    try:
+        document = PDFDocument.objects.get(id=document_id)
+    except (PDFDocument.DoesNotExist, ValueError):
+        return JsonResponse({'error': '文档不存在'}, status=404)
+    
+    pdf_path = os.path.join(settings.MEDIA_ROOT, document.pdf_file.name)
+    if not os.path.exists(pdf_path):
+        return JsonResponse({'error': 'PDF文件不存在'}, status=404)
+    
+    from .ai_service import get_processor, LLMStreamError
+    processor = get_processor()
+    
+    def event_stream():
+        yield _sse_event('start', {'task_type': task_type, 'document_title': document.title})
+        try:
+            for delta in processor.stream_document(
+                document.index_key, pdf_path, task_type, force_refresh=force_refresh,
+                global_id=document.pk, content_hash=document.content_hash
+            ):
+                yield _sse_event('delta', {'content': delta})
+        except LLMStreamError as e:
+            yield _sse_event('error', {'error': str(e)})
+            return
+        except Exception as e:
+            yield _sse_event('error', {'error': f'处理失败: {str(e)}'})
+            return
+        yield _sse_event('done', {
+            'stage_timings': processor.stage_timings,
+            'cache': processor.cache_info
+        })
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _json_params(request):
+    """解析JSON请求体，非法时返回None"""
+    try:
+        params = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return params if isinstance(params, dict) else None
+
+@csrf_exempt
+@require_http_methods(['POST'])
+async def process_document_async(request):
+    """处理文档API的原生异步版本（ASGI下一个worker可同时等待大量上游调用）
+
+    参数与 /api/process/ 相同，请求体为JSON。
+    """
+    params = _json_params(request)
+    if params is None:
+        return JsonResponse({'error': '请求体不是合法JSON'}, status=400)
+    document_id = params.get('document_id')
+    task_type = params.get('task_type')
+    force_refresh = _is_true(params.get('force_refresh'))
+    
+    if not document_id or not task_type:
+        return JsonResponse({'error': '缺少参数'}, status=400)
+    
+    try:
+        document = await PDFDocument.objects.aget(id=document_id)
+    except (PDFDocument.DoesNotExist, ValueError):
+        return JsonResponse({'error': '文档不存在'}, status=404)
+    
+    pdf_path = os.path.join(settings.MEDIA_ROOT, document.pdf_file.name)
+    if not os.path.exists(pdf_path):
+        return JsonResponse({'error': 'PDF文件不存在'}, status=404)
+    
+    if _is_true(params.get('async')):
+        from .jobs import enqueue_job, QueueFull
+        try:
+            job = await sync_to_async(enqueue_job)(document, task_type)
+        except QueueFull as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        return JsonResponse({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'task_type': task_type,
+            'document_title': document.title
+        }, status=202)
+    
+    from .ai_service import get_processor
+    processor = get_processor()
+    try:
+        result = await processor.aprocess_document(
+            document.index_key, pdf_path, task_type,
+            force_refresh=force_refresh, mode=params.get('mode'), global_id=document.pk,
+            content_hash=document.content_hash
+        )
+    except Exception as e:
+        return JsonResponse({'error': f'处理失败: {str(e)}'}, status=500)
+    if processor.last_error:
+        return JsonResponse({
+            'success': False,
+            'error': processor.last_error,
+            'task_type': task_type,
+            'document_title': document.title
+        }, status=processor.error_status)
+    
+    return JsonResponse({
+        'success': True,
+        'result': result,
+        'task_type': task_type,
+        'document_title': document.title,
+        'cache': processor.cache_info
+    })
+
+@csrf_exempt
+@require_http_methods(['POST'])
+async def test_api_connection_async(request):
+    """测试API连接的异步版本"""
+    from .ai_service import DocumentProcessor
+    
+    params = _json_params(request)
+    if params is None:
+        return JsonResponse({'success': False, 'error': '请求体不是合法JSON'}, status=400)
+    api_key = params.get('api_key')
+    if not api_key:
+        return JsonResponse({'success': False, 'error': 'API密钥不能为空'})
+    
+    test_config = {
+        'api_key': api_key,
+        'base_url': (params.get('base_url') or '').rstrip('/'),
+        'model_name': params.get('model_name', 'gpt-3.5-turbo'),
+        'embedding_model': 'text-embedding-ada-002',
+        'temperature': 0.7,
+        'max_tokens': 2000,
+        'simulation_mode': False
+    }
+    try:
+        result = await DocumentProcessor().acall_llm_api(
+            "请回复'连接成功'，不要添加其他内容。", config=test_config
+        )
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': f'连接测试失败: {str(e)}'})
+    
+    if "连接成功" in result:
+        return JsonResponse({'success': True, 'message': 'API连接测试成功'})
+    elif "API错误" in result:
+        return JsonResponse({'success': False, 'error': result})
+    else:
+        return JsonResponse({'success': False, 'error': f'API返回异常: {result}'})
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def test_api_connection(request):
@@ -129,3 +371,77 @@ def get_active_config(request):
             return Response({'success': False, 'error': '没有激活的配置'})
     except Exception as e:
         return Response({'success': False, 'error': str(e)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_library(request):
+    """跨文档检索：GET /api/search/?q=...&top_k=5"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': '缺少参数'}, status=400)
+    try:
+        top_k = min(max(int(request.query_params.get('top_k', 5)), 1), 50)
+    except ValueError:
+        return Response({'error': 'top_k必须是整数'}, status=400)
+    
+    from .ai_service import get_processor
+    results = get_processor().search_library(query, top_k=top_k)
+    
+    documents = PDFDocument.objects.in_bulk({r['document_id'] for r in results})
+    for r in results:
+        document = documents.get(r['document_id'])
+        r['document_title'] = document.title if document else None
+    results = [r for r in results if r['document_title'] is not None]
+    return Response({'success': True, 'results': results})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def upstream_stats(request):
+    """各上游的限流统计：排队等待、429次数、重试和当前并发，用于调整限流参数"""
+    from .upstream import limiter_stats
+    return Response({'success': True, 'upstreams': limiter_stats()})
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """Prometheus文本格式的处理阶段耗时、缓存和上游指标"""
+    from . import metrics as registry
+    if not registry.enabled():
+        raise Http404('指标已关闭')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def list_profiles(request):
+    """最近的请求剖析结果（仅管理员）"""
+    from . import profiling
+    if not profiling.is_profile_admin(request):
+        return Response({'error': '需要管理员权限'}, status=status.HTTP_403_FORBIDDEN)
+    return Response({'success': True, 'profiles': profiling.list_profiles()})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_profile(request, profile_id):
+    """单个剖析的阶段耗时和最耗时的函数；?download=1 下载pstats文件"""
+    from . import profiling
+    if not profiling.is_profile_admin(request):
+        return Response({'error': '需要管理员权限'}, status=status.HTTP_403_FORBIDDEN)
+    if request.query_params.get('download') == '1':
+        path = profiling.stats_path(profile_id)
+        if path is None:
+            return Response({'error': '剖析文件不存在'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
+    summary = profiling.load_profile(profile_id)
+    if summary is None:
+        return Response({'error': '剖析记录不存在'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'success': True, 'profile': summary})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_job(request, job_id):
+    """查询处理任务状态"""
+    try:
+        job = ProcessingJob.objects.select_related('document').get(id=job_id)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': '任务不存在'}, status=404)
+    return Response(ProcessingJobSerializer(job).data)